@@ -13,7 +13,8 @@ from typing import TYPE_CHECKING
 # imports from shared
 from patcher.bases import (
     EventHandler, Event, JackPort,
-    PortMode, PortType, ProtoEngine, FullPortName)
+    PortMode, PortType, ProtoEngine, FullPortName, PortRegistry,
+    ConnectionList)
 from osclib import BunServerThread, OscPack, bun_manage
 import osc_paths.ray as r
 import osc_paths.ray.patchbay.monitor as rpm
@@ -46,8 +47,11 @@ class PatchRemote(BunServerThread):
         self.ev = ev_handler
         patchbay_dmn_mng.start(self.url)
         self._patchbay_port = patchbay_dmn_mng.get_port()
-        self.ports = dict[FullPortName, JackPort]()
-        self.connections = list[tuple[FullPortName, FullPortName]]()
+        self.ports = dict[str, JackPort]()
+        'ports keyed by their patchbay daemon name'
+        self.pb_names = dict[FullPortName, list[str]]()
+        'patchbay daemon names of ports, keyed by their ALSA name'
+        self.connections = ConnectionList()
         self.startup_received = False
 
     def send_patchbay(self, *args):
@@ -92,7 +96,7 @@ class PatchRemote(BunServerThread):
         if conn not in self.connections:
             return
 
-        self.connections.remove(conn)
+        del self.connections[conn]
         self.ev.add_event(Event.CONNECTION_REMOVED, *conn)
 
     @bun_manage(rpm.PORT_ADDED, 'siih')
@@ -119,6 +123,7 @@ class PatchRemote(BunServerThread):
         jack_port.id = uuid
 
         self.ports[name] = jack_port
+        self.pb_names.setdefault(jack_port.name, []).append(name)
 
         if self.startup_received:
             self.ev.add_event(
@@ -127,11 +132,15 @@ class PatchRemote(BunServerThread):
     @bun_manage(rpm.PORT_REMOVED, 's')
     def _port_removed(self, osp: OscPack):
         name: str = osp.args[0] # type:ignore
-        jack_port = self.ports.get(name)
+        jack_port = self.ports.pop(name, None)
         if jack_port is None:
             return
         
-        self.ports.pop(name)
+        pb_names = self.pb_names.get(jack_port.name)
+        if pb_names is not None and name in pb_names:
+            pb_names.remove(name)
+            if not pb_names:
+                del self.pb_names[jack_port.name]
         
         self.ev.add_event(Event.PORT_REMOVED, jack_port.name,
                           jack_port.mode, jack_port.type)
@@ -156,8 +165,7 @@ class AlsaEngine(ProtoEngine):
         return True
 
     def fill_ports_and_connections(
-            self, all_ports: dict[PortMode, list[JackPort]],
-            connection_list: list[tuple[str, str]]):
+            self, ports: PortRegistry, connection_list: ConnectionList):
         '''get all current ALSA ports and connections at startup'''
 
         for i in range(100):
@@ -171,32 +179,19 @@ class AlsaEngine(ProtoEngine):
             return
 
         for jack_port in self.remote.ports.values():
-            all_ports[jack_port.mode].append(jack_port)
+            ports.add(jack_port)
                 
-        for conn in self.remote.connections:
-            connection_list.append(conn)                
+        connection_list.extend(self.remote.connections)
 
     def connect_ports(self, port_out: str, port_in: str):
-        for jport_out_name, jport_out in self.remote.ports.items():
-            if jport_out.name != port_out:
-                continue
-            
-            for jport_in_name, jport_in in self.remote.ports.items():
-                if jport_in.name != port_in:
-                    continue
-                
+        for jport_out_name in self.remote.pb_names.get(port_out, ()):
+            for jport_in_name in self.remote.pb_names.get(port_in, ()):
                 self.remote.send_patchbay(
                     r.patchbay.CONNECT, jport_out_name, jport_in_name)
 
     def disconnect_ports(self, port_out: str, port_in: str):
-        for jport_out_name, jport_out in self.remote.ports.items():
-            if jport_out.name != port_out:
-                continue
-            
-            for jport_in_name, jport_in in self.remote.ports.items():
-                if jport_in.name != port_in:
-                    continue
-                
+        for jport_out_name in self.remote.pb_names.get(port_out, ()):
+            for jport_in_name in self.remote.pb_names.get(port_in, ()):
                 self.remote.send_patchbay(
                     r.patchbay.DISCONNECT, jport_out_name, jport_in_name)
 
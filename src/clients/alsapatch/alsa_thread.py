@@ -2,7 +2,7 @@
 # Imports from standard library
 from dataclasses import dataclass
 import time
-from typing import TYPE_CHECKING, Iterator, Optional
+from typing import TYPE_CHECKING, Iterator, Optional, TypeAlias
 from threading import Thread
 
 # third party imports
@@ -31,6 +31,12 @@ from patcher.bases import Glob, EventHandler, Event, PortMode, PortType
 _PORT_READS = SEQ_PORT_CAP_READ | SEQ_PORT_CAP_SUBS_READ
 _PORT_WRITES = SEQ_PORT_CAP_WRITE | SEQ_PORT_CAP_SUBS_WRITE
 
+PortAddr: TypeAlias = tuple[int, int]
+'ALSA port address (client_id, port_id)'
+
+ConnAddr: TypeAlias = tuple[PortAddr, PortAddr]
+'ALSA connection (source port address, dest port address)'
+
 
 @dataclass
 class AlsaPort:
@@ -40,32 +46,6 @@ class AlsaPort:
     physical: bool
 
 
-@dataclass
-class AlsaConn:
-    source_client_id: int
-    source_port_id: int
-    dest_client_id: int
-    dest_port_id: int
-    
-    def as_port_names(
-            self, clients: dict[int, 'AlsaClient']) -> \
-                Optional[tuple[str, str]]:
-        src_client = clients.get(self.source_client_id)
-        dest_client = clients.get(self.dest_client_id)
-        
-        if src_client is None or dest_client is None:
-            return None
-        
-        src_port = src_client.ports.get(self.source_port_id)
-        dest_port = dest_client.ports.get(self.dest_port_id)
-        
-        if src_port is None or dest_port is None:
-            return None
-        
-        return (f"{src_client.name}:{src_port.name}",
-                f"{dest_client.name}:{dest_port.name}")
-
-
 class AlsaClient:
     def __init__(self, alsa_mng: 'AlsaManager', name: str, id: int):
         self.alsa_mng = alsa_mng
@@ -93,6 +73,9 @@ class AlsaClient:
         physical = not bool(port_info['type'] & SEQ_PORT_TYPE_APPLICATION)
         self.ports[port_id] = AlsaPort(port_info['name'], port_id, caps, physical)
 
+    def full_port_name(self, port: AlsaPort) -> str:
+        return f'{self.name}:{port.name}'
+
 
 class AlsaManager:
     def __init__(self, event_handler: EventHandler):
@@ -100,10 +83,14 @@ class AlsaManager:
         self.terminate = False
         self.seq = alsaseq.Sequencer(clientname='ray-alsapatch')
 
-        self._all_alsa_connections = list[AlsaConn]()
-        self._connections = list[AlsaConn]()
         self._clients = dict[int, AlsaClient]()
-        self._clients_names = dict[int, str]()
+        self._connections = dict[ConnAddr, tuple[str, str]]()
+        'full port names of connections, resolved once when added'
+        self._port_conns = dict[PortAddr, set[ConnAddr]]()
+        'connections of each port'
+        self._port_addrs = dict[str, list[PortAddr]]()
+        '''addresses of ports by full port name,
+        several ALSA clients can have the same name'''
 
         self._stopping = False
         self._event_thread = Thread(target=self.read_events)
@@ -123,108 +110,141 @@ class AlsaManager:
         self.get_the_graph()
         self._event_thread.start()
 
+    def _add_port(
+            self, client: AlsaClient, port_id: int) -> Optional[AlsaPort]:
+        client.add_port(port_id)
+        port = client.ports.get(port_id)
+        if port is None:
+            return None
+
+        port_addrs = self._port_addrs.setdefault(
+            client.full_port_name(port), [])
+        if (client.id, port_id) not in port_addrs:
+            port_addrs.append((client.id, port_id))
+        return port
+
+    def _remove_port(
+            self, client: AlsaClient, port_id: int) -> Optional[AlsaPort]:
+        port = client.ports.pop(port_id, None)
+        if port is None:
+            return None
+
+        full_port_name = client.full_port_name(port)
+        port_addrs = self._port_addrs.get(full_port_name)
+        if port_addrs is not None and (client.id, port_id) in port_addrs:
+            port_addrs.remove((client.id, port_id))
+            if not port_addrs:
+                del self._port_addrs[full_port_name]
+        return port
+
+    def _full_port_name(self, port_addr: PortAddr) -> Optional[str]:
+        client = self._clients.get(port_addr[0])
+        if client is None:
+            return None
+
+        port = client.ports.get(port_addr[1])
+        if port is None:
+            return None
+
+        return client.full_port_name(port)
+
+    def _add_connection(self, conn: ConnAddr) -> Optional[tuple[str, str]]:
+        '''index the connection if its ports are known.
+        Return its full port names if it was not already present.'''
+        if conn in self._connections:
+            return None
+
+        src_name = self._full_port_name(conn[0])
+        dest_name = self._full_port_name(conn[1])
+        if src_name is None or dest_name is None:
+            return None
+
+        port_names = (src_name, dest_name)
+        self._connections[conn] = port_names
+        for port_addr in conn:
+            self._port_conns.setdefault(port_addr, set()).add(conn)
+        return port_names
+
+    def _remove_connection(
+            self, conn: ConnAddr) -> Optional[tuple[str, str]]:
+        '''Return full port names of the connection if it was present'''
+        port_names = self._connections.pop(conn, None)
+        if port_names is None:
+            return None
+
+        for port_addr in conn:
+            port_conns = self._port_conns.get(port_addr)
+            if port_conns is not None:
+                port_conns.discard(conn)
+                if not port_conns:
+                    del self._port_conns[port_addr]
+        return port_names
+
+    def _add_port_events(self, event: Event, client: AlsaClient,
+                         port: AlsaPort):
+        if port.caps & _PORT_READS == _PORT_READS:
+            self.ev_handler.add_event(
+                event, client.full_port_name(port),
+                PortMode.OUTPUT, PortType.MIDI)
+        if port.caps & _PORT_WRITES == _PORT_WRITES:
+            self.ev_handler.add_event(
+                event, client.full_port_name(port),
+                PortMode.INPUT, PortType.MIDI)
+
     def get_the_graph(self):
         if self.seq is None:
             return
         
         clients = self.seq.connection_list()
         
-        self._clients_names.clear()
         self._clients.clear()
-        self._all_alsa_connections.clear()
+        self._connections.clear()
+        self._port_conns.clear()
+        self._port_addrs.clear()
+
+        all_conns = list[ConnAddr]()
 
         for client in clients:
             client_name, client_id, port_list = client
-            self._clients_names[client_id] = client_name
-            self._clients[client_id] = AlsaClient(
-                self, client_name, client_id)
+            alsa_client = AlsaClient(self, client_name, client_id)
+            self._clients[client_id] = alsa_client
             for port_name, port_id, connection_list in port_list:
-                self._clients[client_id].add_port(port_id)
+                self._add_port(alsa_client, port_id)
       
                 connections = connection_list[0]
                 for connection in connections:
                     conn_client_id, conn_port_id = connection[:2]                    
-                    self._all_alsa_connections.append(
-                        AlsaConn(client_id, port_id,
-                                 conn_client_id, conn_port_id))
+                    all_conns.append(
+                        ((client_id, port_id),
+                         (conn_client_id, conn_port_id)))
                     
-        for conn in self._all_alsa_connections:
-            source_client = self._clients.get(conn.source_client_id)
-            dest_client = self._clients.get(conn.dest_client_id)
-            if source_client is None or dest_client is None:
-                continue
-            
-            source_port = source_client.ports.get(conn.source_port_id)
-            dest_port = dest_client.ports.get(conn.dest_port_id)
-            
-            if source_port is None or dest_port is None:
-                continue
-            
-            self._connections.append(conn)
+        # connections can be indexed only once all ports are known
+        for conn in all_conns:
+            self._add_connection(conn)
             
         for client in self._clients.values():
             for port in client.ports.values():
-                if port.caps & _PORT_READS == _PORT_READS:
-                    self.ev_handler.add_event(
-                        Event.PORT_ADDED, f'{client.name}:{port.name}',
-                        PortMode.OUTPUT, PortType.MIDI)
-                if port.caps & _PORT_WRITES == _PORT_WRITES:
-                    self.ev_handler.add_event(
-                        Event.PORT_ADDED, f'{client.name}:{port.name}',
-                        PortMode.INPUT, PortType.MIDI)
-
-        for conn in self._connections:
-            port_names = conn.as_port_names(self._clients)
-            if port_names is not None:
-                self.ev_handler.add_event(
-                    Event.CONNECTION_ADDED, *port_names)
+                self._add_port_events(Event.PORT_ADDED, client, port)
+
+        for port_names in self._connections.values():
+            self.ev_handler.add_event(Event.CONNECTION_ADDED, *port_names)
     
     def parse_connections(self) -> Iterator[tuple[str, str]]:
-        for conn in self._connections:
-            src_client = self._clients.get(conn.source_client_id)
-            dest_client = self._clients.get(conn.dest_client_id)
-            if src_client is None or dest_client is None:
-                continue
-            
-            src_port = src_client.ports.get(conn.source_port_id)
-            dest_port = dest_client.ports.get(conn.dest_port_id)
-            
-            if src_port is None or dest_port is None:
-                continue
-            
-            yield (f'{src_client.name}:{src_port.name}',
-                   f'{dest_client.name}:{dest_port.name}')
+        yield from self._connections.values()
     
     def connect_ports(self, port_out_name: str, port_in_name: str,
                       disconnect=False):
-        src_client_name, _, src_port_name = port_out_name.partition(':')
-        dest_client_name, _, dest_port_name = port_in_name.partition(':')
-
-        src_clients = [c for c in self._clients.values() if c.name == src_client_name]
-        dest_clients = [c for c in self._clients.values() if c.name == dest_client_name]
-        
-        if not (src_clients and dest_clients):
-            return
-        
-        for src_client in src_clients:
-            for src_port_id, src_port in src_client.ports.items():
-                if src_port.name == src_port_name:
-                    for dest_client in dest_clients:
-                        for dest_port_id, dest_port in dest_client.ports.items():
-                            if dest_port.name == dest_port_name:
-                                try:
-                                    if disconnect:
-                                        self.seq.disconnect_ports(
-                                            (src_client.id, src_port_id),
-                                            (dest_client.id, dest_port_id))
-                                    else: 
-                                        self.seq.connect_ports(
-                                            (src_client.id, src_port_id),
-                                            (dest_client.id, dest_port_id),
-                                            0, 0, 0, 0)
-                                except:
-                                    # TODO log something
-                                    continue
+        for src_addr in self._port_addrs.get(port_out_name, ()):
+            for dest_addr in self._port_addrs.get(port_in_name, ()):
+                try:
+                    if disconnect:
+                        self.seq.disconnect_ports(src_addr, dest_addr)
+                    else:
+                        self.seq.connect_ports(
+                            src_addr, dest_addr, 0, 0, 0, 0)
+                except:
+                    # TODO log something
+                    continue
         
     def read_events(self):
         while True:
@@ -273,6 +293,14 @@ class AlsaManager:
                     if client is not None:
                         # EventHandler.add_event(
                         #     Event.CLIENT_REMOVED, self._clients[client_id].name)
+
+                        # ports have normally exited before,
+                        # clean the indexes in case they did not.
+                        for port_id in list(client.ports):
+                            for conn in list(self._port_conns.get(
+                                    (client_id, port_id), ())):
+                                self._remove_connection(conn)
+                            self._remove_port(client, port_id)
                         del self._clients[client_id]
                     
                 elif event.type == SEQ_EVENT_PORT_START:
@@ -281,19 +309,11 @@ class AlsaManager:
                     if client is None:
                         continue
                     
-                    client.add_port(port_id)
-                    port = client.ports.get(port_id)
+                    port = self._add_port(client, port_id)
                     if port is None:
                         continue
                     
-                    if port.caps & _PORT_READS == _PORT_READS:
-                        self.ev_handler.add_event(
-                            Event.PORT_ADDED, f'{client.name}:{port.name}',
-                            PortMode.OUTPUT, PortType.MIDI)
-                    if port.caps & _PORT_WRITES == _PORT_WRITES:
-                        self.ev_handler.add_event(
-                            Event.PORT_ADDED, f'{client.name}:{port.name}',
-                            PortMode.INPUT, PortType.MIDI)
+                    self._add_port_events(Event.PORT_ADDED, client, port)
                     
                 elif event.type == SEQ_EVENT_PORT_EXIT:
                     client_id, port_id = data['addr.client'], data['addr.port']
@@ -301,80 +321,42 @@ class AlsaManager:
                     if client is None:
                         continue
 
-                    port = client.ports.get(port_id)
-                    if port is None:
+                    if port_id not in client.ports:
                         continue
                     
-                    to_rm_conns = list[AlsaConn]()
-                    
-                    for conn in self._connections:
-                        if (client_id, port_id) in ((conn.source_client_id, conn.source_port_id),
-                                                    (conn.dest_client_id, conn.dest_port_id)):
-                            to_rm_conns.append(conn)
-                            
-                    for conn in to_rm_conns:
-                        self._connections.remove(conn)
-                        port_names = conn.as_port_names(self._clients)
+                    for conn in list(self._port_conns.get(
+                            (client_id, port_id), ())):
+                        port_names = self._remove_connection(conn)
                         if port_names is not None:
                             self.ev_handler.add_event(
                                 Event.CONNECTION_REMOVED, *port_names)
 
-                    if port.caps & _PORT_READS == _PORT_READS:
-                        self.ev_handler.add_event(
-                            Event.PORT_REMOVED, f'{client.name}:{port.name}',
-                            PortMode.OUTPUT, PortType.MIDI)
-                    if port.caps & _PORT_WRITES == _PORT_WRITES:
-                        self.ev_handler.add_event(
-                            Event.PORT_REMOVED, f'{client.name}:{port.name}',
-                            PortMode.INPUT, PortType.MIDI)
+                    port = self._remove_port(client, port_id)
+                    if port is not None:
+                        self._add_port_events(
+                            Event.PORT_REMOVED, client, port)
 
                 elif event.type == SEQ_EVENT_PORT_SUBSCRIBED:
-                    sender_client = self._clients.get(data['connect.sender.client'])
-                    dest_client = self._clients.get(data['connect.dest.client'])
-                    if sender_client is None or dest_client is None:
-                        continue
-                    
-                    sender_port = sender_client.ports.get(data['connect.sender.port'])
-                    dest_port = dest_client.ports.get(data['connect.dest.port'])
-                    
-                    if sender_port is None or dest_port is None:
-                        continue
-                    
-                    alsa_conn = AlsaConn(
-                        sender_client.id, sender_port.id,
-                        dest_client.id, dest_port.id)
-                    
-                    self._connections.append(alsa_conn)
-                    
-                    port_names = alsa_conn.as_port_names(self._clients)
+                    port_names = self._add_connection(
+                        ((data['connect.sender.client'],
+                          data['connect.sender.port']),
+                         (data['connect.dest.client'],
+                          data['connect.dest.port'])))
                     
                     if port_names is not None:
                         self.ev_handler.add_event(
                             Event.CONNECTION_ADDED, *port_names)
 
                 elif event.type == SEQ_EVENT_PORT_UNSUBSCRIBED:
-                    sender_client = self._clients.get(data['connect.sender.client'])
-                    dest_client = self._clients.get(data['connect.dest.client'])
-                    if sender_client is None or dest_client is None:
-                        continue
-
-                    sender_port = sender_client.ports.get(data['connect.sender.port'])
-                    dest_port = dest_client.ports.get(data['connect.dest.port'])
-
-                    if sender_port is None or dest_port is None:
-                        continue
+                    port_names = self._remove_connection(
+                        ((data['connect.sender.client'],
+                          data['connect.sender.port']),
+                         (data['connect.dest.client'],
+                          data['connect.dest.port'])))
 
-                    for conn in self._connections:
-                        if (conn.source_client_id == sender_client.id
-                                and conn.source_port_id == sender_port.id
-                                and conn.dest_client_id == dest_client.id
-                                and conn.dest_port_id == dest_port.id):
-                            port_names = conn.as_port_names(self._clients)
-                            if port_names is not None:
-                                self.ev_handler.add_event(
-                                    Event.CONNECTION_REMOVED, *port_names)
-                            self._connections.remove(conn)
-                            break
+                    if port_names is not None:
+                        self.ev_handler.add_event(
+                            Event.CONNECTION_REMOVED, *port_names)
                         
     def stop(self):
         self.terminate = True
@@ -1,6 +1,7 @@
 
 # Imports from standard library
 import logging
+import time
 from typing import Optional
 
 # Third party
@@ -9,7 +10,7 @@ import jack
 # imports from shared
 from patcher.bases import (
     EventHandler, Event, JackPort,
-    PortMode, PortType, ProtoEngine)
+    PortMode, PortType, ProtoEngine, PortRegistry, ConnectionList)
 
 
 _logger = logging.getLogger(__name__)
@@ -31,6 +32,15 @@ def mode_type(port: jack.Port) -> tuple[PortMode, PortType]:
     return port_mode, port_type
 
 
+def port_type_of(port: jack.Port) -> PortType:
+    # get_ports already checked the port type to create a MidiPort
+    if isinstance(port, jack.MidiPort):
+        return PortType.MIDI
+    if port.is_audio:
+        return PortType.AUDIO
+    return PortType.NULL
+
+
 class JackEngine(ProtoEngine):
     def __init__(self, event_handler: EventHandler):
         super().__init__(event_handler)
@@ -72,24 +82,49 @@ class JackEngine(ProtoEngine):
         return True
 
     def fill_ports_and_connections(
-            self, all_ports: dict[PortMode, list[JackPort]],
-            connection_list: list[tuple[str, str]]):
-        '''get all current JACK ports and connections at startup'''
+            self, ports: PortRegistry, connection_list: ConnectionList):
+        '''get all current JACK ports and connections at startup.
+        
+        JACK has no call giving all connections at once, connections
+        are asked port by port, only for ports of the mode with fewer
+        ports, each connection having one port of each mode.'''
         if self._client is None:
             return
         
-        for port in self._client.get_ports():
-            jack_port = JackPort()
-            jack_port.name = port.name
-            port_mode, port_type = mode_type(port)
-            jack_port.mode = port_mode
-            jack_port.type = port_type
-            jack_port.is_new = True
-            all_ports[jack_port.mode].append(jack_port)
-            
-            if jack_port.mode is PortMode.OUTPUT:
-                for oth_port in self._client.get_all_connections(port):
-                    connection_list.append((jack_port.name, oth_port.name))
+        start = time.perf_counter()
+        
+        # one get_ports call per mode, so the mode is not asked
+        # for each port.
+        mode_ports = dict[PortMode, list[jack.Port]]()
+        for port_mode in (PortMode.OUTPUT, PortMode.INPUT):
+            mode_ports[port_mode] = self._client.get_ports(
+                is_input=port_mode is PortMode.INPUT,
+                is_output=port_mode is PortMode.OUTPUT)
+            for port in mode_ports[port_mode]:
+                ports.add(JackPort(
+                    port.name, port_mode, port_type_of(port), True))
+
+        n_calls = 2
+        if (len(mode_ports[PortMode.OUTPUT])
+                <= len(mode_ports[PortMode.INPUT])):
+            for port in mode_ports[PortMode.OUTPUT]:
+                port_name = port.name
+                connection_list.extend(
+                    (port_name, in_port.name) for in_port
+                    in self._client.get_all_connections(port))
+                n_calls += 1
+        else:
+            for port in mode_ports[PortMode.INPUT]:
+                port_name = port.name
+                connection_list.extend(
+                    (out_port.name, port_name) for out_port
+                    in self._client.get_all_connections(port))
+                n_calls += 1
+
+        _logger.info(
+            f'{len(ports)} ports and {len(connection_list)} connections '
+            f'got with {n_calls} JACK client calls '
+            f'in {time.perf_counter() - start:.3f}s')
 
     def connect_ports(self, port_out: str, port_in: str):
         if self._client is None:
@@ -13,7 +13,8 @@ from typing import TYPE_CHECKING
 # imports from shared
 from patcher.bases import (
     EventHandler, Event, JackPort,
-    PortMode, PortType, ProtoEngine, FullPortName)
+    PortMode, PortType, ProtoEngine, FullPortName, PortRegistry,
+    ConnectionList)
 from osclib import BunServerThread, OscPack, bun_manage
 import osc_paths.ray as r
 import osc_paths.ray.patchbay.monitor as rpm
@@ -45,8 +46,8 @@ class PatchRemote(BunServerThread):
         self.add_managed_methods()
         self.ev = ev_handler
         patchbay_dmn_mng.start(self.url)
-        self.ports = dict[FullPortName, JackPort]()
-        self.connections = list[tuple[FullPortName, FullPortName]]()
+        self.ports = PortRegistry()
+        self.connections = ConnectionList()
         self.startup_received = False
 
     def send_patchbay(self, *args):
@@ -82,7 +83,7 @@ class PatchRemote(BunServerThread):
         if conn not in self.connections:
             return
 
-        self.connections.remove(conn)
+        del self.connections[conn]
         self.ev.add_event(Event.CONNECTION_REMOVED, *conn)
 
     @bun_manage(rpm.PORT_ADDED, 'siih')
@@ -105,7 +106,7 @@ class PatchRemote(BunServerThread):
         jack_port.mode = mode
         jack_port.id = uuid
 
-        self.ports[name] = jack_port
+        self.ports.add(jack_port)
 
         if self.startup_received:
             self.ev.add_event(Event.PORT_ADDED, name, mode, port_type)
@@ -113,12 +114,10 @@ class PatchRemote(BunServerThread):
     @bun_manage(rpm.PORT_REMOVED, 's')
     def _port_removed(self, osp: OscPack):
         name: str = osp.args[0] # type:ignore
-        jack_port = self.ports.get(name)
+        jack_port = self.ports.pop(name)
         if jack_port is None:
             return
         
-        self.ports.pop(name)
-        
         self.ev.add_event(Event.PORT_REMOVED, name,
                           jack_port.mode, jack_port.type)
     
@@ -127,12 +126,9 @@ class PatchRemote(BunServerThread):
         old: str = osp.args[0] # type:ignore
         new: str = osp.args[1] # type:ignore
         
-        jack_port = self.ports.get(old)
+        jack_port = self.ports.rename(old, new)
         if jack_port is None:
             return
-        
-        jack_port.name = new
-        self.ports[new] = self.ports.pop(old)
 
         self.ev.add_event(Event.PORT_RENAMED, old, new,
                           jack_port.mode, jack_port.type)
@@ -161,8 +157,7 @@ class JackEngine(ProtoEngine):
         return True
 
     def fill_ports_and_connections(
-            self, all_ports: dict[PortMode, list[JackPort]],
-            connection_list: list[tuple[str, str]]):
+            self, ports: PortRegistry, connection_list: ConnectionList):
         '''get all current JACK ports and connections at startup'''
 
         for i in range(100):
@@ -175,11 +170,10 @@ class JackEngine(ProtoEngine):
                 'will quit.')
             return
 
-        for jack_port in self.remote.ports.values():
-            all_ports[jack_port.mode].append(jack_port)
+        for jack_port in self.remote.ports:
+            ports.add(jack_port)
                 
-        for conn in self.remote.connections:
-            connection_list.append(conn)                
+        connection_list.extend(self.remote.connections)
 
     def connect_ports(self, port_out: str, port_in: str):
         self.remote.send_patchbay(r.patchbay.CONNECT, port_out, port_in)
@@ -5,7 +5,7 @@ import sys
 
 from arg_lines import (
     CLIENT_PROPS, HELP_ARGS, FIRST_ARG, SERVER_OPTIONS, YESNO,
-    ADD_EXEC_OPS, LIST_CLIENTS_FILTERS,
+    ADD_EXEC_OPS, LIST_CLIENTS_FILTERS, OSC_STATS_OPS,
     CLIENT_ARG, TRASHED_CLIENT_ARG)
 
 MULTI_DAEMON_FILE = Path('/tmp/RaySession/multi-daemon.json')
@@ -163,6 +163,10 @@ def complete_control(comp_words: list[str]) -> str:
         case 'auto_export_custom_names':
             if len(comp_words) == 2:
                 return YESNO
+
+        case 'osc_stats':
+            if len(comp_words) == 2:
+                return OSC_STATS_OPS
         
         case 'save_as_template':
             if len(comp_words) == 2:
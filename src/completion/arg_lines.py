@@ -42,6 +42,7 @@ auto_export_custom_names
 export_custom_names
 import_pretty_names
 clear_pretty_names
+osc_stats
 save
 save_as_template
 take_snapshot
@@ -70,6 +71,11 @@ session_scripts
 gui_states
 """
 
+OSC_STATS_OPS = """
+stop
+reset
+"""
+
 YESNO = """
 yes
 no
@@ -80,7 +80,8 @@ SERVER_OPERATIONS = (
     'auto_export_custom_names',
     'export_custom_names',
     'import_pretty_names',
-    'clear_pretty_names')
+    'clear_pretty_names',
+    'osc_stats')
 
 
 def signal_handler(sig, frame):
@@ -477,6 +478,8 @@ if True:
 
     if operation_type is OperationType.CONTROL and operation == 'stop':
         osc_order_path = r.server.QUIT
+    elif operation_type is OperationType.SERVER and operation == 'osc_stats':
+        osc_order_path = r.server.GET_STATS
 
     from osc_server import OscServer  # see top of the file
     server = OscServer(detach)
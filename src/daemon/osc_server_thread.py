@@ -9,10 +9,11 @@ import subprocess
 import time
 from typing import TYPE_CHECKING, Callable, Optional
 from pathlib import Path
+from threading import current_thread, main_thread
 import xml.etree.ElementTree as ET
 
 # third party imports
-from qtpy.QtCore import QCoreApplication
+from qtpy.QtCore import QCoreApplication, Qt
 
 # Imports from HoustonPatchbay
 from patshared import GroupPos, Naming
@@ -522,6 +523,8 @@ class OscServerThread(ClientCommunicating):
         self.add_nice_methods(METHODS_DICT, self.generic_method)
         self.add_nice_methods(_validators_types, self.generic_method)
         self.add_method(None, None, self.noneMethod) # type:ignore
+        signaler.osc_flush.connect(
+            self.flush_coalesced, Qt.ConnectionType.QueuedConnection)
         global instance
         instance = self
 
@@ -583,12 +586,14 @@ class OscServerThread(ClientCommunicating):
 
         multi_daemon_file.update()
 
-    @validator(r.server.ASK_FOR_PATCHBAY, 's')
+    @validator(r.server.ASK_FOR_PATCHBAY, 's|sii')
     def _srv_ask_for_patchbay(self, osp: OscPack):
         patchbay_dmn_port = patchbay_dmn_mng.get_port()
         if isinstance(patchbay_dmn_port, int):
+            # graph id and sequence known by the GUI, if any
             self.send(
-                patchbay_dmn_port, r.patchbay.ADD_GUI, osp.src_addr.url)
+                patchbay_dmn_port, r.patchbay.ADD_GUI, osp.src_addr.url,
+                *osp.args[1:])
             return False
 
         # continue in main thread if patchbay_to_osc is not started yet
@@ -634,6 +639,23 @@ class OscServerThread(ClientCommunicating):
         self.monitor_list.remove(monitor_addr)
         self.send(*osp.reply(), 'monitor exit')
 
+    @directos(r.server.GET_STATS, '|s')
+    def _srv_get_stats(self, osp: OscPack):
+        action = osp.args[0] if osp.args else ''
+        
+        if action == 'stop':
+            self.enable_stats(False)
+            lines = ['OSC stats recording stopped']
+        elif action == 'reset' or self.stats is None:
+            self.enable_stats()
+            lines = ['OSC stats recording started']
+        else:
+            lines = self.stats.lines()
+        
+        for i in range(0, len(lines), 20):
+            self.send(*osp.reply(), *lines[i:i+20])
+        self.send(*osp.reply())
+
     @directos(r.server.SET_NSM_LOCKED, '')
     def _srv_set_nsm_locked(self, osp: OscPack):
         self.is_nsm_locked = True
@@ -1235,7 +1257,23 @@ class OscServerThread(ClientCommunicating):
         _logger.debug(f'\033[96mdaemon sends\033[0m {args[1:]}')        
         ClientCommunicating.send(self, *args)
 
+    def _schedule_flush(self):
+        if current_thread() is main_thread():
+            # many messages can be sent to GUIs in the same iteration
+            # of the main loop, send them together at the end.
+            signaler.osc_flush.emit()
+            return
+        super()._schedule_flush()
+
     def send_gui(self, *args):
+        _logger.debug(f'\033[96mdaemon sends to GUIs\033[0m {args}')
+        for gui in self.gui_list:
+            self.send_coalesced(gui.addr, *args)
+
+    def send_gui_now(self, *args):
+        '''send to GUIs without coalescing,
+        for messages that can not wait the next flush.'''
+        _logger.debug(f'\033[96mdaemon sends now to GUIs\033[0m {args}')
         for gui in self.gui_list:
             self.send(gui.addr, *args)
 
@@ -87,6 +87,16 @@ class ServerSender:
 
         server.send_gui(*args)
 
+    def send_gui_now(self, *args):
+        if self.is_dummy:
+            return
+
+        server = OscServerThread.get_instance()
+        if not server:
+            return
+
+        server.send_gui_now(*args)
+
     def send_gui_message(self, message:str):
         self.send_gui(rg.server.MESSAGE, message)
 
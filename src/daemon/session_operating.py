@@ -1674,7 +1674,7 @@ for better organization.""")
         self._set_path(None)
         self.message("Bye Bye...")
         self._send_reply("Bye Bye...")
-        self.send_gui(rg.server.DISANNOUNCE)
+        self.send_gui_now(rg.server.DISANNOUNCE)
         QCoreApplication.quit()
 
     def add_client_template(self, src_addr, src_path,
@@ -208,8 +208,21 @@ class SignaledSession(OperatingSession):
             pass
 
     def osc_receive(self, osp: OscPack):
-        if osp.path in _managed_funcs:
-            _managed_funcs[osp.path](self, osp)
+        func = _managed_funcs.get(osp.path)
+        if func is None:
+            return
+        
+        if not osp.recv_time:
+            func(self, osp)
+            return
+        
+        # OSC stats are enabled, record the hand-off to the main thread
+        start = time.perf_counter()
+        func(self, osp)
+        server = self.get_server_even_dummy()
+        if server is not None and server.stats is not None:
+            server.stats.record_main_thread(
+                osp.path, start - osp.recv_time, time.perf_counter() - start)
 
     def send_error_no_client(self, osp: OscPack, client_id: str):
         self.send(*osp.error(), ray.Err.CREATE_FAILED,
@@ -356,7 +369,7 @@ class SignaledSession(OperatingSession):
         server.announce_gui(
             osp.src_addr.url, nsm_locked, is_net_free, gui_pid, None)
 
-    @manage(r.server.ASK_FOR_PATCHBAY, 's')
+    @manage(r.server.ASK_FOR_PATCHBAY, 's|sii')
     def _ray_server_ask_for_patchbay(self, osp: OscPack):        
         # if we are here, it means that we need a patchbay daemon to run
         patchbay_dmn_mng.start(osp.src_addr.url)
@@ -10,6 +10,11 @@ class Signaler(QObject):
     Then, the function associated with the OSC path in session_signaled
     will be executed in the main thread.'''
     
+    osc_flush = Signal()
+    '''Emitted with a queued connection when messages are sent
+    with `send_coalesced` from the main thread. They are flushed
+    at the end of the current main loop iteration.'''
+    
     dummy_load_and_template = Signal(str, str, str)
     patchbay_finished = Signal()
 
@@ -206,7 +206,9 @@ class DaemonManager(QObject):
             self.main_win.waiting_for_patchbay = False
             server = GuiServerThread.instance()
             if server is not None:
-                server.to_daemon(r.server.ASK_FOR_PATCHBAY, '')
+                server.to_daemon(
+                    r.server.ASK_FOR_PATCHBAY,
+                    *self.session.patchbay_manager.ask_for_patchbay_args())
 
         self.signaler.daemon_announce_ok.emit()
         self.session.set_daemon_options(options)
@@ -223,6 +225,12 @@ class DaemonManager(QObject):
             if server is not None:
                 server.disannounce(address)
 
+            if (self.main_win is not None
+                    and self.main_win.ui.actionShowJackPatchbay.isChecked()):
+                # ask again for the patchbay at next daemon announce,
+                # with the graph sequence known.
+                self.main_win.waiting_for_patchbay = True
+
         self._port = None
         self.url = ''
         del self.address
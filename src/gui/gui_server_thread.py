@@ -73,6 +73,7 @@ METHODS_DICT = {
     rpm.SERVER_STOPPED: '',
     rpm.METADATA_UPDATED: 'hss',
     rpm.DSP_LOAD: 'i',
+    rpm.GRAPH_SEQUENCE: 'ii',
     rpm.ADD_XRUN: '',
     rpm.BUFFER_SIZE: 'i',
     rpm.SAMPLE_RATE: 'i',
@@ -158,6 +159,8 @@ class GuiServerThread(BunServerThread):
         self.signaler = session.signaler
         self.daemon_manager = session.daemon_manager
         self.session = session
+        # manage startup messages now, not at next received message
+        self.wake()
 
     @staticmethod
     def instance():
@@ -256,7 +259,8 @@ class GuiServerThread(BunServerThread):
         if (self.session is not None
                 and self.session.main_win is not None
                 and self.session.main_win.waiting_for_patchbay):
-            self.send(osp.src_addr, r.server.ASK_FOR_PATCHBAY, '')
+            self.send(osp.src_addr, r.server.ASK_FOR_PATCHBAY,
+                      *self.session.patchbay_manager.ask_for_patchbay_args())
             self.session.main_win.waiting_for_patchbay = False
 
         if self.signaler is not None:
@@ -664,6 +664,11 @@ class SignaledSession(Session):
     def _patchbay_server_lose(self, osp: OscPack):
         self.patchbay_manager.server_lose()
 
+    @manage(rpm.GRAPH_SEQUENCE, 'ii')
+    def _patchbay_graph_sequence(self, osp: OscPack):
+        args: tuple[int, int] = osp.args # type:ignore
+        self.patchbay_manager.graph_sequence = args
+
     @manage(rpm.DSP_LOAD, 'i')
     def _patchbay_dsp_load(self, osp: OscPack):
         dsp_load: int = osp.args[0] # type:ignore
@@ -862,7 +862,9 @@ class MainWindow(QMainWindow):
         height = rect.height()
 
         if yesno:
-            self.to_daemon(r.server.ASK_FOR_PATCHBAY, '')
+            self.to_daemon(
+                r.server.ASK_FOR_PATCHBAY,
+                *self.session.patchbay_manager.ask_for_patchbay_args())
 
             patchbay_geom = RS.settings.value('MainWindow/patchbay_geometry')
             sizes = RS.settings.value('MainWindow/splitter_canvas_sizes')
@@ -1750,6 +1752,7 @@ class MainWindow(QMainWindow):
         if CommandLineArgs.under_nsm:
             if self.session.nsm_child is not None:
                 self.session.nsm_child.send_gui_state(True)
+        self.session.patchbay_manager.main_win_visibility_changed(True)
         QMainWindow.showEvent(self, event)
 
     def hideEvent(self, event):
@@ -1758,6 +1761,7 @@ class MainWindow(QMainWindow):
         if CommandLineArgs.under_nsm:
             if self.session.nsm_child is not None:
                 self.session.nsm_child.send_gui_state(False)
+        self.session.patchbay_manager.main_win_visibility_changed(False)
         QMainWindow.hideEvent(self, event)
 
     def resizeEvent(self, event):
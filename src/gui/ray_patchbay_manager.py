@@ -24,6 +24,7 @@ from patchbay import (
 import ray
 import xdg
 from jack_renaming_tools import group_belongs_to_client
+from osclib import is_on_this_machine
 import osc_paths.ray as r
 
 # Local imports
@@ -129,6 +130,9 @@ class RayPatchbayManager(PatchbayManager):
         
         self._last_selected_client_name = ''
         self._last_selected_box_n = 1
+        self.graph_sequence = (0, 0)
+        '''graph id and sequence of the last graph change received
+        from the patchbay daemon, (0, 0) if the graph is not known.'''
 
     @staticmethod
     def send_to_patchbay_daemon(*args):
@@ -200,7 +204,24 @@ class RayPatchbayManager(PatchbayManager):
     def disannounce(self):
         self.send_to_patchbay_daemon(
             r.patchbay.GUI_DISANNOUNCE, '')
+
+        if self.graph_sequence[0]:
+            # keep the graph, when the patchbay will be shown again,
+            # the patchbay daemon will send only the changes since.
+            return
         super().disannounce()
+
+    def server_lose(self):
+        self.graph_sequence = (0, 0)
+        super().server_lose()
+
+    def ask_for_patchbay_args(self) -> tuple:
+        '''args of the ask_for_patchbay message to the daemon.
+        If the graph is known, the patchbay daemon will send only
+        the graph changes since the last one received.'''
+        if self.graph_sequence[0]:
+            return ('', *self.graph_sequence)
+        return ('',)
     
     def set_views_changed(self):
         super().set_views_changed()
@@ -363,6 +384,22 @@ class RayPatchbayManager(PatchbayManager):
     def transport_relocate(self, frame: int):
         self.send_to_patchbay_daemon(r.patchbay.TRANSPORT_RELOCATE, frame)
 
+    def main_win_visibility_changed(self, visible: bool):
+        '''transport and DSP load are not needed while the main window
+        is hidden, and are sent at low rate to a distant GUI.'''
+        server = GuiServerThread.instance()
+        if server is None or server.patchbay_addr is None:
+            return
+
+        if not visible:
+            rate = ray.StreamRate.OFF
+        elif is_on_this_machine(server.patchbay_addr.url):
+            rate = ray.StreamRate.FULL
+        else:
+            rate = ray.StreamRate.LOW
+
+        server.send_patchbay_daemon(r.patchbay.STREAMS_RATE, rate.value)
+
     def change_tools_displayed(self, tools_displayed: ToolDisplayed):
         ex_tool_displayed = self._tools_displayed
         super().change_tools_displayed(tools_displayed)
@@ -542,6 +579,12 @@ class RayPatchbayManager(PatchbayManager):
             self.options_dialog.set_pretty_names_locked(bool(locked))
     
     def receive_big_packets(self, state: int):
+        if not state and self.graph_sequence[0]:
+            # the patchbay daemon sends all the graph,
+            # it could not send only the changes since the kept graph.
+            self.graph_sequence = (0, 0)
+            self.clear_all()
+
         if state:
             self._delayed_orders_timer.stop()
             
@@ -573,6 +616,9 @@ class RayPatchbayManager(PatchbayManager):
                           samplerate: int, buffer_size: int, tcp_url: str):
         if self.options_dialog is not None:
             self.options_dialog.enable_alsa_midi(bool(alsa_lib_ok))
+
+        if self.main_win is not None and not self.main_win.isVisible():
+            self.main_win_visibility_changed(False)
         
         if self._tools_widget is None:
             return
@@ -0,0 +1,248 @@
+
+from collections import deque
+from itertools import islice
+import logging
+import random
+from typing import TYPE_CHECKING, Optional
+
+from osclib import MegaSend, OscArg
+import osc_paths.ray.patchbay.monitor as rpm
+
+if TYPE_CHECKING:
+    from patch_engine import PatchEngine
+
+
+_logger = logging.getLogger(__name__)
+
+JOURNAL_SIZE = 4096
+'max number of graph changes a reconnecting GUI can receive as a delta'
+
+
+class GraphSnapshot:
+    '''State of the graph known by the GUIs, and the MegaSend
+    to send to a new GUI.
+
+    It is seeded from the patch engine, then updated with each message
+    sent to GUIs, so it is always the state the connected GUIs know.
+    The MegaSend is built only if the graph changed since the last one,
+    GUIs connecting at the same time share it and its encoding.
+
+    The last changes are kept in a journal, a GUI knowing the graph
+    at a previous version can receive only the changes since it.
+
+    The snapshot is no longer seeded when it can not be sure to have
+    the graph of the patch engine: when JACK stops or is lost (the ALSA
+    graph remains), or when a message removes or renames something
+    it does not know, meaning a change did not go through the GUI
+    messages. It is seeded again from the patch engine at next need.'''
+    def __init__(self):
+        self.seeded = False
+        self.graph_id = 0
+        'changes each time the graph is cleared'
+        self.version = 0
+        'incremented at each graph change, it is the graph sequence'
+        self._ports = dict[str, tuple[int, int, int]]()
+        'port type, flags and uuid by port name'
+        self._client_uuids = dict[str, int]()
+        self._connections = dict[tuple[str, str], None]()
+        self._port_connections = dict[str, set[tuple[str, str]]]()
+        'connections of each port, by port name'
+        self._metadatas = dict[int, dict[str, str]]()
+        self._journal = deque[tuple[int, str, tuple[OscArg, ...]]](
+            maxlen=JOURNAL_SIZE)
+        'version, path and args of the last graph changes'
+        self._mega_send: Optional[MegaSend] = None
+        self._mega_send_version = -1
+
+    def seed(self, pe: 'PatchEngine'):
+        '''replace all the graph with the one of the patch engine'''
+        self.clear()
+
+        for port in pe.ports:
+            self._ports[port.name] = (port.type, port.flags, port.uuid)
+
+        self._client_uuids.update(pe.client_name_uuids)
+
+        for connection in pe.connections:
+            self._add_connection((connection[0], connection[1]))
+
+        for uuid, key_dict in pe.metadatas.items():
+            self._metadatas[uuid] = dict(key_dict)
+
+        if pe.alsa_mng is not None:
+            for port in pe.alsa_mng.parse_ports_and_flags():
+                self._ports[port.name] = (port.type, port.flags, port.uuid)
+
+            for conn in pe.alsa_mng.parse_connections():
+                self._add_connection((conn[0], conn[1]))
+
+        self.seeded = True
+
+    def clear(self):
+        self._ports.clear()
+        self._client_uuids.clear()
+        self._connections.clear()
+        self._port_connections.clear()
+        self._metadatas.clear()
+        self._journal.clear()
+        self.graph_id = random.randint(1, 0x7fffffff)
+        self.version += 1
+
+    def apply(self, path: str, args: tuple[OscArg, ...]):
+        '''update the graph with a message sent to GUIs,
+        messages not changing the graph are ignored.'''
+        if path in (rpm.SERVER_STOPPED, rpm.SERVER_LOSE):
+            # JACK ports and connections are gone, not the ALSA ones.
+            # The patch engine knows what remains.
+            self.clear()
+            self.seeded = False
+            return
+
+        if not self.seeded:
+            # the next seed will read it from the patch engine
+            return
+
+        match path:
+            case rpm.PORT_ADDED:
+                name, type_, flags, uuid = args
+                self._ports[name] = (type_, flags, uuid) # type:ignore
+            case rpm.PORT_RENAMED:
+                ex_name, new_name = args[:2]
+                port = self._ports.pop(ex_name, None) # type:ignore
+                if port is None:
+                    self._unknown_change(path, args)
+                    return
+                if len(args) > 2:
+                    port = (port[0], port[1], args[2])
+                self._ports[new_name] = port # type:ignore
+                self._rename_connections(ex_name, new_name) # type:ignore
+            case rpm.PORT_REMOVED:
+                if self._ports.pop(args[0], None) is None: # type:ignore
+                    self._unknown_change(path, args)
+                    return
+                for conn in self._port_connections.get(
+                        args[0], ()).copy(): # type:ignore
+                    self._remove_connection(conn)
+            case rpm.CLIENT_NAME_AND_UUID:
+                self._client_uuids[args[0]] = args[1] # type:ignore
+            case rpm.CONNECTION_ADDED:
+                self._add_connection((args[0], args[1])) # type:ignore
+            case rpm.CONNECTION_REMOVED:
+                conn: tuple[str, str] = (args[0], args[1]) # type:ignore
+                if conn not in self._connections:
+                    self._unknown_change(path, args)
+                    return
+                self._remove_connection(conn)
+            case rpm.METADATA_UPDATED:
+                uuid, key, value = args
+                if value:
+                    self._metadatas.setdefault(
+                        uuid, {})[key] = value # type:ignore
+                else:
+                    key_dict = self._metadatas.get(uuid) # type:ignore
+                    if key_dict is None or key_dict.pop(key, None) is None:
+                        return
+                    if not key_dict:
+                        del self._metadatas[uuid] # type:ignore
+            case _:
+                return
+
+        self.version += 1
+        self._journal.append((self.version, path, args))
+
+    def _unknown_change(self, path: str, args: tuple[OscArg, ...]):
+        _logger.warning(
+            f'graph snapshot does not know the target of {path} {args}, '
+            'it will be seeded again from the patch engine')
+        self.clear()
+        self.seeded = False
+
+    def _add_connection(self, conn: tuple[str, str]):
+        self._connections[conn] = None
+        for port_name in conn:
+            self._port_connections.setdefault(port_name, set()).add(conn)
+
+    def _remove_connection(self, conn: tuple[str, str]):
+        del self._connections[conn]
+        for port_name in conn:
+            port_conns = self._port_connections.get(port_name)
+            if port_conns is None:
+                continue
+            port_conns.discard(conn)
+            if not port_conns:
+                del self._port_connections[port_name]
+
+    def _rename_connections(self, ex_name: str, new_name: str):
+        port_conns = self._port_connections.get(ex_name)
+        if not port_conns:
+            return
+
+        for conn in port_conns.copy():
+            self._remove_connection(conn)
+            self._add_connection(
+                (new_name if conn[0] == ex_name else conn[0],
+                 new_name if conn[1] == ex_name else conn[1]))
+
+    def mega_send(self) -> MegaSend:
+        '''MegaSend of all the graph, built again only
+        if the graph changed since the last call.
+        
+        Each call returns a MegaSend with a new id, because a GUI
+        ignores a mega send id it already received.'''
+        if (self._mega_send is not None
+                and self._mega_send_version == self.version):
+            # keep messages encoded by the previous send
+            self._mega_send = self._mega_send.renewed()
+            return self._mega_send
+
+        ms = MegaSend('patchbay_ports')
+        ms.add(rpm.BIG_PACKETS, 0)
+
+        for name, (type_, flags, uuid) in self._ports.items():
+            ms.add(rpm.PORT_ADDED, name, type_, flags, uuid)
+
+        for client_name, client_uuid in self._client_uuids.items():
+            ms.add(rpm.CLIENT_NAME_AND_UUID, client_name, client_uuid)
+
+        for connection in self._connections:
+            ms.add(rpm.CONNECTION_ADDED, connection[0], connection[1])
+
+        for uuid, key_dict in self._metadatas.items():
+            for key, value in key_dict.items():
+                ms.add(rpm.METADATA_UPDATED, uuid, key, value)
+
+        ms.add(rpm.BIG_PACKETS, 1)
+        ms.add(rpm.GRAPH_SEQUENCE, self.graph_id, self.version)
+
+        _logger.debug(f'graph snapshot {self.version} built, '
+                      f'{len(ms)} messages')
+        self._mega_send = ms
+        self._mega_send_version = self.version
+        return ms
+
+    def delta(self, graph_id: int, since: int) -> Optional[MegaSend]:
+        '''MegaSend of the graph changes after the version `since`
+        of the graph `graph_id`.
+        
+        Return None if these changes are not all in the journal,
+        or if they are more numerous than the messages of the full graph.'''
+        if graph_id != self.graph_id or since > self.version:
+            return None
+
+        n_changes = self.version - since
+        if n_changes > len(self._journal):
+            return None
+        
+        if n_changes > (len(self._ports) + len(self._client_uuids)
+                        + len(self._connections) + len(self._metadatas)):
+            return None
+
+        ms = MegaSend('patchbay_delta')
+        for _, path, args in islice(
+                self._journal, len(self._journal) - n_changes, None):
+            ms.add(path, *args)
+        ms.add(rpm.GRAPH_SEQUENCE, self.graph_id, self.version)
+
+        _logger.debug(f'graph delta from {since} to {self.version}, '
+                      f'{n_changes} changes')
+        return ms
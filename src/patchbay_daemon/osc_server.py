@@ -1,15 +1,19 @@
 
 import logging
-from typing import TYPE_CHECKING
+import time
+from typing import TYPE_CHECKING, Optional
 
 from patch_engine import ALSA_LIB_OK
 from patshared import TransportWanted
 
-from osclib import (BunServer, Address, MegaSend,
-                    are_same_osc_port, OscPack, bun_manage, OscPath)
+from osclib import (BunServer, Address, MegaSend, OscArg,
+                    are_same_osc_port, is_on_this_machine,
+                    OscPack, bun_manage, OscPath)
+import ray
 import osc_paths.ray as r
 import osc_paths.ray.patchbay.monitor as rpm
 
+from graph_snapshot import GraphSnapshot
 
 if TYPE_CHECKING:
     from patchbay_daemon import PatchEngine
@@ -17,6 +21,39 @@ if TYPE_CHECKING:
 
 _logger = logging.getLogger(__name__)
 
+_LOW_RATE_INTERVALS = {rpm.TRANSPORT_POSITION: 0.5,
+                       rpm.DSP_LOAD: 4.0}
+'min seconds between two messages of a stream to a GUI at low rate'
+
+
+class GuiStreams:
+    '''subscription of a GUI to transport and DSP load messages'''
+    def __init__(self, gui_addr: Address):
+        if is_on_this_machine(gui_addr.url):
+            self.rate = ray.StreamRate.FULL
+        else:
+            self.rate = ray.StreamRate.LOW
+        self.transport_wanted = TransportWanted.FULL
+        self.dsp_wanted = True
+        self.sent_versions = dict[str, int]()
+        'version of the last stream value sent, by path'
+        self.next_sends = dict[str, float]()
+        '`time.monotonic()` value before which nothing is sent, by path'
+
+    def wants(self, path: str) -> bool:
+        if self.rate is ray.StreamRate.OFF:
+            return False
+        if path == rpm.TRANSPORT_POSITION:
+            return self.transport_wanted is not TransportWanted.NO
+        if path == rpm.DSP_LOAD:
+            return self.dsp_wanted
+        return True
+
+    def interval(self, path: str) -> float:
+        if self.rate is ray.StreamRate.LOW:
+            return _LOW_RATE_INTERVALS.get(path, 0.0)
+        return 0.0
+
 
 class PatchbayDaemonServer(BunServer):
     def __init__(self, patch_engine: 'PatchEngine', daemon_port: int):
@@ -28,11 +65,25 @@ class PatchbayDaemonServer(BunServer):
         self.pretty_names = patch_engine.custom_names
         self.gui_list = list[Address]()
         self._tmp_gui_url = ''
+        self._snapshot = GraphSnapshot()
+        self._gui_sequences = dict[str | int, tuple[int, int]]()
+        '''graph id and version of the last graph_sequence sent
+        to each GUI, by destination key'''
+        self._gui_streams = dict[str, GuiStreams]()
+        'stream subscriptions by GUI url'
+        self._stream_values = dict[str, tuple[int, tuple[OscArg, ...]]]()
+        'version and args of the last value of each stream, by path'
+        self._stream_version = 0
+        self.streams_pending = False
+        'True if a stream value waits for the interval of a GUI'
     
-    @bun_manage(r.patchbay.ADD_GUI, 's')
+    @bun_manage(r.patchbay.ADD_GUI, 's|sii')
     def _ray_patchbay_add_gui(self, osp: OscPack):
-        gui_url: str = osp.args[0] # type:ignore
-        self.add_gui(gui_url)
+        if len(osp.args) == 3:
+            gui_url, graph_id, sequence = osp.args
+            self.add_gui(gui_url, graph_id, sequence) # type:ignore
+        else:
+            self.add_gui(osp.args[0]) # type:ignore
 
     @bun_manage(r.patchbay.GUI_DISANNOUNCE, 's')
     def _ray_patchbay_gui_disannounce(self, osp: OscPack):
@@ -41,7 +92,7 @@ class PatchbayDaemonServer(BunServer):
         for gui_addr in self.gui_list:
             if are_same_osc_port(gui_addr, osp.src_addr):
                 # possible because we break the loop
-                self.gui_list.remove(gui_addr)
+                self._remove_gui(gui_addr)
                 break
 
     @bun_manage(r.patchbay.CONNECT, 'ss')
@@ -80,7 +131,13 @@ class PatchbayDaemonServer(BunServer):
 
     @bun_manage(r.patchbay.ACTIVATE_DSP_LOAD, 'i')
     def _ray_patchbay_activate_dsp_load(self, osp: OscPack):
-        self.pe.dsp_wanted = bool(osp.args[0])
+        streams = self._gui_streams_of(osp.src_addr)
+        if streams is None:
+            self.pe.dsp_wanted = bool(osp.args[0])
+            return
+
+        streams.dsp_wanted = bool(osp.args[0])
+        self._update_streams_wanted()
     
     @bun_manage(r.patchbay.ACTIVATE_TRANSPORT, 'i')
     def _ray_patchbay_activate_transport(self, osp: OscPack):
@@ -88,7 +145,30 @@ class PatchbayDaemonServer(BunServer):
             transport_wanted = TransportWanted(osp.args[0])
         except:
             transport_wanted = TransportWanted.FULL
-        self.pe.transport_wanted = transport_wanted
+
+        streams = self._gui_streams_of(osp.src_addr)
+        if streams is None:
+            self.pe.transport_wanted = transport_wanted
+            return
+
+        streams.transport_wanted = transport_wanted
+        self._update_streams_wanted()
+
+    @bun_manage(r.patchbay.STREAMS_RATE, 'i')
+    def _ray_patchbay_streams_rate(self, osp: OscPack):
+        streams = self._gui_streams_of(osp.src_addr)
+        if streams is None:
+            return
+
+        try:
+            streams.rate = ray.StreamRate(osp.args[0])
+        except ValueError:
+            _logger.warning(f'unknown streams rate {osp.args[0]}')
+            return
+
+        self._update_streams_wanted()
+        # a GUI showing again gets the last values now
+        self.flush_streams()
 
     @bun_manage(r.patchbay.GROUP_CUSTOM_NAME, 'sss*')
     def _ray_patchbay_group_pretty_name(self, osp: OscPack):
@@ -167,57 +247,116 @@ class PatchbayDaemonServer(BunServer):
         self._tmp_gui_url = gui_url
 
     def send_gui(self, *args):
-        rm_gui = list[Address]()
+        self._snapshot.apply(args[0], args[1:])
         
+        # messages are sent in bundles at next recv
         for gui_addr in self.gui_list:
-            try:
-                self.send(gui_addr, *args)
-            except OSError:
-                rm_gui.append(gui_addr)
-            except BaseException as e:
-                _logger.warning(str(e))
-        
-        for gui_addr in rm_gui:
-            self.gui_list.remove(gui_addr)
+            self.send_coalesced(gui_addr, *args)
+
+    def _send_coalesced(self, key: str | int, dest: str | int | Address,
+                        messages: list[tuple]):
+        # Each drain of messages to a GUI, whatever the caller,
+        # ends with the graph sequence if it changed. All graph changes
+        # since the last one are in the drained messages.
+        # The GUI gives it back when it asks again for the graph.
+        sequence = self._gui_sequences.get(key)
+        if sequence is not None:
+            new_sequence = (self._snapshot.graph_id, self._snapshot.version)
+            if new_sequence != sequence:
+                self._gui_sequences[key] = new_sequence
+                messages = messages + [(rpm.GRAPH_SEQUENCE, *new_sequence)]
+
+        super()._send_coalesced(key, dest, messages)
+
+    def _coalesced_send_failed(self, dest: Address, error: OSError):
+        if dest in self.gui_list:
+            self._remove_gui(dest)
+
+    def _remove_gui(self, gui_addr: Address):
+        self.gui_list.remove(gui_addr)
+        self._gui_sequences.pop(self._dest_key(gui_addr), None)
+        if self._gui_streams.pop(gui_addr.url, None) is not None:
+            self._update_streams_wanted()
+
+    def _gui_streams_of(self, src_addr: Address) -> Optional[GuiStreams]:
+        for gui_addr in self.gui_list:
+            if are_same_osc_port(gui_addr, src_addr):
+                return self._gui_streams.get(gui_addr.url)
+        return None
+
+    def _update_streams_wanted(self):
+        '''the patch engine produces transport and DSP load values
+        only if at least one GUI wants them'''
+        self.pe.dsp_wanted = any(
+            streams.wants(rpm.DSP_LOAD)
+            for streams in self._gui_streams.values())
+        self.pe.transport_wanted = max(
+            (streams.transport_wanted
+             for streams in self._gui_streams.values()
+             if streams.wants(rpm.TRANSPORT_POSITION)),
+            key=lambda transport_wanted: transport_wanted.value,
+            default=TransportWanted.NO)
+
+    def stream_interval(self, path: str) -> Optional[float]:
+        '''shortest interval in seconds between two messages
+        of the stream `path` wanted by a GUI, None if no GUI wants it'''
+        return min(
+            (streams.interval(path)
+             for streams in self._gui_streams.values()
+             if streams.wants(path)),
+            default=None)
+
+    def send_stream(self, *args):
+        '''send a transport or DSP load message to the GUIs wanting it.
+        A GUI at low rate receives only the last value
+        at the end of its interval.'''
+        self._stream_version += 1
+        self._stream_values[args[0]] = (self._stream_version, args[1:])
+        self.flush_streams()
+
+    def flush_streams(self):
+        '''send the last stream values to GUIs not having them yet,
+        if their interval allows it.'''
+        now = time.monotonic()
+        self.streams_pending = False
 
-    def send_distant_data(self, src_addrs: list[Address]):
+        for gui_addr in self.gui_list:
+            streams = self._gui_streams.get(gui_addr.url)
+            if streams is None:
+                continue
+
+            for path, (version, args) in self._stream_values.items():
+                if (not streams.wants(path)
+                        or streams.sent_versions.get(path) == version):
+                    continue
+
+                if now < streams.next_sends.get(path, 0.0):
+                    self.streams_pending = True
+                    continue
+
+                self.send_coalesced(gui_addr, path, *args)
+                streams.sent_versions[path] = version
+                streams.next_sends[path] = now + streams.interval(path)
+
+    def send_distant_data(self, src_addrs: list[Address],
+                          graph_id=0, sequence=0):
+        '''send the graph to GUIs at src_addrs, or only its changes
+        since `sequence` if the journal of the graph `graph_id` has them.'''
         if not src_addrs:
             return
         
-        ms = MegaSend('patchbay_ports')        
-        ms.add(rpm.BIG_PACKETS, 0)
-
-        for port in self.pe.ports:
-            ms.add(rpm.PORT_ADDED,
-                   port.name, port.type, port.flags, port.uuid)
-
-        for client_name, client_uuid \
-                in self.pe.client_name_uuids.items():
-            ms.add(rpm.CLIENT_NAME_AND_UUID,
-                   client_name, client_uuid)
-
-        for connection in self.pe.connections:
-            ms.add(rpm.CONNECTION_ADDED,
-                   connection[0], connection[1])
-
-        for uuid, key_dict in self.pe.metadatas.items():
-            for key, value in key_dict.items():
-                ms.add(rpm.METADATA_UPDATED,
-                       uuid, key, value)
-
-        if self.pe.alsa_mng is not None:
-            alsa_mng = self.pe.alsa_mng
-            for port in alsa_mng.parse_ports_and_flags():
-                ms.add(rpm.PORT_ADDED,
-                       port.name, port.type, port.flags, port.uuid)
-                
-            for conn in alsa_mng.parse_connections():
-                ms.add(rpm.CONNECTION_ADDED, *conn)
-        
-        ms.add(rpm.BIG_PACKETS, 1)
-        self.mega_send(src_addrs, ms)
+        if not self._snapshot.seeded:
+            self._snapshot.seed(self.pe)
+
+        mega_send = None
+        if graph_id:
+            mega_send = self._snapshot.delta(graph_id, sequence)
+        if mega_send is None:
+            mega_send = self._snapshot.mega_send()
+
+        self.mega_send(src_addrs, mega_send)
 
-    def add_gui(self, gui_url: str):
+    def add_gui(self, gui_url: str, graph_id=0, sequence=0):
         try:
             gui_addr = Address(gui_url)
             self._tmp_gui_url = ''
@@ -239,7 +378,12 @@ class PatchbayDaemonServer(BunServer):
                       int(bool(self.pe.pretty_names_lockers)))
 
             self.gui_list.append(gui_addr)
-            self.send_distant_data([gui_addr])
+            self._gui_streams[gui_addr.url] = GuiStreams(gui_addr)
+            self._update_streams_wanted()
+            self.send_distant_data([gui_addr], graph_id, sequence)
+            # the graph sent ends with the current graph sequence
+            self._gui_sequences[self._dest_key(gui_addr)] = (
+                self._snapshot.graph_id, self._snapshot.version)
 
         except OSError as e:
             _logger.error(f'Failed to send message to GUI at {gui_url}')
@@ -249,6 +393,7 @@ class PatchbayDaemonServer(BunServer):
             _logger.error(str(e))
 
     def server_restarted(self):
+        self._snapshot.seed(self.pe)
         self.send_gui(rpm.SERVER_STARTED)
         self.send_samplerate()
         self.send_buffersize()
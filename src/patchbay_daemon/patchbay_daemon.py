@@ -1,17 +1,22 @@
 #!/usr/bin/python3 -u
 
 # standard lib imports
+import math
 import signal
 import sys
 import warnings
 from pathlib import Path
 import logging
+from typing import Callable, Optional
 
 # imports from shared/
 from proc_name import set_proc_name
+from patcher.bases import Scheduler, Timer
+import osc_paths.ray.patchbay.monitor as rpm
 
 # imports from HoustonPatchbay
 from patch_engine import PatchEngine
+from patshared import TransportWanted
 
 # local imports
 from osc_server import PatchbayDaemonServer
@@ -28,57 +33,186 @@ else:
         f"%(levelname)s:%(name)s - %(message)s"))
     _logger.addHandler(_log_handler)
 
+PATCH_EVENTS_DELAY = 0.050
+'''seconds between the first patch event received while idle
+and the processing of all received ones'''
+
+TRANSPORT_INTERVAL = 0.050
+'seconds between two checks of the JACK transport for a GUI at full rate'
+
+
+class PeriodicTask:
+    '''`func` called every `interval` seconds,
+    only while `wanted` returns True.
+    
+    If `interval_of` is given, the interval is read from it
+    each time the timer starts.'''
+    def __init__(self, interval: float, func: Callable[[], None],
+                 wanted: Callable[[], bool], scheduler: Scheduler,
+                 interval_of: Optional[Callable[[], float]] = None):
+        self._func = func
+        self._wanted = wanted
+        self._interval = interval
+        self._interval_of = interval_of
+        self._scheduler = scheduler
+        self._timer = Timer(interval, scheduler)
+
+    def _start_timer(self):
+        if self._interval_of is not None:
+            interval = self._interval_of()
+            if interval != self._interval:
+                self._interval = interval
+                self._timer = Timer(interval, self._scheduler)
+        self._timer.start()
+
+    def update(self):
+        if not self._wanted():
+            self._timer.stop()
+            return
+
+        if not self._timer.deadline:
+            self._start_timer()
+        elif self._timer.elapsed():
+            self._func()
+            self._start_timer()
+
+
+def wake_on_patch_events(pe: PatchEngine, osc_server: PatchbayDaemonServer,
+                         on_event: Callable[[], None]) -> bool:
+    '''make the patch event queue of the patch engine, filled by
+    JACK callbacks, call `on_event` and wake the OSC server each time
+    an event is added.
+    
+    Return False if the patch engine has no such queue,
+    patch events have then to be processed at a regular interval.'''
+    queue = getattr(pe, 'patch_event_queue', None)
+    queue_add = getattr(queue, 'add', None)
+    if queue_add is None:
+        return False
+
+    def add_and_wake(*args, **kwargs):
+        queue_add(*args, **kwargs)
+        on_event()
+        osc_server.wake()
+
+    try:
+        queue.add = add_and_wake # type:ignore
+    except AttributeError:
+        return False
+    return True
+
 
 def main_loop(args):
     pe: PatchEngine
     osc_server: PatchbayDaemonServer
     pe, osc_server = args
 
+    patch_events = [False]
+    'True when patch events have been added since the last processing'
+
+    def patch_event_added():
+        # called from the JACK thread
+        patch_events[0] = True
+
+    events_wake = wake_on_patch_events(pe, osc_server, patch_event_added)
+    if not events_wake:
+        _logger.warning(
+            'patch engine has no patch event queue to wake the loop, '
+            f'patch events will be processed every {PATCH_EVENTS_DELAY}s')
+
     pe.start(RayPatchEngineOuter(osc_server))
     if osc_server._tmp_gui_url:
         osc_server.add_gui(osc_server._tmp_gui_url)
 
-    n = 0
+    def process_patch_events():
+        patch_events[0] = False
+        pe.process_patch_events()
+
+        if pe.custom_names_ready and pe.one_shot_act:
+            pe.peo.make_one_shot_act(pe.one_shot_act)
+            pe.one_shot_act = ''
+
+    def restart_jack():
+        if pe.client is not None:
+            _logger.debug(
+                'deactivate JACK client after server shutdown')
+            pe.client.deactivate()
+            _logger.debug('close JACK client after server shutdown')
+            pe.client.close()
+            _logger.debug('close JACK client done')
+            pe.client = None
+        _logger.debug('try to start JACK')
+        pe.start_jack_client()
+
+    def patch_events_wanted() -> bool:
+        if not pe.jack_running:
+            return False
+        # without wake up, events are processed at a regular interval
+        return patch_events[0] or not events_wake
+
+    def jack_stopped() -> bool:
+        return not pe.jack_running
+
+    def dsp_wanted() -> bool:
+        return (pe.jack_running
+                and pe.dsp_wanted
+                and bool(osc_server.gui_list))
+    
+    def transport_wanted() -> bool:
+        # pe.transport_wanted is NO if no GUI wants the transport
+        return (pe.jack_running
+                and pe.transport_wanted != TransportWanted.NO
+                and bool(osc_server.gui_list))
+
+    def transport_interval() -> float:
+        # GUIs at low rate do not need to know the transport
+        # more often than they receive it.
+        return max(
+            TRANSPORT_INTERVAL,
+            osc_server.stream_interval(rpm.TRANSPORT_POSITION) or 0.0)
+
+    def streams_pending() -> bool:
+        return osc_server.streams_pending
+
+    scheduler = Scheduler()
+
+    # Patch events received together while idle are processed together,
+    # PATCH_EVENTS_DELAY after the first one.
+    # The JACK transport has no callback, it has to be polled.
+    tasks = (
+        PeriodicTask(PATCH_EVENTS_DELAY, process_patch_events,
+                     patch_events_wanted, scheduler),
+        PeriodicTask(0.200, pe.remember_dsp_load, dsp_wanted, scheduler),
+        PeriodicTask(1.000, pe.send_dsp_load, dsp_wanted, scheduler),
+        PeriodicTask(TRANSPORT_INTERVAL, pe.send_transport_pos,
+                     transport_wanted, scheduler, transport_interval),
+        PeriodicTask(0.100, osc_server.flush_streams,
+                     streams_pending, scheduler),
+        PeriodicTask(0.500, restart_jack, jack_stopped, scheduler))
 
     while True:
-        osc_server.recv(50)
-        
-        if pe.can_leave:
-            break
+        for task in tasks:
+            task.update()
 
         if pe.jack_running:
-            if n % 4 == 0:
-                pe.remember_dsp_load()
-                if pe.dsp_wanted and n % 20 == 0:
-                    pe.send_dsp_load()
-            
-            pe.process_patch_events()
+            # pretty names can change only with patch events
+            # or OSC messages, both wake the loop.
             pe.check_pretty_names_export()
-            pe.send_transport_pos()
-
-            if pe.custom_names_ready and pe.one_shot_act:
-                pe.peo.make_one_shot_act(pe.one_shot_act)
-                pe.one_shot_act = ''
-                if pe.can_leave:
-                    break
-        else:
-            if n % 10 == 0:
-                if pe.client is not None:
-                    _logger.debug(
-                        'deactivate JACK client after server shutdown')
-                    pe.client.deactivate()
-                    _logger.debug('close JACK client after server shutdown')
-                    pe.client.close()
-                    _logger.debug('close JACK client done')
-                    pe.client = None
-                _logger.debug('try to start JACK')
-                pe.start_jack_client()
-
-        n += 1
+
+        if pe.can_leave:
+            break
+
+        # wait for OSC messages or the next task deadline
+        timeout = scheduler.timeout()
+        osc_server.recv(
+            None if timeout is None else math.ceil(timeout * 1000))
         
-        # for faster modulos
-        if n == 20:
-            n = 0
+        if pe.can_leave:
+            break
+
+    if osc_server.stats is not None:
+        # enabled with RAY_OSC_STATS environment variable
+        _logger.info('\n'.join(osc_server.stats.lines()))
 
     pe.exit()
 
@@ -147,6 +281,14 @@ def start():
     patch_engine.one_shot_act = one_shot_act
     osc_server = PatchbayDaemonServer(patch_engine, daemon_port)
     osc_server.set_tmp_gui_url(gui_url)
+
+    def signal_handler(sig, frame):
+        PatchEngine.signal_handler(sig, frame)
+        # the main loop may wait without deadline
+        osc_server.wake()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
     main_loop((patch_engine, osc_server))
 
 def internal_prepare(
@@ -164,5 +306,10 @@ def internal_prepare(
     osc_server = PatchbayDaemonServer(patch_engine, int(daemon_port))
     osc_server.set_tmp_gui_url(gui_url)
 
-    return (main_loop, patch_engine.internal_stop,
+    def internal_stop():
+        patch_engine.internal_stop()
+        # the main loop may wait without deadline
+        osc_server.wake()
+
+    return (main_loop, internal_stop,
             (patch_engine, osc_server), None)
@@ -22,6 +22,9 @@ JACK_CLIENT_NAME = 'ray-patch_dmn'
 
 
 class RayPatchEngineOuter(PatchEngineOuter):
+    '''Every graph change of the patch engine must be sent with
+    `_send_gui`, the graph snapshot of the server is updated
+    with these messages only.'''
     def __init__(self, osc_server: 'PatchbayDaemonServer'):
         super().__init__()
         self.osc_server = osc_server
@@ -90,12 +93,13 @@ class RayPatchEngineOuter(PatchEngineOuter):
         self.osc_server.server_restarted()
     
     def send_transport_position(self, tpos: 'TransportPosition'):
-        self._send_gui(rpm.TRANSPORT_POSITION,
-                      tpos.frame, int(tpos.rolling), int(tpos.valid_bbt),
-                      tpos.bar, tpos.beat, tpos.tick, tpos.beats_per_minutes)
+        self.osc_server.send_stream(
+            rpm.TRANSPORT_POSITION,
+            tpos.frame, int(tpos.rolling), int(tpos.valid_bbt),
+            tpos.bar, tpos.beat, tpos.tick, tpos.beats_per_minutes)
     
     def send_dsp_load(self, dsp_load: int):
-        self._send_gui(rpm.DSP_LOAD, dsp_load)
+        self.osc_server.send_stream(rpm.DSP_LOAD, dsp_load)
     
     def send_one_xrun(self):
         self._send_gui(rpm.ADD_XRUN)
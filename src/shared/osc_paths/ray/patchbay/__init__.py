@@ -7,6 +7,10 @@ from . import monitor
 ACTIVATE_DSP_LOAD = '/ray/patchbay/activate_dsp_load'
 ACTIVATE_TRANSPORT = '/ray/patchbay/activate_transport'
 ADD_GUI = '/ray/patchbay/add_gui'
+'''GUI url, optionally followed by the graph id and the graph sequence
+of the last graph_sequence message received by this GUI,
+to receive only the graph changes since this sequence. (arg types: s|sii)'''
+
 CONNECT = '/ray/patchbay/connect'
 DISCONNECT = '/ray/patchbay/disconnect'
 GROUP_CUSTOM_NAME = '/ray/patchbay/group_custom_name'
@@ -20,6 +24,11 @@ EXPORT_ALL_CUSTOM_NAMES = '/ray/patchbay/export_all_custom_names'
 IMPORT_ALL_PRETTY_NAMES = '/ray/patchbay/import_all_pretty_names'
 CLEAR_ALL_PRETTY_NAMES = '/ray/patchbay/clear_all_pretty_names'
 SET_BUFFER_SIZE = '/ray/patchbay/set_buffer_size'
+STREAMS_RATE = '/ray/patchbay/streams_rate'
+'''Rate of transport and DSP load messages sent to this GUI,
+0: none, 1: low rate, 2: full rate.
+Default is full rate for a GUI on the same machine, low rate otherwise. (arg types: i)'''
+
 TRANSPORT_PLAY = '/ray/patchbay/transport_play'
 TRANSPORT_RELOCATE = '/ray/patchbay/transport_relocate'
 TRANSPORT_STOP = '/ray/patchbay/transport_stop'
\ No newline at end of file
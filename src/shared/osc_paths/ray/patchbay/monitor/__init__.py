@@ -12,6 +12,10 @@ CLIENT_NAME_AND_UUID = '/ray/patchbay/monitor/client_name_and_uuid'
 CONNECTION_ADDED = '/ray/patchbay/monitor/connection_added'
 CONNECTION_REMOVED = '/ray/patchbay/monitor/connection_removed'
 DSP_LOAD = '/ray/patchbay/monitor/dsp_load'
+GRAPH_SEQUENCE = '/ray/patchbay/monitor/graph_sequence'
+'''graph id and sequence of the last graph change sent to the GUI.
+The graph id changes when the graph is seeded again. (arg types: ii)'''
+
 METADATA_UPDATED = '/ray/patchbay/monitor/metadata_updated'
 PORT_ADDED = '/ray/patchbay/monitor/port_added'
 PORT_REMOVED = '/ray/patchbay/monitor/port_removed'
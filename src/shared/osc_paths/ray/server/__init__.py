@@ -8,6 +8,9 @@ ABORT_COPY = '/ray/server/abort_copy'
 ABORT_PARRALLEL_COPY = '/ray/server/abort_parrallel_copy'
 ABORT_SNAPSHOT = '/ray/server/abort_snapshot'
 ASK_FOR_PATCHBAY = '/ray/server/ask_for_patchbay'
+'''Ask for a patchbay daemon, with optionally the graph id and
+graph sequence the GUI already knows, see /ray/patchbay/add_gui. (arg types: s|sii)'''
+
 PATCHBAY_DAEMON_READY = '/ray/server/patchbay_daemon_ready'
 '''The patchbay daemon sends this message to the daemon
 when it is ready to receive custom names'''
@@ -18,6 +21,11 @@ CONTROLLER_ANNOUNCE = '/ray/server/controller_announce'
 CONTROLLER_DISANNOUNCE = '/ray/server/controller_disannounce'
 EXOTIC_ACTION = '/ray/server/exotic_action'
 GET_SESSION_PREVIEW = '/ray/server/get_session_preview'
+GET_STATS = '/ray/server/get_stats'
+'''Reply the per path OSC statistics of the daemon, recording starts
+at first call. With 'stop' as argument, stop the recording,
+with 'reset', reset the statistics.'''
+
 GUI_ANNOUNCE = '/ray/server/gui_announce'
 GUI_DISANNOUNCE = '/ray/server/gui_disannounce'
 HAS_OPTION = '/ray/server/has_option'
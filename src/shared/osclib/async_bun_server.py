@@ -0,0 +1,251 @@
+import asyncio
+from collections import deque
+import logging
+import time
+from typing import Optional, Union
+
+from .bases import Address, OscArg, UDP
+from .bun_server import BunServer
+from .funcs import is_on_this_machine, resolve_host
+
+
+_logger = logging.getLogger(__name__)
+
+REPLY_PATH = '/reply'
+ERROR_PATH = '/error'
+
+_TCP_POLL_INTERVAL = 0.050
+'''interval in seconds between two receptions with a non UDP protocol,
+the server fileno is then only the listening socket.'''
+
+_LATE_REPLY_DELAY = 30.0
+'''time in seconds during which a reply to a timed out or cancelled
+request is still expected, and discarded, so that it can not be taken
+for the reply of a next request with the same destination and path.'''
+
+_resolved_hosts = dict[str, str]()
+
+
+class OscRequestError(Exception):
+    '''raised by `AsyncBunServer.request` when the destination
+    replies to the request with an `/error` message.'''
+    def __init__(self, path: str, code: int, message: str):
+        super().__init__(message)
+        self.path = path
+        self.code = code
+        self.message = message
+
+    def __str__(self) -> str:
+        return f'{self.path} failed ({self.code}): {self.message}'
+
+
+class _PendingRequest:
+    def __init__(self, future: asyncio.Future, multi: bool):
+        self.future = future
+        self.multi = multi
+        self.replies = list[list[OscArg]]()
+        self.abandoned_at = 0.0
+        'monotonic time of the timeout or cancellation, 0.0 if waiting'
+
+
+class AsyncBunServer(BunServer):
+    '''BunServer receiving its messages from an asyncio event loop.
+
+    Once `attach` is called, messages are received and their methods
+    executed by the loop as soon as they arrive, without any polling.
+
+    `await request(addr, path, *args)` sends a message and returns
+    the args of the `/reply` message for this path, or raises
+    `OscRequestError` if the destination replies with an `/error`.
+    Many requests can wait at the same time, replies are matched
+    with their request by destination host, port and path,
+    in sending order.
+
+    `/reply` and `/error` methods are added at init, so they should
+    not be added again on this server.'''
+    def __init__(self, port: Union[int, str] =1, proto=UDP,
+                 reg_methods=True, total_fake=False):
+        super().__init__(port=port, proto=proto, reg_methods=reg_methods,
+                         total_fake=total_fake)
+        self._pending = dict[
+            tuple[str, int, str], deque[_PendingRequest]]()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._readers = list[int]()
+        self._poll_handle: Optional[asyncio.TimerHandle] = None
+
+        self.add_method(REPLY_PATH, None, self._reply_received)
+        self.add_method(ERROR_PATH, 'sis', self._error_received)
+
+    def attach(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        '''start to receive messages from the asyncio loop,
+        the running one if `loop` is not given.'''
+        if self._loop is not None:
+            return
+
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._readers.append(self._channel.fileno())
+
+        if self.sv is not None:
+            if self.protocol == UDP:
+                self._readers.append(self.sv.fileno())
+            else:
+                self._poll_handle = self._loop.call_later(
+                    _TCP_POLL_INTERVAL, self._poll)
+
+        for fd in self._readers:
+            self._loop.add_reader(fd, self._recv_available)
+
+    def detach(self):
+        '''stop to receive messages from the asyncio loop,
+        pending requests are cancelled.'''
+        if self._loop is None:
+            return
+
+        for fd in self._readers:
+            self._loop.remove_reader(fd)
+        self._readers.clear()
+        self._channel.close()
+
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+
+        for pendings in self._pending.values():
+            for pending in pendings:
+                pending.future.cancel()
+        self._pending.clear()
+        self._loop = None
+
+    def _recv_available(self):
+        while self.recv(0):
+            pass
+
+    def _poll(self):
+        self._recv_available()
+        if self._loop is not None:
+            self._poll_handle = self._loop.call_later(
+                _TCP_POLL_INTERVAL, self._poll)
+
+    @staticmethod
+    def _peer(addr: Union[Address, str, int]) -> tuple[str, int]:
+        '''host and port of addr, host is empty for this machine'''
+        if isinstance(addr, int):
+            return ('', addr)
+        if isinstance(addr, str):
+            addr = Address(addr)
+        if is_on_this_machine(addr):
+            return ('', addr.port) # type:ignore
+
+        host = _resolved_hosts.get(addr.hostname)
+        if host is None:
+            host = _resolved_hosts[addr.hostname] = resolve_host(
+                addr.hostname)
+        return (host, addr.port) # type:ignore
+
+    def _first_pending(self, key: tuple[str, int, str]
+                       ) -> Optional[_PendingRequest]:
+        pendings = self._pending.get(key)
+        if not pendings:
+            return None
+
+        # forget abandoned requests whose reply will probably never come
+        now = time.monotonic()
+        while (pendings and pendings[0].abandoned_at
+               and now - pendings[0].abandoned_at > _LATE_REPLY_DELAY):
+            pendings.popleft()
+
+        if not pendings:
+            del self._pending[key]
+            return None
+        return pendings[0]
+
+    def _pop_pending(self, key: tuple[str, int, str]):
+        pendings = self._pending[key]
+        pendings.popleft()
+        if not pendings:
+            del self._pending[key]
+
+    def _reply_received(self, path: str, args: list[OscArg],
+                        types: str, src_addr: Address):
+        if not args or not isinstance(args[0], str):
+            return
+
+        key = (*self._peer(src_addr), args[0])
+        pending = self._first_pending(key)
+        if pending is None:
+            _logger.debug(f'unexpected reply for {args[0]} '
+                          f'from {src_addr.url}')
+            return
+
+        if pending.multi and len(args) > 1:
+            # a reply to a list request, the last one contains no args
+            pending.replies.append(args[1:])
+            return
+
+        self._pop_pending(key)
+        if pending.future.done():
+            # late reply to an abandoned request
+            return
+
+        if pending.multi:
+            pending.future.set_result(
+                [arg for reply in pending.replies for arg in reply])
+        else:
+            pending.future.set_result(args[1:])
+
+    def _error_received(self, path: str, args: list[OscArg],
+                        types: str, src_addr: Address):
+        err_path, code, message = args
+        key = (*self._peer(src_addr), err_path)
+        pending = self._first_pending(key) # type:ignore
+        if pending is None:
+            _logger.debug(f'unexpected error for {err_path} '
+                          f'from {src_addr.url}: {message}')
+            return
+
+        self._pop_pending(key) # type:ignore
+
+        if not pending.future.done():
+            pending.future.set_exception(
+                OscRequestError(err_path, code, message)) # type:ignore
+
+    async def _request(self, addr: Union[Address, str, int], path: str,
+                       args: tuple, timeout: Optional[float],
+                       multi: bool) -> list[OscArg]:
+        if self._loop is None:
+            self.attach()
+
+        key = (*self._peer(addr), path)
+        pending = _PendingRequest(self._loop.create_future(), multi)  # type:ignore
+        self._pending.setdefault(key, deque()).append(pending)
+        self.send(addr, path, *args)
+
+        try:
+            return await asyncio.wait_for(pending.future, timeout)
+        finally:
+            if not pending.future.done() or pending.future.cancelled():
+                # timeout or cancellation. The request stays in the queue,
+                # a late reply will be discarded with it, replies are
+                # matched in sending order.
+                pending.abandoned_at = time.monotonic()
+
+    async def request(self, addr: Union[Address, str, int], path: str,
+                      *args: OscArg,
+                      timeout: Optional[float] = 5.0) -> list[OscArg]:
+        '''send a message to `addr` and wait for its `/reply`.
+
+        Return the args of the reply, without the path.
+        Raise `OscRequestError` if `addr` replies with an `/error`,
+        and `asyncio.TimeoutError` if there is no answer after
+        `timeout` seconds (never if `timeout` is None).'''
+        return await self._request(addr, path, args, timeout, False)
+
+    async def request_list(self, addr: Union[Address, str, int], path: str,
+                           *args: OscArg,
+                           timeout: Optional[float] = 5.0) -> list[OscArg]:
+        '''same as `request`, for paths replying in several `/reply`
+        messages, the last one containing only the path
+        (as `/ray/server/list_sessions`).
+
+        Return all the args of all replies.'''
+        return await self._request(addr, path, args, timeout, True)
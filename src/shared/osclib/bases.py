@@ -1,7 +1,9 @@
 from dataclasses import dataclass
+from functools import lru_cache
 import random
+import re
 from types import NoneType
-from typing import TYPE_CHECKING, TypeAlias, Union
+from typing import TYPE_CHECKING, Optional, TypeAlias, Union
 
 if TYPE_CHECKING:
     from dum_imports import (
@@ -55,17 +57,56 @@ for example:
 
 class MegaSend:
     '''container for multiple messages to send
-    with `mega_send` method of a BunServer (or BunServerThread)'''
-    messages: list[Message]
+    with `mega_send` method of a BunServer (or BunServerThread).
+    
+    Messages are only stored as tuples (path, *args), liblo Messages
+    are created only if the chosen route needs them.'''
     def __init__(self, ref: str):
         self.ref = ref
         self.tuples = list[tuple[OscArg | tuple[str, OscArg], ...]]()
-        self.messages = list[Message]()
+        self._messages: Optional[list[Message]] = None
+        self._sizes: Optional[list[int]] = None
         self.id = random.randrange(0x80000000, 0x7fffffffffffffff)
     
+    def __len__(self) -> int:
+        return len(self.tuples)
+    
     def add(self, *args):
         self.tuples.append(args)
-        self.messages.append(Message(*args))
+        self._messages = None
+        self._sizes = None
+
+    @property
+    def messages(self) -> list[Message]:
+        '''liblo Messages, created at first call'''
+        if self._messages is None:
+            self._messages = [Message(*args) for args in self.tuples]
+        return self._messages
+    
+    @property
+    def sizes(self) -> list[int]:
+        '''encoded size in bytes of each message, computed at first call,
+        without creating any liblo Message'''
+        if self._sizes is None:
+            self._sizes = [osc_message_size(args) for args in self.tuples]
+        return self._sizes
+    
+    def renewed(self) -> 'MegaSend':
+        '''copy of this MegaSend with a new id, to send the same messages
+        again to a destination which already received it.
+        Messages and sizes already created are shared.'''
+        mega_send = MegaSend(self.ref)
+        mega_send.tuples = self.tuples
+        mega_send._messages = self._messages
+        mega_send._sizes = self._sizes
+        return mega_send
+
+    def bundle_size(self, start=0, end: Optional[int] = None) -> int:
+        '''encoded size in bytes of the bundle elements containing
+        messages from `start` to `end` (excluded), without the bundle
+        header.'''
+        sizes = self.sizes[start:end]
+        return sum(sizes) + 4 * len(sizes)
 
 
 @dataclass()
@@ -74,6 +115,9 @@ class OscPack:
     args: list[OscArg]
     types: OscTypes
     src_addr: Address
+    recv_time: float = 0.0
+    '''`time.perf_counter()` at reception, set only
+    if the server records OSC stats'''
     
     def reply(self) -> tuple[Address, str, str]:
         return (self.src_addr, '/reply', self.path)
@@ -130,56 +174,94 @@ def get_types_with_args(args: list) -> OscTypes:
     
     return types
 
-def types_validator(input_types: OscTypes, multypes: OscMulTypes) -> bool:
-    '''return True if `input_types` is compatible with `multypes`.
-    OscTypes and OscMulTypes are `str` aliases.'''
-    avl_typess = set(multypes.split('|'))
-    if input_types in avl_typess:
-        return True
-    if '.*' in avl_typess or '*' in avl_typess:
-        return True
-    
-    for avl_types in avl_typess:
-        if not ('*' in avl_types or '.' in avl_types):
+def _osc_string_size(string: str) -> int:
+    'size of an OSC string, null terminated and padded to 4 bytes'
+    return (len(string.encode()) // 4 + 1) * 4
+
+_FIXED_ARG_SIZES = {
+    'i': 4, 'f': 4, 'c': 4, 'r': 4, 'm': 4,
+    'h': 8, 't': 8, 'd': 8,
+    'T': 0, 'F': 0, 'N': 0, 'I': 0}
+
+def osc_message_size(message: tuple) -> int:
+    '''size in bytes of the encoded OSC message, `message` being
+    a tuple (path, *args) as stored in a MegaSend.'''
+    path, *args = message
+    types = get_types_with_args(args)
+    size = _osc_string_size(path) + _osc_string_size(',' + types)
+
+    for c, arg in zip(types, args):
+        fixed_size = _FIXED_ARG_SIZES.get(c)
+        if fixed_size is not None:
+            size += fixed_size
             continue
 
-        wildcard = ''
-        mt = ''
+        typed = isinstance(arg, tuple) and len(arg) == 2
+        if typed:
+            arg = arg[1]
 
+        if isinstance(arg, str):
+            size += _osc_string_size(arg)
+        elif isinstance(arg, bytes) and not (typed and c == 'b'):
+            # liblo sends untyped bytes as a string
+            size += (len(arg) // 4 + 1) * 4
+        else:
+            # blob, 4 bytes for its size and data padded to 4 bytes
+            size += 4 + (len(arg) + 3) // 4 * 4 # type:ignore
+    
+    return size
+
+def _multypes_to_regex(multypes: OscMulTypes) -> str:
+    '''convert an OscMulTypes to a regular expression
+    with exactly the same behavior than the historical
+    types validation.'''
+    alternatives = list[str]()
+
+    for avl_types in multypes.split('|'):
+        if not ('*' in avl_types or '.' in avl_types):
+            alternatives.append(re.escape(avl_types))
+            continue
+        
+        if avl_types in ('*', '.*'):
+            alternatives.append('.*')
+            continue
+        
+        regex = ''
         for i in range(len(avl_types)):
             mt = avl_types[i]
             if i + 1 < len(avl_types) and avl_types[i+1] == '*':
-                if mt in ('', '.'):
-                    return True
-                wildcard = mt
-                
-            else:
-                wildcard = ''
-
-            if wildcard:
-                j = i
-                compat = True
-                while j < len(input_types):
-                    if input_types[j] != wildcard:
-                        compat = False
-                        break
-                    j += 1
-                
-                if compat:
-                    return True
+                if mt == '.':
+                    # all next args are accepted
+                    regex += '.*'
                 else:
-                    break
-            
-            if i >= len(input_types):
+                    # all next args must be of this type
+                    regex += re.escape(mt) + '*'
                 break
-            
+
             if mt == '.':
-                continue
-            
-            if input_types[i] != mt:
-                break
+                regex += '.'
+            else:
+                regex += re.escape(mt)
         else:
-            # input_types is compatible with this avl_types
-            return True
+            # without '*', args after the last type letter
+            # have always been accepted.
+            regex += '.*'
+
+        alternatives.append(regex)
+    
+    return '|'.join([f'(?:{alt})' for alt in alternatives])
+
+@lru_cache(maxsize=None)
+def compile_multypes(multypes: OscMulTypes) -> re.Pattern[str]:
+    '''return the compiled regex matching all OscTypes
+    compatible with `multypes`. Result is kept, so this is done
+    only once per OscMulTypes.'''
+    return re.compile(_multypes_to_regex(multypes))
+
+@lru_cache(maxsize=4096)
+def types_validator(input_types: OscTypes, multypes: OscMulTypes) -> bool:
+    '''return True if `input_types` is compatible with `multypes`.
+    OscTypes and OscMulTypes are `str` aliases.
     
-    return False
\ No newline at end of file
+    Results are memoized, so it is generally only a dict hit.'''
+    return compile_multypes(multypes).fullmatch(input_types) is not None
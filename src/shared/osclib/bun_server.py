@@ -1,21 +1,25 @@
 from dataclasses import dataclass
 import inspect
-import json
 import logging
 import os
-from queue import Queue, Empty
+import re
+import select
+import stat
 import tempfile
 import time
 from threading import Thread, current_thread
-from typing import Callable, Union, Optional
+from typing import Callable, Sequence, Union, Optional
 
 from osclib import OscTypes
 
 from .bases import (
     OscArg, OscMulTypes, OscPack, OscPath, Server, Address, Message, Bundle,
-    MegaSend, get_types_with_args, types_validator, UDP)
+    MegaSend, get_types_with_args, types_validator, compile_multypes,
+    osc_message_size, UDP)
 from .funcs import is_on_this_machine, set_on_this_machine
-from .bun_tools import number_of_args, MethodsAdder, MegaSendChecker
+from .bun_tools import (
+    number_of_args, MethodsAdder, MegaSendChecker, PackFilter, ProcessChannel,
+    OutgoingCoalescer, CoalesceCounter, OscStats, encode_bulk, decode_bulk)
 
 _logger = logging.getLogger(__name__)
 
@@ -25,11 +29,52 @@ _RESERVED_PORT = 47
 '''Port reserved in OSC, used to try to send message to,
 this way, no risk that any OSC port can receive it.'''
 
+_MEGA_SEND_PATHS = frozenset((
+    '/_bundle_head', '/_bundle_head_reply',
+    '/_bundle_tail', '/_bundle_tail_reply',
+    '/_local_mega_send', '/_local_mega_send_done'))
+'''paths of mega send internal methods, called for all packs'''
+
+_UDP_MAX_SIZE = 65507
+'maximum size in bytes of an UDP datagram sent by liblo'
+
+_BUNDLE_HEADER_SIZE = 16
+"'#bundle' string and time tag"
+
+_BUNDLE_MARKER_SIZE = 4 + osc_message_size(
+    ('/_bundle_head', 0x100000000, 0, 0))
+'bundle element size of a /_bundle_head or /_bundle_tail message'
+
+_LOCAL_BULK_TIMEOUT = 30.0
+'''seconds after which a local mega send not read by its receiver
+is released by the sender.'''
+
+_LOCAL_BULK_DIR_PREFIX = 'ray_mega_send_'
+'prefix of the private directory of local mega sends written in files'
+
+_PROC_FD_RE = re.compile(r'/proc/[0-9]+/fd/[0-9]+')
+'path of a local mega send written in a memfd'
+
+_MEMFD_NAME = 'ray_mega_send'
+
+_MEGA_SEND_RECV_MEMORY = 64
+'number of last received mega sends remembered to ignore resent packs'
+
+_PACK_RESEND_TIMEOUT = 0.500
+'seconds without tail reply after which a mega send pack is resent'
+
+_PACK_MAX_SENDS = 4
+'max number of sends of a same mega send pack'
+
+_MIN_BUNDLE_SIZE = 512
+'under this size, we consider that bundles can not be sent'
+
 IS_NOT_LAST = 0
 IS_LAST = 1
 
-_process_port_queues = dict[int, Queue[OscPack]]()
-'Contains the port numbers of all BunServer instantiated in this process'
+_process_channels = dict[int, ProcessChannel]()
+'''Contains the port numbers of all BunServer instantiated in this process,
+with the channel receiving messages from the other ones.'''
 
 _last_fake_num = 0x1000000
 
@@ -87,6 +132,7 @@ class BunServer:
         decorated with @bun_manage'''
 
         self._dummy_port = 0
+        self._pack_filter = PackFilter()
 
         if not total_fake:
             if port == 1:
@@ -106,15 +152,42 @@ class BunServer:
                             self.__bundle_tail_reply) # type:ignore
             self.add_method('/_local_mega_send', 'hs',
                             self.__local_mega_send) # type:ignore
+            self.add_method('/_local_mega_send_done', 'hs',
+                            self.__local_mega_send_done) # type:ignore
         else:
             global _last_fake_num
             self.sv = None
             _last_fake_num += 1
             self._dummy_port = _last_fake_num
         
+        self._max_bundle_sizes = dict[tuple[int, bool], int]()
+        '''max bundle size that can be sent, 
+        for each protocol and locality of the destination'''
         self._ms_checker = MegaSendChecker()
         self._mega_send_recv = dict[int, int]()
-        _process_port_queues[self.port] = Queue()
+        '''number of packs received in order for the last mega sends,
+        it is the number of the next expected pack'''
+        self.mega_send_window = 1
+        '''max number of mega send packs sent 
+        without having received their reply.
+        A larger window did not make transfers faster on loopback
+        (see src/tests/bench_mega_send_window.py), it may help
+        with a distant receiver.'''
+        self.mega_send_window_bytes = 131072
+        '''max size in bytes of mega send packs sent without having
+        received their reply. Should be lower than the receiver socket
+        buffer, else packs are lost and sent again.'''
+        self._local_bulks = dict[str, tuple[int, float]]()
+        '''bulks written for local mega sends, not yet read by receiver.
+        values are tuple[file descriptor (-1 if not a memfd), time]'''
+        self._local_bulk_dir = ''
+        'private directory of bulks written in files, created if needed'
+        self._channel = ProcessChannel()
+        _process_channels[self.port] = self._channel
+        self._coalescer = OutgoingCoalescer()
+        self._stats: Optional[OscStats] = None
+        if os.getenv('RAY_OSC_STATS', '0').lower() not in ('0', 'false', ''):
+            self.enable_stats()
     
     @property
     def url(self) -> str:
@@ -138,6 +211,19 @@ class BunServer:
             return UDP
         return self.sv.protocol
     
+    @property
+    def stats(self) -> Optional[OscStats]:
+        '''OSC statistics, None if not enabled'''
+        return self._stats
+    
+    def enable_stats(self, enabled=True):
+        '''start (or stop) to record per path OSC statistics,
+        statistics are reset if they were already enabled.
+        
+        Only received messages going to methods added with 
+        `add_nice_method` are recorded.'''
+        self._stats = OscStats() if enabled else None
+    
     def _exec_func(self, func: Callable, osp: OscPack):
         'Used when OSC communication is fake, to execute the desired func'
         match number_of_args(func):
@@ -173,44 +259,85 @@ class BunServer:
         if osp.path in self._mw_path_wrap:
             self._mw_path_wrap[osp.path].wrapper(self, osp) # type:ignore
     
-    def recv(self, timeout: Optional[int] = None) -> bool:
-        if self.sv is None and timeout:
-            has_osp = False
-            while True:
-                try:
-                    osp = _process_port_queues[self.port].get(
-                        timeout=timeout*0.001)
-                    has_osp = True
-                except Empty:
-                    break
-                except BaseException as e:
-                    _logger.error(f'Unknown problem in fake recv {str(e)}')
-                    return False
-
-                types_func = self._methods_adder.get_func(osp.path, osp.args)
-                if types_func is None:
-                    continue
-                
-                types, func = types_func
-                osp.types = types
-                self._exec_func(func, osp)
-            
-            return has_osp
+    def _exec_messages(
+            self, src_addr: Address, messages: Sequence[tuple],
+            unwrap_typed=False):
+        '''execute messages (tuples (path, *args)) received without OSC.
         
-        while _process_port_queues[self.port].qsize():
-            osp = _process_port_queues[self.port].get()
-            types_func = self._methods_adder.get_func(osp.path, osp.args)
+        If `unwrap_typed` is True, typed tuple args as ('d', 0.4557511)
+        are given to the func as liblo would give them.'''
+        for message in messages:
+            path, args = message[0], list(message[1:])
+            raw_types = ''
+            if unwrap_typed and any(isinstance(a, tuple) for a in args):
+                raw_types = get_types_with_args(args)
+                args = [a[1] if isinstance(a, tuple) and len(a) == 2
+                        else a for a in args]
+
+            types_func = self._methods_adder.get_func(path, args)
             if types_func is None:
                 continue
             
             types, func = types_func
-            osp.types = types
-            self._exec_func(func, osp)
+            if raw_types:
+                types = raw_types
+            self._exec_func(func, OscPack(path, args, types, src_addr))
+    
+    def _recv_process_channel(self) -> bool:
+        '''execute all messages received from BunServers
+        of the same process. Return True if there was at least one batch.'''
+        has_batch = False
+
+        for src_port, messages in self._channel.drain():
+            has_batch = True
+            self._exec_messages(Address(src_port), messages)
         
+        return has_batch
+    
+    def recv(self, timeout: Optional[int] = None) -> bool:
+        '''receive and execute messages, waiting at most `timeout` ms
+        (forever if `timeout` is None). Messages from BunServers of
+        the same process wake it up immediately.
+        
+        Without OSC port (total_fake), it never waits forever,
+        it only executes messages already received if `timeout` is None.
+        
+        Return True if any message has been received.'''
+        if self._coalescer.has_pending():
+            self.flush_coalesced()
+
         if self.sv is None:
-            return False
+            if timeout and not self._channel.has_messages():
+                self._channel.wait(timeout * 0.001)
+            return self._recv_process_channel()
+        
+        if self.protocol != UDP:
+            # with TCP, the server fileno is only the listening socket,
+            # we can not use select.
+            has_batch = self._recv_process_channel()
+            return self.sv.recv(timeout) or has_batch
         
-        return self.sv.recv(timeout)
+        if timeout != 0 and not self._channel.has_messages():
+            select.select(
+                [self.sv.fileno(), self._channel.fileno()], [], [],
+                None if timeout is None else timeout * 0.001)
+
+        has_batch = self._recv_process_channel()
+        return self.sv.recv(0) or has_batch
+    
+    def free(self):
+        '''release the OSC port and the resources of this server,
+        it can not be used anymore.'''
+        self._release_local_bulks()
+        if _process_channels.get(self.port) is self._channel:
+            del _process_channels[self.port]
+        self._channel.close()
+        if self.sv is not None:
+            self.sv.free()
+
+    def wake(self):
+        '''make a current or next `recv` return immediately'''
+        self._channel.wake()
     
     def send(self, *args, **kwargs):
         if len(args) < 2:
@@ -220,14 +347,22 @@ class BunServer:
         dest_port = 0
 
         if isinstance(dest, Address):
-            if (dest.port in _process_port_queues
+            if (dest.port in _process_channels
                     and is_on_this_machine(dest)
                     and dest.protocol == UDP):
                 dest_port: int = dest.port # type:ignore
         elif isinstance(dest, int):
-            if dest in _process_port_queues:
+            if dest in _process_channels:
                 dest_port = dest
         
+        if self._coalescer.has_pending():
+            # messages sent with send_coalesced must arrive before
+            for key_dest_msgs in self._coalescer.take(self._dest_key(dest)):
+                self._send_coalesced(*key_dest_msgs)
+
+        if self._stats is not None and isinstance(args[1], str):
+            self._stats.record_out(args[1:])
+
         if isinstance(args[1], (Message, Bundle)):
             if self.sv is None:
                 raise TypeError(
@@ -242,10 +377,7 @@ class BunServer:
             # communication between two BunServer in the same process.
             # Avoid OSC communication, directly enqueue the message
             # the receiver will take it at recv.
-            dest, path, *other_args = args
-            _process_port_queues[dest_port].put(
-                OscPack(path, other_args, get_types_with_args(other_args),
-                        Address(self.port)))
+            _process_channels[dest_port].put(self.port, args[1:])
             return
 
         if self.sv is None:
@@ -253,12 +385,141 @@ class BunServer:
 
         self.sv.send(*args, **kwargs)
     
+    @staticmethod
+    def _dest_key(dest: str | int | Address) -> str | int:
+        '''key of the coalesced messages queue of `dest`.
+        An UDP peer on this machine has the same key (its port),
+        whether it is given as an Address, an url or a port.'''
+        if isinstance(dest, int):
+            return dest
+
+        if isinstance(dest, Address):
+            if dest.protocol == UDP and is_on_this_machine(dest):
+                return dest.port # type:ignore
+            return dest.url
+
+        dport = dest.rpartition(':')[2].partition('/')[0]
+        proto_str = dest.partition('.')[2].partition(':')[0]
+        if (dport.isdigit() and proto_str.lower() == 'udp'
+                and is_on_this_machine(dest)):
+            return int(dport)
+        return dest
+    
+    def _same_process_port(self, dest: str | int | Address) -> int:
+        '''return the port of dest if it is a BunServer
+        of this process, otherwise 0'''
+        if isinstance(dest, Address):
+            if (dest.port in _process_channels
+                    and is_on_this_machine(dest)
+                    and dest.protocol == UDP):
+                return dest.port # type:ignore
+        elif isinstance(dest, int):
+            if dest in _process_channels:
+                return dest
+        elif isinstance(dest, str):
+            dport = dest.rpartition(':')[2].partition('/')[0]
+            proto_str = dest.partition('.')[2].partition(':')[0]
+            if (dport.isdigit() and int(dport) in _process_channels
+                    and is_on_this_machine(dest)
+                    and proto_str.lower() == 'udp'):
+                return int(dport)
+        return 0
+    
+    def send_coalesced(self, dest: str | int | Address, *args):
+        '''send a message to `dest` in the same OSC bundle as the other
+        messages sent with this method to the same destination,
+        until the next `flush_coalesced`.
+        
+        Pending messages are flushed at next `recv` start, and before
+        any `send` or `mega_send` to the same destination,
+        so the messages order is kept.'''
+        if self._stats is not None:
+            self._stats.record_out(args)
+
+        if self._coalescer.add(self._dest_key(dest), dest, args):
+            self._schedule_flush()
+    
+    def _schedule_flush(self):
+        '''called when a message is sent with `send_coalesced`
+        while no message was pending. Pending messages will be flushed
+        at next `recv`, nothing else to do here.'''
+        pass
+    
+    def flush_coalesced(self):
+        '''send now all messages sent with `send_coalesced`'''
+        for key, dest, messages in self._coalescer.take():
+            self._send_coalesced(key, dest, messages) # type:ignore
+    
+    @property
+    def coalesce_counters(self) -> dict[str | int, CoalesceCounter]:
+        '''messages and datagrams counts of `send_coalesced`,
+        for each destination (url or port)'''
+        return self._coalescer.counters
+    
+    def _coalesced_send_failed(self, dest: str | int | Address,
+                               error: OSError):
+        '''called when a send of coalesced messages to `dest` failed'''
+        _logger.warning(f'Failed to send messages to {dest}, {str(error)}')
+    
+    def _send_coalesced(self, key: str | int, dest: str | int | Address,
+                        messages: list[tuple]):
+        counter = self._coalescer.counters.get(key)
+        if counter is None:
+            counter = self._coalescer.counters[key] = CoalesceCounter()
+        counter.messages += len(messages)
+
+        dest_port = self._same_process_port(dest)
+        if dest_port:
+            _process_channels[dest_port].put_batch(self.port, messages)
+            counter.datagrams += 1
+            return
+
+        if self.sv is None:
+            return
+
+        size_key = (self.protocol, self._is_local_url(dest))
+        max_size = self._max_bundle_sizes.get(size_key)
+        if max_size is None:
+            max_size = self._probe_max_bundle_size()
+            self._max_bundle_sizes[size_key] = max_size
+
+        sizes = [osc_message_size(m) for m in messages]
+        n_messages = len(messages)
+        start = 0
+
+        try:
+            while start < n_messages:
+                end = start + 1
+                bundle_size = _BUNDLE_HEADER_SIZE + sizes[start] + 4
+                while (end < n_messages
+                        and bundle_size + sizes[end] + 4 <= max_size):
+                    bundle_size += sizes[end] + 4
+                    end += 1
+
+                if end - start == 1:
+                    self.sv.send(dest, *messages[start]) # type:ignore
+                else:
+                    self.sv.send(dest, Bundle( # type:ignore
+                        *[Message(*m) for m in messages[start:end]]))
+                counter.datagrams += 1
+                start = end
+
+        except OSError as e:
+            self._coalesced_send_failed(dest, e)
+        except BaseException as e:
+            _logger.warning(str(e))
+    
     def add_method(
             self, path: Optional[str], typespec: Optional[OscTypes],
             func: Callable[[], None], user_data=None):
         self._methods_adder.add(path, typespec, func, user_data)
         if self.sv is None:
             return
+
+        if path not in _MEGA_SEND_PATHS:
+            # messages of a pack received twice or out of order
+            # must not reach any method.
+            func = self._pack_filter.guarded(func)
         self.sv.add_method(path, typespec, func, user_data=user_data)
     
     def __bundle_head(
@@ -266,17 +527,20 @@ class BunServer:
             types: OscTypes, src_addr: Address):
         mega_send_id, pack_num, is_last = args
         self.send(src_addr, '/_bundle_head_reply', *args)
-        if is_last:
-            if self._mega_send_recv.get(mega_send_id) is not None:
-                self._mega_send_recv.pop(mega_send_id)
-        else:
-            if pack_num != 0:
-                last_pack_num = self._mega_send_recv.get(mega_send_id)
-                if self._mega_send_recv.get(mega_send_id) != pack_num - 1:
-                    _logger.error(f'mega send id {mega_send_id} '
-                                  f'missing package between {last_pack_num} '
-                                  f'and {pack_num}')
-            self._mega_send_recv[mega_send_id] = pack_num
+
+        expected = self._mega_send_recv.get(mega_send_id, 0)
+        if pack_num < expected:
+            # this pack has been resent because its tail reply
+            # has been lost, ignore its messages.
+            _logger.debug(f'mega send id {mega_send_id} pack {pack_num} '
+                          f'already received, ignored')
+            self._pack_filter.ignored = (mega_send_id, pack_num)
+        elif pack_num > expected:
+            # a previous pack is missing, messages must be executed
+            # in order, this pack will be sent again after the missing one.
+            _logger.debug(f'mega send id {mega_send_id} pack {pack_num} '
+                          f'received before pack {expected}, ignored')
+            self._pack_filter.ignored = (mega_send_id, pack_num)
     
     def __bundle_head_reply(
             self, path: str, args: list[int],
@@ -286,6 +550,21 @@ class BunServer:
     def __bundle_tail(
             self, path: str, args: list[int],
             types: OscTypes, src_addr: Address):
+        mega_send_id, pack_num, is_last = args
+
+        if self._pack_filter.ignored == (mega_send_id, pack_num):
+            self._pack_filter.ignored = None
+            if pack_num >= self._mega_send_recv.get(mega_send_id, 0):
+                # no reply, sender will send it again (go-back-N)
+                return
+        else:
+            if mega_send_id not in self._mega_send_recv:
+                if len(self._mega_send_recv) >= _MEGA_SEND_RECV_MEMORY:
+                    # forget the oldest mega send
+                    self._mega_send_recv.pop(
+                        next(iter(self._mega_send_recv)))
+            self._mega_send_recv[mega_send_id] = pack_num + 1
+
         self.send(src_addr, '/_bundle_tail_reply', *args)
     
     def __bundle_tail_reply(
@@ -297,7 +576,7 @@ class BunServer:
     def __local_mega_send(
             self, path: str, args: tuple[int, str],
             types: OscTypes, src_addr: Address):
-        mega_send_id, ms_path = args
+        mega_send_id, bulk_path = args
 
         if mega_send_id in self._mega_send_recv:
             # this mega_send has been already received
@@ -306,57 +585,43 @@ class BunServer:
                 f'local mega send {mega_send_id} ignored, already received')
             return
 
+        if not is_on_this_machine(src_addr.url):
+            _logger.warning(
+                f'__local_mega_send: refused from {src_addr.url}, '
+                'not on this machine')
+            return
+
         try:
-            with open(ms_path, 'r') as f:
-                events: list[tuple[str, float, int]] = json.load(f)
+            data = self._read_local_bulk(bulk_path)
+        except PermissionError as e:
+            _logger.warning(f'__local_mega_send: refused, {str(e)}')
+            return
         except BaseException as e:
             _logger.error(
-                f'__local_mega_send: failed to open file "{ms_path}"')
+                f'__local_mega_send: failed to read file "{bulk_path}"')
             return
-        
-        if not isinstance(events, list):
+
+        # sender can now release the memory
+        self.send(src_addr, '/_local_mega_send_done',
+                  mega_send_id, bulk_path)
+
+        try:
+            messages = decode_bulk(data)
+        except (ValueError, EOFError, TypeError):
             _logger.error(
-                f'__local_mega_send: wrong data in "{ms_path}"')
+                f'__local_mega_send: wrong data in "{bulk_path}"')
             return
         
-        try:
-            os.remove(ms_path)
-        except:
-            _logger.info(
-                f'__local_mega_send: Failed to remove tmp file {ms_path}')
-        
-        for event in events:
-            if not (isinstance(event, list) and len(event) > 0):
-                _logger.error(
-                    f'__local_mega_send: wrong data in "{ms_path}"')
-                return
-            
-            path, args_ = event[0], event[1:]
-            
-            types_func = self._methods_adder.get_func(path, list(args_))
-            if types_func is None:
-                continue
-            
-            types, func = types_func
-            
-            # transform args_ to nargs,
-            # especially if tuples are used to send arguments
-            # for example: ('d', 0.455751122211)
-            # here received in json, there are no tuples, only lists
-            # all other arg types seems to be kept.
-            nargs = []
-            for arg in args_:
-                if isinstance(arg, list) and len(arg) == 2:
-                    if arg[0] == 'm' and isinstance(arg[1], list):
-                        nargs.append(tuple(arg[1]))
-                    else:
-                        nargs.append(arg[1])
-                else:
-                    nargs.append(arg)
-            
-            osp = OscPack(path, nargs, types, src_addr)
-            self._exec_func(func, osp)
+        self._exec_messages(src_addr, messages, unwrap_typed=True)
     
+    def __local_mega_send_done(
+            self, path: str, args: tuple[int, str],
+            types: OscTypes, src_addr: Address):
+        mega_send_id, bulk_path = args
+        fd_time = self._local_bulks.pop(bulk_path, None)
+        if fd_time is not None and fd_time[0] >= 0:
+            os.close(fd_time[0])
+
     def __director(self, path: str, args: list[OscArg],
                    types: OscTypes, src_addr: Address):
         '''transmit messages received from methods added
@@ -377,7 +642,15 @@ class BunServer:
                 rejected_func(OscPack(path, args, types, src_addr))
             return
 
-        func(OscPack(path, args, types, src_addr))
+        stats = self._stats
+        if stats is None:
+            func(OscPack(path, args, types, src_addr))
+            return
+        
+        osp = OscPack(path, args, types, src_addr)
+        osp.recv_time = time.perf_counter()
+        func(osp)
+        stats.record_in((path, *args), time.perf_counter() - osp.recv_time)
     
     def add_nice_method(
             self, path: str, multypes: OscMulTypes,
@@ -392,6 +665,9 @@ class BunServer:
                 f'for path: {path}, {multypes} ignored')
             return
 
+        # compile multypes now, not at first message reception
+        compile_multypes(multypes)
+
         self._director_methods[path] = (multypes, func)
         for types in multypes.split('|'):
             if '.' in types or '*' in types:
@@ -425,31 +701,13 @@ class BunServer:
         same_proc_urls = list[str | int | Address]()
 
         for url in urls:
-            dest_port = 0
-
-            if isinstance(url, Address):
-                if (url.port in _process_port_queues
-                        and is_on_this_machine(url)
-                        and url.protocol == UDP):
-                    dest_port: int = url.port # type:ignore
-            elif isinstance(url, int):
-                if url in _process_port_queues:
-                    dest_port = url
-            elif isinstance(url, str):
-                dport = url.rpartition(':')[2].partition('/')[0]
-                proto_str = url.partition('.')[2].partition(':')[0]
-                if (dport.isdigit() and int(dport) in _process_port_queues
-                        and is_on_this_machine(url)
-                        and proto_str.lower() == 'udp'):
-                    dest_port = int(dport)
-
+            dest_port = self._same_process_port(url)
             if dest_port:
                 # we are sending a MegaSend to another instance 
-                # in the same process. No OSC communication is needed            
-                for path, *args in mega_send.tuples:
-                    _process_port_queues[dest_port].put(
-                        OscPack(path, args, get_types_with_args(args), # type:ignore
-                                Address(self.port)))
+                # in the same process. No OSC communication is needed,
+                # all messages are enqueued at once.
+                _process_channels[dest_port].put_batch(
+                    self.port, mega_send.tuples)
                 same_proc_urls.append(url)
 
         for same_proc_url in same_proc_urls:
@@ -457,6 +715,16 @@ class BunServer:
     
     def _mega_send_one_bundle(
             self, urls: list[str | int | Address], mega_send: MegaSend):
+        if self.protocol == UDP:
+            # a message is at least 8 bytes long, +4 for its size
+            # in the bundle, so large mega sends are rejected
+            # without computing messages sizes.
+            if (len(mega_send) * 12 > _UDP_MAX_SIZE
+                    or (_BUNDLE_HEADER_SIZE + _BUNDLE_MARKER_SIZE
+                        + mega_send.bundle_size()) > _UDP_MAX_SIZE):
+                # no need to create liblo messages, bundle would be too big
+                return
+
         head_msg = Message('/_bundle_head', mega_send.id, 0, IS_LAST) # type:ignore
         urls_done = set[str | int | Address]()
 
@@ -472,11 +740,118 @@ class BunServer:
         for url in urls_done:
             urls.remove(url)
     
-    def _mega_send_local_json(
+    def _read_local_bulk(self, bulk_path: str) -> bytes:
+        '''read a bulk written by `_write_local_bulk` of a BunServer
+        of the same user, raise PermissionError for any other file.
+        A bulk written in a file is removed once read.
+        
+        Data is decoded with marshal, which is not safe for data
+        written by someone else.'''
+        is_memfd = _PROC_FD_RE.fullmatch(bulk_path) is not None
+        if is_memfd:
+            # /proc/PID/fd/FD is a link to the memfd, it can be opened
+            # only by a process of the same user.
+            if not os.readlink(bulk_path).startswith(f'/memfd:{_MEMFD_NAME}'):
+                raise PermissionError(f'{bulk_path} is not a mega send memfd')
+            flags = os.O_RDONLY
+        else:
+            bulk_dir = os.path.dirname(bulk_path)
+            dir_stat = os.lstat(bulk_dir)
+            if not (os.path.basename(bulk_dir).startswith(
+                        _LOCAL_BULK_DIR_PREFIX)
+                    and stat.S_ISDIR(dir_stat.st_mode)
+                    and dir_stat.st_uid == os.getuid()
+                    and not dir_stat.st_mode & 0o077):
+                raise PermissionError(
+                    f'{bulk_dir} is not a private mega send directory')
+            flags = os.O_RDONLY | os.O_NOFOLLOW
+
+        fd = os.open(bulk_path, flags)
+        try:
+            file_stat = os.fstat(fd)
+            if not (stat.S_ISREG(file_stat.st_mode)
+                    and file_stat.st_uid == os.getuid()):
+                raise PermissionError(
+                    f'{bulk_path} is not a mega send of this user')
+
+            with os.fdopen(fd, 'rb', closefd=False) as f:
+                data = f.read()
+        finally:
+            os.close(fd)
+
+        if not is_memfd:
+            try:
+                os.remove(bulk_path)
+            except BaseException:
+                _logger.info(f'Failed to remove tmp file {bulk_path}')
+        return data
+
+    def _write_local_bulk(self, data: bytes) -> str:
+        '''write data in memory, in a memfd if possible, otherwise in a
+        file of a private directory in /dev/shm.
+        Return the path to read it.'''
+        if hasattr(os, 'memfd_create'):
+            fd = os.memfd_create(_MEMFD_NAME, os.MFD_CLOEXEC)
+            with os.fdopen(fd, 'wb', closefd=False) as f:
+                f.write(data)
+
+            bulk_path = f'/proc/{os.getpid()}/fd/{fd}'
+            if os.path.exists(bulk_path):
+                self._local_bulks[bulk_path] = (fd, time.time())
+                return bulk_path
+            os.close(fd)
+        
+        if not self._local_bulk_dir:
+            # mkdtemp creates the directory readable only by this user
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            self._local_bulk_dir = tempfile.mkdtemp(
+                prefix=_LOCAL_BULK_DIR_PREFIX, dir=shm_dir)
+
+        with tempfile.NamedTemporaryFile(
+                mode='wb', dir=self._local_bulk_dir, prefix='bulk_',
+                delete=False) as f:
+            f.write(data)
+        self._local_bulks[f.name] = (-1, time.time())
+        return f.name
+    
+    def _release_old_local_bulks(self, timeout=_LOCAL_BULK_TIMEOUT):
+        '''release bulks not read by their receiver
+        (probably dead) after `timeout` seconds'''
+        now = time.time()
+        for bulk_path, fd_time in list(self._local_bulks.items()):
+            fd, creation_time = fd_time
+            if now - creation_time < timeout:
+                continue
+
+            del self._local_bulks[bulk_path]
+            if fd >= 0:
+                os.close(fd)
+                continue
+
+            try:
+                os.remove(bulk_path)
+            except FileNotFoundError:
+                pass
+            except BaseException as e:
+                _logger.info(f'Failed to remove tmp file {bulk_path}')
+
+    def _release_local_bulks(self):
+        '''release all bulks not read yet, and their directory'''
+        self._release_old_local_bulks(0.0)
+        if self._local_bulk_dir:
+            try:
+                os.rmdir(self._local_bulk_dir)
+            except OSError:
+                pass
+            self._local_bulk_dir = ''
+
+    def _mega_send_local_bulk(
             self, urls: list[str | int | Address], mega_send: MegaSend):
-        '''for url on the same machine, create a .json file and send 
-        a message linking to it.'''
+        '''for url on the same machine, write all messages in memory
+        and send a message linking to it.'''
+        self._release_old_local_bulks()
         urls_done = set[str | int | Address]()
+        data: Optional[bytes] = None
         
         for url in urls:
             is_local = False
@@ -485,13 +860,22 @@ class BunServer:
             elif isinstance(url, (str, Address)):
                 is_local = is_on_this_machine(url)
 
-            if is_local:
-                tmp_file = tempfile.NamedTemporaryFile(
-                    mode='w+t', delete=False)
-                tmp_file.write(json.dumps(mega_send.tuples))
-                tmp_file.seek(0)
-                self.send(url, '/_local_mega_send', mega_send.id, tmp_file.name)
-                urls_done.add(url)
+            if not is_local:
+                continue
+            
+            if data is None:
+                data = encode_bulk(mega_send.tuples)
+
+            try:
+                bulk_path = self._write_local_bulk(data)
+            except OSError as e:
+                _logger.error(
+                    f'Failed to write local mega send {mega_send.ref}\n'
+                    f'{str(e)}')
+                continue
+
+            self.send(url, '/_local_mega_send', mega_send.id, bulk_path)
+            urls_done.add(url)
                 
         for url in urls_done:
             urls.remove(url)
@@ -508,6 +892,13 @@ class BunServer:
         urls = url.copy() if isinstance(url, list) else [url]
         if not urls:
             return True
+        
+        if self._coalescer.has_pending():
+            self.flush_coalesced()
+        
+        if self._stats is not None:
+            for message in mega_send.tuples:
+                self._stats.record_out(message, len(urls))
 
         self._mega_send_same_process(urls, mega_send)
         if self.sv is None or not urls:
@@ -517,89 +908,216 @@ class BunServer:
         if not urls:
             return True
 
-        self._mega_send_local_json(urls, mega_send)
+        self._mega_send_local_bulk(urls, mega_send)
         if not urls:
             return True
 
-        pack_len = min(len(mega_send.tuples) // 2, 100)
-        cutting = list[int]()
-        pack_can_grow = True
+        success = True
+        for url in urls:
+            if not self._mega_send_packs(url, mega_send):
+                success = False
+        return success
+    
+    def _is_local_url(self, url: str | int | Address) -> bool:
+        if isinstance(url, int):
+            return True
+        return is_on_this_machine(url)
+    
+    def _probe_max_bundle_size(self, size=_UDP_MAX_SIZE) -> int:
+        '''find the maximum size of a bundle that can be sent,
+        by sending test bundles to the reserved port, 
+        starting from `size`. Return 0 if no bundle can be sent.'''
+        if self.protocol != UDP:
+            # no datagram limit, but test can not be done
+            # because no server listens to the reserved port.
+            return size
 
-        while True:
-            start = 0
-            if cutting:
-                start = cutting[-1] + 1
-            
-            end = min(start + pack_len, len(mega_send.messages)) - 1
-            
+        while size >= _MIN_BUNDLE_SIZE:
+            # bundle containing only one message '/_p' with one string,
+            # its total size is at most `size`.
+            str_len = (size - _BUNDLE_HEADER_SIZE - 12) // 4 * 4 - 1
             try:
                 self.sv.send(
                     _RESERVED_PORT, # type:ignore
-                    Bundle(*[Message('/_bundle_head', 0x100000000, 0, 0)] # type:ignore
-                           + mega_send.messages[start:end]
-                           +[Message('/_bundle_tail', 0x100000000, 0, 0)])) # type:ignore
+                    Bundle(Message('/_p', 'p' * str_len))) # type:ignore
             except:
-                if pack_len == 1:
+                size //= 2
+            else:
+                return size
+        return 0
+    
+    def _cut_pack(self, mega_send: MegaSend, start: int,
+                  max_size: int) -> int:
+        '''return the end (excluded) of the pack starting at `start`,
+        for bundles of `max_size` bytes max.'''
+        sizes = mega_send.sizes
+        n_messages = len(sizes)
+        available = (max_size - _BUNDLE_HEADER_SIZE
+                     - 2 * _BUNDLE_MARKER_SIZE)
+        end = start
+        pack_size = 0
+        while (end < n_messages
+                and pack_size + sizes[end] + 4 <= available):
+            pack_size += sizes[end] + 4
+            end += 1
+        return end
+    
+    def _send_pack(self, url: str | int | Address, mega_send: MegaSend,
+                   pack_num: int, start: int, end: int):
+        is_last = IS_LAST if end == len(mega_send) else IS_NOT_LAST
+        self.sv.send( # type:ignore
+            url,
+            Bundle(
+                *[Message('/_bundle_head', mega_send.id, # type:ignore
+                          pack_num, is_last)] # type:ignore
+                + mega_send.messages[start:end]
+                +[Message('/_bundle_tail', mega_send.id, # type:ignore
+                          pack_num, is_last)])) # type:ignore
+    
+    def _mega_send_packs(self, url: str | int | Address,
+                         mega_send: MegaSend) -> bool:
+        '''send the mega send in several bundles, each one as big
+        as possible. The max bundle size is found only once per
+        protocol and locality of the destination, and found again
+        only when a send fails.
+        
+        Up to `mega_send_window` packs are sent without waiting for
+        their reply, a pack without reply is sent again after 
+        _PACK_RESEND_TIMEOUT. The receiver ignores packs received after
+        a missing one, so all packs after it are sent again, in order.'''
+        n_messages = len(mega_send)
+        size_key = (self.protocol, self._is_local_url(url))
+        checker = self._ms_checker
+        packs = list[tuple[int, int, int]]()
+        'start, end and size of each sent pack'
+        send_counts = list[int]()
+        send_times = list[float]()
+        waiting = set[int]()
+        'pack numbers sent without tail reply'
+        start = 0
+        success = True
+
+        while True:
+            for pack_num in [p for p in waiting
+                             if checker.tail_received(mega_send.id, p)]:
+                waiting.discard(pack_num)
+            
+            if start >= n_messages and not waiting:
+                break
+            
+            while (start < n_messages
+                    and len(waiting) < self.mega_send_window
+                    and (not waiting
+                         or sum([packs[p][2] for p in waiting])
+                            < self.mega_send_window_bytes)):
+                max_size = self._max_bundle_sizes.get(size_key)
+                if max_size is None:
+                    max_size = self._probe_max_bundle_size()
+                    self._max_bundle_sizes[size_key] = max_size
+
+                end = self._cut_pack(mega_send, start, max_size)
+                if end == start:
                     _logger.critical(
-                        f'One message is too big to be send'
+                        f'One message is too big to be sent '
                         f'by the mega send {mega_send.ref}')
+                    success = False
                     break
                 
-                pack_len //= 2
-                pack_can_grow = False
-            else:
-                if pack_can_grow:
-                    pack_len *= 2
-                cutting.append(end)
-                if end == len(mega_send.messages) - 1:
-                    break
-        
-        if not cutting:
-            return False
-
-        for url in urls:
-            start = 0
-            pack_num = 0
+                pack_num = len(packs)
+                checker.add_waiting(mega_send.id, pack_num)
+                
+                try:
+                    self._send_pack(url, mega_send, pack_num, start, end)
+                except BaseException as e:
+                    # max size found previously is not valid anymore,
+                    # find it again, smaller.
+                    _logger.info(
+                        f'Failed to send a bundle of {max_size} bytes '
+                        f'for mega send {mega_send.ref}, {str(e)}')
+                    self._max_bundle_sizes[size_key] = \
+                        self._probe_max_bundle_size(max_size // 2)
+                    continue
 
-            for c in cutting:
-                is_last = IS_LAST if c == cutting[-1] else IS_NOT_LAST
+                packs.append((start, end, mega_send.bundle_size(start, end)))
+                send_counts.append(1)
+                send_times.append(time.time())
+                waiting.add(pack_num)
+                start = end
             
-                self.sv.send(
-                    url,
-                    Bundle(
-                        *[Message('/_bundle_head', mega_send.id, # type:ignore
-                                  pack_num, is_last)] # type:ignore
-                        + mega_send.messages[start:c]
-                        +[Message('/_bundle_tail', mega_send.id, # type:ignore
-                                  pack_num, is_last)])) # type:ignore
-                regc = self.wait_mega_send_answer(mega_send, pack_num)
-                if not regc:
+            if not success:
+                break
+
+            # send again packs without reply since too long,
+            # and all the next ones (go-back-N).
+            now = time.time()
+            resending = False
+            for pack_num in sorted(waiting):
+                if (not resending
+                        and now - send_times[pack_num]
+                            < _PACK_RESEND_TIMEOUT):
+                    continue
+
+                resending = True
+
+                if send_counts[pack_num] >= _PACK_MAX_SENDS:
+                    _logger.info(
+                        f'too long wait for bundle '
+                        f'recv confirmation {mega_send.id}. {mega_send.ref}')
+                    success = False
                     break
+                
+                _logger.debug(f'send again pack {pack_num} '
+                              f'of mega send {mega_send.ref}')
+                try:
+                    pack_start, pack_end, pack_size = packs[pack_num]
+                    self._send_pack(
+                        url, mega_send, pack_num, pack_start, pack_end)
+                except BaseException as e:
+                    _logger.info(str(e))
+                send_counts[pack_num] += 1
+                send_times[pack_num] = now
             
-                start = c + 1
-                pack_num += 1
-        
-        return True
+            if not success:
+                break
+            
+            if waiting:
+                next_resend = min([send_times[p] for p in waiting]) \
+                    + _PACK_RESEND_TIMEOUT
+                self._wait_mega_send_replies(
+                    max(next_resend - time.time(), 0.001))
+
+        checker.forget(mega_send.id)
+        return success
+    
+    def _wait_mega_send_replies(self, timeout: float):
+        '''wait for mega send replies, or any other message.
+        `timeout` is in seconds.'''
+        self.recv(max(int(timeout * 1000), 1))
     
     def wait_mega_send_answer(
             self, mega_send: MegaSend, pack_num: int) -> bool:
+        if self.sv is None:
+            return True
+        
         self._ms_checker.add_waiting(mega_send.id, pack_num)
 
         start = time.time()
         
         while not self._ms_checker.head_received(mega_send.id, pack_num):
-            self.recv(10)
-            if time.time() - start >= 0.050:
+            remaining = 0.050 - (time.time() - start)
+            if remaining <= 0.0:
                 break
+            self._wait_mega_send_replies(remaining)
             
         while not self._ms_checker.previous_tail_received(
                 mega_send.id, pack_num):
-            self.recv(100)
-            if time.time() - start >= 5.000:
+            remaining = 5.000 - (time.time() - start)
+            if remaining <= 0.0:
                 _logger.info(
                     f'too long wait for bundle '
                     f'recv confirmation {mega_send.id}. {mega_send.ref}')
                 return False
+            self._wait_mega_send_replies(min(remaining, 0.100))
         return True
  
 
@@ -618,49 +1136,52 @@ class BunServerThread(BunServer):
         if self._thread is not None and self._thread.is_alive():
             return
         
-        if self._thread is None:
-            self._thread = Thread(target=self._main_loop)
+        self._terminated = False
+        self._thread = Thread(target=self._main_loop)
         self._thread.start()
         
     def stop(self):
         if self._thread is None:
             return
         self._terminated = True
+        self.wake()
         self._thread.join()
         self._thread = None
+        # messages sent with send_coalesced just before stop
+        # may not have been flushed by the thread.
+        self.flush_coalesced()
+        self._release_local_bulks()
+        # the pipe used by the thread to wait, created again if restarted
+        self._channel.close()
+
+    def free(self):
+        self.stop()
+        super().free()
     
     def _main_loop(self):
-        while not self._terminated:
-            self.recv(self.timeout)
-    
-    def wait_mega_send_answer(
-            self, mega_send: MegaSend, pack_num: int) -> bool:
-        if self.sv is None:
-            return True
-        
-        self._ms_checker.add_waiting(mega_send.id, pack_num)
+        # with UDP, recv is woken up by messages from OSC,
+        # from BunServers of the same process, or by `stop`.
+        timeout = None if self.protocol == UDP else self.timeout
 
-        start = time.time()
-        recv = current_thread() is self._thread
-        
-        while not self._ms_checker.head_received(mega_send.id, pack_num):
-            if recv:
-                self.sv.recv(10)
-            else:
-                time.sleep(0.001)
-            if time.time() - start >= 0.050:
-                break
-            
-        while not self._ms_checker.previous_tail_received(
-                mega_send.id, pack_num):
-            if recv:
-                self.sv.recv(100)
+        while not self._terminated:
+            if self.sv is None:
+                # no OSC port, only messages from BunServers of
+                # the same process, or `stop`, wake it up.
+                self._channel.wait()
+                self.recv(0)
             else:
-                time.sleep(0.001)
-
-            if time.time() - start >= 5.000:
-                _logger.info(
-                    f'too long wait for bundle '
-                    f'recv confirmation {mega_send.id}. {mega_send.ref}')
-                return False
-        return True
+                self.recv(timeout)
+        
+        self.flush_coalesced()
+    
+    def _schedule_flush(self):
+        if self._thread is not None and current_thread() is not self._thread:
+            # flush will be done by the thread of this server
+            self.wake()
+    
+    def _wait_mega_send_replies(self, timeout: float):
+        if self._thread is None or current_thread() is self._thread:
+            self.sv.recv(max(int(timeout * 1000), 1)) # type:ignore
+        else:
+            # replies are received by the thread of this server
+            self._ms_checker.wait(timeout)
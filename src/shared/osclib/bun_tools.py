@@ -1,14 +1,23 @@
-from inspect import signature, _ParameterKind
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from inspect import ismethod, signature, _ParameterKind
 import logging
-from typing import Callable, Optional
+import marshal
+import os
+import time
+from threading import Event, Lock
+from weakref import WeakMethod
+from typing import Callable, Iterator, Optional, Sequence
 
 
-from .bases import OscArg, OscTypes, get_types_with_args
+from .bases import OscArg, OscTypes, get_types_with_args, osc_message_size
 
 
 _logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=256)
 def number_of_args(func: Callable) -> int:
     sig = signature(func)
     num = 0
@@ -22,31 +31,357 @@ def number_of_args(func: Callable) -> int:
     return num
 
 
+_BULK_MAGIC = b'RAYBULK' + bytes([marshal.version])
+'''header of encoded MegaSend bulks, contains the marshal version'''
+
+
+def _plain_arg(arg: OscArg) -> OscArg:
+    '''convert subclasses (IntEnum for example) to their base type,
+    marshal does not accept them.'''
+    if isinstance(arg, bool) or arg is None:
+        return arg
+    if isinstance(arg, int):
+        return int(arg)
+    if isinstance(arg, float):
+        return float(arg)
+    if isinstance(arg, str):
+        return str(arg)
+    if isinstance(arg, bytes):
+        return bytes(arg)
+    if isinstance(arg, (tuple, list)):
+        return tuple(_plain_arg(a) for a in arg) # type:ignore
+    return arg
+
+def encode_bulk(messages: list[tuple]) -> bytes:
+    '''encode messages (tuples (path, *args)) to be read by 
+    `decode_bulk` in another process.
+    Arg types are exactly preserved, including typed tuples
+    as ('d', 0.455751122211).'''
+    try:
+        return _BULK_MAGIC + marshal.dumps(messages)
+    except ValueError:
+        return _BULK_MAGIC + marshal.dumps(
+            [tuple(_plain_arg(a) for a in msg) for msg in messages])
+
+def decode_bulk(data: bytes) -> list[tuple]:
+    '''decode messages encoded with `encode_bulk`,
+    raise ValueError if data is not valid'''
+    if not data.startswith(_BULK_MAGIC):
+        raise ValueError('data is not an encoded bulk of messages')
+    
+    messages = marshal.loads(data[len(_BULK_MAGIC):])
+    if not isinstance(messages, list):
+        raise ValueError('data is not an encoded bulk of messages')
+
+    for message in messages:
+        if not (isinstance(message, tuple)
+                and message
+                and isinstance(message[0], str)):
+            raise ValueError('encoded bulk contains an invalid message')
+    return messages
+
+
+class ProcessChannel:
+    '''Receives messages sent by other BunServers of the same process,
+    without any OSC communication.
+    
+    Messages are tuples (path, *args), they are delivered by batches,
+    a batch being a sequence of messages sent by the same port.
+    A MegaSend is one batch, whatever its number of messages.
+    
+    `deque.append` and `deque.popleft` are thread safe, so no lock
+    is needed, `wakeup` is set each time a batch is added.
+    
+    For a use with `select`, `fileno()` returns the read end of a pipe
+    in which one byte is written each time a batch is added.
+    The pipe is closed by `close`, and created again at next `fileno`.'''
+    def __init__(self):
+        self._batches = deque[tuple[int, Sequence[tuple]]]()
+        self.wakeup = Event()
+        self._pipe_r = -1
+        self._pipe_w = -1
+        self._pipe_lock = Lock()
+        'prevents a write in the pipe while it is closed'
+
+    def fileno(self) -> int:
+        with self._pipe_lock:
+            if self._pipe_r < 0:
+                self._pipe_r, self._pipe_w = os.pipe()
+                os.set_blocking(self._pipe_r, False)
+                os.set_blocking(self._pipe_w, False)
+                if self._batches or self.wakeup.is_set():
+                    # woken up before the pipe creation
+                    self._write_pipe()
+            return self._pipe_r
+
+    def close(self):
+        '''close the pipe, if `fileno` created it'''
+        with self._pipe_lock:
+            if self._pipe_r < 0:
+                return
+            os.close(self._pipe_r)
+            os.close(self._pipe_w)
+            self._pipe_r = -1
+            self._pipe_w = -1
+
+    def _write_pipe(self):
+        try:
+            os.write(self._pipe_w, b'\0')
+        except BlockingIOError:
+            # pipe is full, reader will wake up anyway
+            pass
+
+    def wake(self):
+        '''wake up the reader, even if there is no message'''
+        self.wakeup.set()
+        if self._pipe_w >= 0:
+            # Lock is not awaited. It can be held by the reader thread
+            # itself (wake called from a signal handler), or by a thread
+            # reading, creating or writing the pipe, then the reader
+            # is already awake or will be.
+            if not self._pipe_lock.acquire(blocking=False):
+                return
+            try:
+                if self._pipe_w >= 0:
+                    self._write_pipe()
+            finally:
+                self._pipe_lock.release()
+
+    def put(self, src_port: int, message: tuple):
+        self._batches.append((src_port, (message,)))
+        self.wake()
+
+    def put_batch(self, src_port: int, messages: Sequence[tuple]):
+        self._batches.append((src_port, messages))
+        self.wake()
+
+    def has_messages(self) -> bool:
+        return bool(self._batches)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        '''wait until a batch is added, return False on timeout'''
+        return self.wakeup.wait(timeout)
+
+    def drain(self) -> Iterator[tuple[int, Sequence[tuple]]]:
+        '''yield all batches (src_port, messages) until channel is empty'''
+        self.wakeup.clear()
+        if self._pipe_r >= 0:
+            with self._pipe_lock:
+                try:
+                    while self._pipe_r >= 0 and os.read(self._pipe_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+        while True:
+            try:
+                yield self._batches.popleft()
+            except IndexError:
+                break
+
+
+@dataclass
+class CoalesceCounter:
+    '''counts of messages sent with `send_coalesced` to a destination,
+    and of datagrams (bundles or single messages) used to send them.'''
+    messages: int = 0
+    datagrams: int = 0
+
+
+class OutgoingCoalescer:
+    '''Messages waiting to be sent together, for each destination.
+    Messages can be added from any thread.'''
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = dict[str | int, tuple[object, list[tuple]]]()
+        self.counters = dict[str | int, CoalesceCounter]()
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def add(self, key: str | int, dest: object, message: tuple) -> bool:
+        '''add a message for the destination `dest`, identified by `key`.
+        Return True if no message was pending before.'''
+        with self._lock:
+            was_empty = not self._pending
+            dest_messages = self._pending.get(key)
+            if dest_messages is None:
+                self._pending[key] = (dest, [message])
+            else:
+                dest_messages[1].append(message)
+        return was_empty
+
+    def take(self, key: Optional[str | int] = None
+             ) -> list[tuple[str | int, object, list[tuple]]]:
+        '''remove and return pending messages as a list of
+        (key, dest, messages), for all destinations if `key` is None.'''
+        with self._lock:
+            if key is None:
+                pending, self._pending = self._pending, {}
+                return [(k, d_m[0], d_m[1]) for k, d_m in pending.items()]
+
+            dest_messages = self._pending.pop(key, None)
+            if dest_messages is None:
+                return []
+            return [(key, dest_messages[0], dest_messages[1])]
+
+
+_HISTO_BUCKETS = 16
+'''number of buckets in durations histograms, bucket n contains
+durations lower than 2**n microseconds, the last one all the longer ones.'''
+
+
+def _histo_bucket(duration: float) -> int:
+    return min(int(duration * 1000000).bit_length(), _HISTO_BUCKETS - 1)
+
+
+class PathStats:
+    '''traffic and handler durations of one OSC path'''
+    __slots__ = ('msgs_in', 'bytes_in', 'msgs_out', 'bytes_out',
+                 'handler_time', 'handler_histo',
+                 'handoff_time', 'handoff_histo',
+                 'main_time', 'main_histo')
+
+    def __init__(self):
+        self.msgs_in = 0
+        self.bytes_in = 0
+        self.msgs_out = 0
+        self.bytes_out = 0
+        self.handler_time = 0.0
+        self.handler_histo = [0] * _HISTO_BUCKETS
+        self.handoff_time = 0.0
+        'time between reception and main thread execution'
+        self.handoff_histo = [0] * _HISTO_BUCKETS
+        self.main_time = 0.0
+        'execution time in the main thread'
+        self.main_histo = [0] * _HISTO_BUCKETS
+
+    @staticmethod
+    def _histo_str(histo: list[int]) -> str:
+        '''histogram as "<1us:n <2us:n ..." without empty buckets'''
+        bucket_strs = list[str]()
+        for i, count in enumerate(histo):
+            if not count:
+                continue
+            if i == _HISTO_BUCKETS - 1:
+                bucket_strs.append(f'>={1 << (i - 1)}us:{count}')
+            else:
+                bucket_strs.append(f'<{1 << i}us:{count}')
+        return ' '.join(bucket_strs)
+
+    def lines(self, path: str) -> list[str]:
+        lines = [f'{path}  in: {self.msgs_in} msgs {self.bytes_in} B'
+                 f'  out: {self.msgs_out} msgs {self.bytes_out} B']
+        if self.msgs_in:
+            lines.append(
+                f'    handler: {self.handler_time * 1000:.3f}ms  '
+                + self._histo_str(self.handler_histo))
+        if self.main_time:
+            lines.append(
+                f'    main thread hand-off: {self.handoff_time * 1000:.3f}ms  '
+                + self._histo_str(self.handoff_histo))
+            lines.append(
+                f'    main thread handler: {self.main_time * 1000:.3f}ms  '
+                + self._histo_str(self.main_histo))
+        return lines
+
+
+class OscStats:
+    '''Per path OSC statistics of a BunServer, recorded only
+    when enabled with `BunServer.enable_stats`.
+    
+    Counters can be increased from several threads without lock,
+    a few counts could be lost, this is acceptable for statistics.'''
+    def __init__(self):
+        self.paths = dict[str, PathStats]()
+        self.start_time = time.time()
+
+    def _get(self, path: str) -> PathStats:
+        path_stats = self.paths.get(path)
+        if path_stats is None:
+            path_stats = self.paths[path] = PathStats()
+        return path_stats
+
+    def record_in(self, message: tuple, duration: float):
+        '''record a received message (path, *args) and the execution
+        time of its handler'''
+        path_stats = self._get(message[0])
+        path_stats.msgs_in += 1
+        path_stats.bytes_in += osc_message_size(message)
+        path_stats.handler_time += duration
+        path_stats.handler_histo[_histo_bucket(duration)] += 1
+
+    def record_out(self, message: tuple, n_dests=1):
+        '''record a message (path, *args) sent to `n_dests` destinations'''
+        path_stats = self._get(message[0])
+        path_stats.msgs_out += n_dests
+        path_stats.bytes_out += osc_message_size(message) * n_dests
+
+    def record_main_thread(self, path: str, handoff: float, duration: float):
+        '''record the time between reception and execution
+        in the main thread (`handoff`), and the execution time'''
+        path_stats = self._get(path)
+        path_stats.handoff_time += handoff
+        path_stats.handoff_histo[_histo_bucket(handoff)] += 1
+        path_stats.main_time += duration
+        path_stats.main_histo[_histo_bucket(duration)] += 1
+
+    def lines(self) -> list[str]:
+        '''human readable stats, paths with the most expensive handlers
+        first, then the most used ones.'''
+        lines = [f'OSC stats since {time.time() - self.start_time:.1f}s']
+        for path, path_stats in sorted(
+                self.paths.items(),
+                key=lambda p_s: (p_s[1].handler_time + p_s[1].main_time,
+                                 p_s[1].msgs_in + p_s[1].msgs_out),
+                reverse=True):
+            lines += path_stats.lines(path)
+        return lines
+
+
 class MegaSendChecker(dict[tuple[int, int], int]):
+    '''receive state of mega send packs. Replies can be received
+    by another thread than the sender one, changes are locked.'''
     _NO_RECV = 0
     _HEAD_RECV = 1
     _QUEUE_RECV = 2
     
     def __init__(self):
         super().__init__()
+        self._changed = Event()
+        self._lock = Lock()
 
     def head_recv(self, mega_send_id: int, pack_num: int):
         bundler_id = (mega_send_id, pack_num)
-        if not bundler_id in self:
-            return
-        
-        self[bundler_id] = self._HEAD_RECV
+        with self._lock:
+            if not bundler_id in self:
+                return
+            self[bundler_id] = self._HEAD_RECV
+        self._changed.set()
 
     def tail_recv(self, mega_send_id: int, pack_num: int):
         bundler_id = (mega_send_id, pack_num)
-        if not bundler_id in self:
-            return
-        
-        self[bundler_id] = self._QUEUE_RECV
+        with self._lock:
+            if not bundler_id in self:
+                return
+            self[bundler_id] = self._QUEUE_RECV
+        self._changed.set()
+    
+    def wait(self, timeout: float):
+        '''wait until a reply is received (from another thread)
+        or timeout (in seconds)'''
+        self._changed.wait(timeout)
+        self._changed.clear()
+    
+    def forget(self, mega_send_id: int):
+        '''remove all packs of this mega send'''
+        with self._lock:
+            for bundler_id in [b for b in self if b[0] == mega_send_id]:
+                del self[bundler_id]
             
     def add_waiting(self, mega_send_id: int, pack_num: int):
         bundler_id = (mega_send_id, pack_num)
-        self[bundler_id] = self._NO_RECV
+        with self._lock:
+            self[bundler_id] = self._NO_RECV
 
     def head_received(self, mega_send_id: int, pack_num: int) -> bool:
         bundler_id = (mega_send_id, pack_num)
@@ -55,6 +390,9 @@ class MegaSendChecker(dict[tuple[int, int], int]):
         
         return self[bundler_id] != self._NO_RECV
         
+    def tail_received(self, mega_send_id: int, pack_num: int) -> bool:
+        return self.get((mega_send_id, pack_num)) == self._QUEUE_RECV
+        
     def previous_tail_received(
             self, mega_send_id: int, pack_num: int) -> bool:
         if pack_num == 0:
@@ -65,9 +403,126 @@ class MegaSendChecker(dict[tuple[int, int], int]):
         return self[bundler_id] == self._QUEUE_RECV
 
 
+class PackFilter:
+    '''Drops the messages of a mega send pack received twice
+    or after a missing pack, before any method is called.
+
+    `ignored` is set by the bundle head of such a pack and reset by its
+    tail, liblo dispatches the messages of the bundle between them.'''
+    def __init__(self):
+        self.ignored: Optional[tuple[int, int]] = None
+        '''(mega_send_id, pack_num) of the pack being dispatched,
+        if its messages must not be transmitted'''
+
+    def guarded(self, func: Callable) -> Callable:
+        '''return a function to add to liblo in place of `func`,
+        calling it except for messages of an ignored pack.
+
+        As liblo does, a bound method is only weakly referenced.'''
+        n_args = number_of_args(func)
+        if ismethod(func):
+            func_ref = WeakMethod(func)
+        else:
+            func_ref = lambda: func
+
+        def guarded_func(path, args, types, src_addr, user_data):
+            if self.ignored is not None:
+                return
+            func = func_ref()
+            if func is None:
+                return
+            match n_args:
+                case 0: return func()
+                case 1: return func(path)
+                case 2: return func(path, args)
+                case 3: return func(path, args, types)
+                case 4: return func(path, args, types, src_addr)
+            return func(path, args, types, src_addr, user_data)
+
+        return guarded_func
+
+
+def _is_char(arg: OscArg) -> bool:
+    return isinstance(arg, str) and len(arg) == 1
+
+def _is_none(arg: OscArg) -> bool:
+    return arg is None
+
+def _is_true(arg: OscArg) -> bool:
+    return arg is True
+
+def _is_false(arg: OscArg) -> bool:
+    return arg is False
+
+def _is_midi(arg: OscArg) -> bool:
+    return isinstance(arg, tuple) and len(arg) == 4
+
+def _is_anything(arg: OscArg) -> bool:
+    return True
+
+
+_TYPE_CLASSES: dict[str, type] = {
+    's': str, 'S': str,
+    'f': float, 'd': float, 't': float, 'I': float,
+    'i': int, 'h': int,
+    'b': bytes}
+'type letters which can be checked with a simple isinstance'
+
+_TYPE_CHECKERS: dict[str, Callable[[OscArg], bool]] = {
+    'c': _is_char,
+    'N': _is_none,
+    'T': _is_true,
+    'F': _is_false,
+    'm': _is_midi}
+'type letters which need a specific check function'
+
+
+def compile_types_validator(
+        typespec: OscTypes) -> Callable[[list[OscArg]], bool]:
+    '''return a function checking if a list of args (of the same length
+    than `typespec`) matches with `typespec`.
+    
+    The check functions are chosen once here, so the returned function
+    does not have to parse `typespec` at each call.'''
+    if not typespec:
+        return lambda args: True
+
+    if all(c in _TYPE_CLASSES for c in typespec):
+        classes = tuple(_TYPE_CLASSES[c] for c in typespec)
+        return lambda args: all(map(isinstance, args, classes))
+    
+    checkers = list[Callable[[OscArg], bool]]()
+    for c in typespec:
+        type_class = _TYPE_CLASSES.get(c)
+        if type_class is not None:
+            checkers.append(
+                lambda arg, type_class=type_class: isinstance(arg, type_class))
+        else:
+            # unknown type letters accept any argument
+            checkers.append(_TYPE_CHECKERS.get(c, _is_anything))
+
+    return lambda args: all(
+        checker(arg) for checker, arg in zip(checkers, args))
+
+
 class MethodsAdder:
+    '''Keeps the methods added to a BunServer, to be able to find
+    the function to call when a message is received without OSC
+    (from a BunServer in the same process).
+    
+    Methods are indexed by path and number of arguments, and each
+    typespec validator is compiled at `add()` time.'''
     def __init__(self):
         self._dict = dict[str | None, list[tuple[str | None, Callable]]]()
+        self._typed_index = dict[
+            tuple[str | None, int],
+            list[tuple[OscTypes, Callable[[list[OscArg]], bool],
+                       Callable[[], None]]]]()
+        '''typed methods, indexed by (path, number of args)'''
+        self._untyped_funcs = dict[str | None, Callable[[], None]]()
+        '''methods added with None typespec, indexed by path.
+        Such a method is always the last effective one for its path,
+        because all next add_method for this path are refused.'''
         
     def _already_associated_by(
             self, path: str | None, typespec: OscTypes | None) \
@@ -112,67 +567,36 @@ class MethodsAdder:
             self._dict[path] = [(typespec, func)]
         else:
             type_funcs.append((typespec, func))
+        
+        if typespec is None:
+            self._untyped_funcs[path] = func
+            return
+        
+        index_key = (path, len(typespec))
+        validators = self._typed_index.get(index_key)
+        if validators is None:
+            validators = self._typed_index[index_key] = []
+        validators.append(
+            (typespec, compile_types_validator(typespec), func))
 
-    def _get_func_in_list(
-            self, args: list[OscArg],
-            type_funcs: list[tuple[OscTypes | None, Callable[[], None]]]) \
+    def _get_path_func(
+            self, path: str | None, args: list[OscArg]) \
                 -> Optional[tuple[OscTypes, Callable[[], None]]]:
-        for types, func in type_funcs:
-            if types is None:
-                return get_types_with_args(args), func
-            
-            if len(types) != len(args):
-                continue
-            
-            for i in range(len(types)):
-                c = types[i]
-                a = args[i]
-                if isinstance(a, tuple) and len(a) == 2:
-                    if a[0] != c:
-                        break
-                
-                match c:
-                    case 'c':
-                        if not (isinstance(a, str) and len(a) == 1):
-                            break
-                    case 's'|'S':
-                        if not isinstance(a, str):
-                            break
-                    case 'f'|'d'|'t'|'I':
-                        if not isinstance(a, float):
-                            break
-                    case 'i'|'h':
-                        if not isinstance(a, int):
-                            break
-                    case 'b':
-                        if not isinstance(a, bytes):
-                            break
-                    case 'N':
-                        if a is not None:
-                            break
-                    case 'T':
-                        if a is not True:
-                            break
-                    case 'F':
-                        if a is not False:
-                            break
-                    case 'm':
-                        if not (isinstance(a, tuple)
-                                and len(a) == 4):
-                            break
-            else:
-                return types, func
+        validators = self._typed_index.get((path, len(args)))
+        if validators is not None:
+            for types, validator, func in validators:
+                if validator(args):
+                    return types, func
+        
+        func = self._untyped_funcs.get(path)
+        if func is not None:
+            return get_types_with_args(args), func
 
     def get_func(
             self, path: str, args: list[OscArg]) \
                 -> tuple[OscTypes, Callable[[], None]] | None:
-        type_funcs = self._dict.get(path)
-        if type_funcs is not None:
-            types_func = self._get_func_in_list(args, type_funcs)
-            if types_func is not None:
-                return types_func
+        types_func = self._get_path_func(path, args)
+        if types_func is not None:
+            return types_func
         
-        none_type_funcs = self._dict.get(None)
-        if none_type_funcs is not None:
-            return self._get_func_in_list(args, none_type_funcs)
-
+        return self._get_path_func(None, args)
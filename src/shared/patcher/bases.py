@@ -1,9 +1,11 @@
 
 # Imports from standard library
+import heapq
 from queue import Queue
+import re
 import time
 from enum import IntEnum
-from typing import Iterator, Optional, TypeAlias
+from typing import Callable, Container, Iterable, Iterator, Optional, TypeAlias
 
 
 # Type aliases
@@ -30,16 +32,194 @@ class PortType(IntEnum):
     MIDI = 2
 
 
-class JackPort:
-    # is_new is used to prevent reconnections
-    # when a disconnection has not been saved and one new port append.
-    id = 0
-    name = ''
-    mode = PortMode.NULL
-    type = PortType.NULL
-    is_new = False
+class ConnectionList(dict[tuple[FullPortName, FullPortName], None]):
+    '''Ordered set of connections (port_out, port_in).
+    
+    Has the `append` and `remove` methods of a list,
+    but membership tests are done in constant time.'''
+    def append(self, conn: tuple[FullPortName, FullPortName]):
+        self[conn] = None
+    
+    def extend(self, conns: Iterable[tuple[FullPortName, FullPortName]]):
+        for conn in conns:
+            self[conn] = None
+    
+    def remove(self, conn: tuple[FullPortName, FullPortName]):
+        del self[conn]
     
+    def discard(self, conn: tuple[FullPortName, FullPortName]):
+        self.pop(conn, None)
+
+
+class ConnectionRule:
+    '''Saved connection rule, connects each output port whose full name
+    matches the `from_pattern` regex to the input port named by the
+    `to_template`, where `\\1`, `\\g<name>`... are replaced with the
+    groups of the match.
     
+    Raise `re.error` if `from_pattern` is not a valid regex.'''
+    def __init__(self, from_pattern: str, to_template: str):
+        self.from_pattern = from_pattern
+        self.to_template = to_template
+        self.regex = re.compile(from_pattern)
+        self.prefix = self._literal_prefix(from_pattern)
+        '''literal start of the names matching from_pattern'''
+
+    @staticmethod
+    def _literal_prefix(pattern: str) -> str:
+        if '|' in pattern:
+            # alternatives can start with anything
+            return ''
+        
+        prefix = ''
+        for char in pattern:
+            if char in '*?{':
+                # previous char is optional
+                return prefix[:-1]
+            if char in '.^$+[]()\\':
+                return prefix
+            prefix += char
+        return prefix
+
+    def target(self, port_name: FullPortName) -> Optional[FullPortName]:
+        '''full name of the input port to connect to the output port
+        `port_name`, None if this port does not match the rule.'''
+        match = self.regex.fullmatch(port_name)
+        if match is None:
+            return None
+        
+        try:
+            return match.expand(self.to_template)
+        except (re.error, IndexError):
+            return None
+
+
+class RuleIndex:
+    '''ConnectionRules indexed by the literal prefix
+    of their from_pattern.
+    
+    For a port name, only rules whose prefix starts the name are tried,
+    with one dict lookup per distinct prefix length.'''
+    def __init__(self):
+        self._rules = list[ConnectionRule]()
+        self._by_prefix = dict[str, list[ConnectionRule]]()
+        self._prefix_lens = list[int]()
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def __iter__(self) -> Iterator[ConnectionRule]:
+        return iter(self._rules)
+
+    def add(self, rule: ConnectionRule):
+        self._rules.append(rule)
+        self._by_prefix.setdefault(rule.prefix, []).append(rule)
+        if len(rule.prefix) not in self._prefix_lens:
+            self._prefix_lens.append(len(rule.prefix))
+            self._prefix_lens.sort()
+
+    def clear(self):
+        self._rules.clear()
+        self._by_prefix.clear()
+        self._prefix_lens.clear()
+
+    def targets(self, port_name: FullPortName) -> list[FullPortName]:
+        '''full names of input ports to connect to the output port
+        `port_name`.'''
+        targets = list[FullPortName]()
+        for prefix_len in self._prefix_lens:
+            if prefix_len > len(port_name):
+                break
+            
+            for rule in self._by_prefix.get(port_name[:prefix_len], ()):
+                target = rule.target(port_name)
+                if target is not None and target not in targets:
+                    targets.append(target)
+        return targets
+
+
+class JackPort:
+    __slots__ = ('id', 'name', 'mode', 'type', 'is_new')
+
+    def __init__(self, name: FullPortName = '', mode=PortMode.NULL,
+                 port_type=PortType.NULL, is_new=False):
+        self.id = 0
+        self.name = name
+        self.mode = mode
+        self.type = port_type
+        # is_new is used to prevent reconnections
+        # when a disconnection has not been saved and one new port append.
+        self.is_new = is_new
+
+
+class PortRegistry:
+    '''JackPorts indexed by full port name, for each port mode.
+    A name is unique for a port mode, but an input and an output port
+    can have the same name (with ALSA).'''
+    def __init__(self):
+        self._mode_ports = dict[PortMode, dict[FullPortName, JackPort]]()
+        for port_mode in PortMode:
+            self._mode_ports[port_mode] = dict[FullPortName, JackPort]()
+
+    def __contains__(self, port_name: FullPortName) -> bool:
+        for mode_ports in self._mode_ports.values():
+            if port_name in mode_ports:
+                return True
+        return False
+
+    def __iter__(self) -> Iterator[JackPort]:
+        for mode_ports in self._mode_ports.values():
+            yield from mode_ports.values()
+
+    def __len__(self) -> int:
+        return sum([len(mp) for mp in self._mode_ports.values()])
+
+    def mode(self, port_mode: PortMode) -> dict[FullPortName, JackPort]:
+        '''ports of this mode, keyed by name. Do not modify it.'''
+        return self._mode_ports[port_mode]
+
+    def get(self, port_name: FullPortName,
+            port_mode: Optional[PortMode] = None) -> Optional[JackPort]:
+        '''port with this name, of `port_mode` if possible'''
+        if port_mode is not None:
+            port = self._mode_ports[port_mode].get(port_name)
+            if port is not None:
+                return port
+
+        for mode_ports in self._mode_ports.values():
+            port = mode_ports.get(port_name)
+            if port is not None:
+                return port
+
+    def add(self, port: JackPort):
+        '''add a port, replacing the one with the same name
+        and mode if any'''
+        self._mode_ports[port.mode][port.name] = port
+
+    def pop(self, port_name: FullPortName,
+            port_mode: Optional[PortMode] = None) -> Optional[JackPort]:
+        '''remove and return the port with this name,
+        of `port_mode` if possible'''
+        port = self.get(port_name, port_mode)
+        if port is not None:
+            del self._mode_ports[port.mode][port_name]
+        return port
+
+    def rename(self, old_name: FullPortName, new_name: FullPortName,
+               port_mode: Optional[PortMode] = None) -> Optional[JackPort]:
+        port = self.pop(old_name, port_mode)
+        if port is None:
+            return None
+
+        port.name = new_name
+        self.add(port)
+        return port
+
+    def clear(self):
+        for mode_ports in self._mode_ports.values():
+            mode_ports.clear()
+
+
 class ProtoEngine:
     XML_TAG = 'RAY-PATCH'
     EXECUTABLE = 'ray-patch'
@@ -52,8 +232,7 @@ class ProtoEngine:
         return True
 
     def fill_ports_and_connections(
-            self, port_list: dict[PortMode, list[JackPort]],
-            connection_list: list[tuple[str, str]]):
+            self, ports: PortRegistry, connection_list: ConnectionList):
         ...
     def connect_ports(self, port_out: str, port_in: str):
         ...
@@ -81,35 +260,169 @@ class MonitorStates(IntEnum):
 
 
 class Timer:
-    _last_ask = 0.0
+    _deadline = 0.0
     _duration: float
     
-    def __init__(self, duration: float):
+    def __init__(self, duration: float,
+                 scheduler: 'Optional[Scheduler]' = None):
         self._duration = duration
+        self._scheduler = scheduler
+    
+    @property
+    def deadline(self) -> float:
+        '''`time.monotonic()` value at which the timer elapses,
+        0.0 if not started'''
+        return self._deadline
         
     def start(self):
-        self._last_ask = time.time()
+        self._deadline = time.monotonic() + self._duration
+        if self._scheduler is not None:
+            self._scheduler.push(self)
+
+    def stop(self):
+        self._deadline = 0.0
         
     def elapsed(self) -> bool:
-        if not self._last_ask:
+        if not self._deadline:
             return False
         
-        elapsed = time.time() - self._last_ask >= self._duration
+        elapsed = time.monotonic() >= self._deadline
         if elapsed:
-            self._last_ask = 0.0
+            self._deadline = 0.0
         return elapsed
 
 
+class Scheduler:
+    '''Heap of Timer deadlines, gives the time to wait
+    until the next one.'''
+    def __init__(self):
+        self._heap = list[tuple[float, int, Timer]]()
+        self._count = 0
+    
+    def push(self, timer: Timer):
+        self._count += 1
+        heapq.heappush(self._heap, (timer.deadline, self._count, timer))
+    
+    def timeout(self) -> Optional[float]:
+        '''seconds until the next timer deadline,
+        None if no timer is started.'''
+        while self._heap:
+            deadline, count, timer = self._heap[0]
+            if timer.deadline != deadline:
+                # timer has been restarted or has elapsed
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, deadline - time.monotonic())
+        return None
+
+
+def coalesce_events(
+        events: list[tuple[Event, tuple]],
+        pending_connections: Container[tuple[FullPortName, FullPortName]]
+            = ()) -> list[tuple[Event, tuple]]:
+    '''remove events without effect on the final state:
+    
+    - a port added then removed
+    - a connection added then removed, or removed then added
+    - a port renamed and renamed back
+    
+    A chain of renames of the same port becomes one rename,
+    a port added then renamed is added with its new name.
+    Ports are identified by name, mode and type.
+    
+    A connection in `pending_connections` (requested and waited for)
+    added then removed keeps its events, so the requester knows
+    the connection has been made.'''
+    result = list[Optional[tuple[Event, tuple]]]()
+    added_ports = dict[tuple[FullPortName, PortMode, PortType], int]()
+    'index in result of PORT_ADDED events, by port name, mode and type'
+    renamed_ports = dict[tuple[FullPortName, PortMode, PortType], int]()
+    'index in result of PORT_RENAMED events, by new name, mode and type'
+    conns = dict[tuple[FullPortName, FullPortName], int]()
+    'index in result of the last event of a connection'
+    
+    for event, args in events:
+        match event:
+            case Event.PORT_ADDED:
+                name, mode, type_ = args
+                added_ports[(name, mode, type_)] = len(result)
+            
+            case Event.PORT_REMOVED:
+                name, mode, type_ = args
+                index = added_ports.pop((name, mode, type_), None)
+                if index is not None:
+                    result[index] = None
+                    continue
+            
+            case Event.PORT_RENAMED:
+                old, new, mode, type_ = args
+                index = added_ports.pop((old, mode, type_), None)
+                if index is not None:
+                    result[index] = (Event.PORT_ADDED, (new, mode, type_))
+                    added_ports[(new, mode, type_)] = index
+                    continue
+
+                index = renamed_ports.pop((old, mode, type_), None)
+                if index is not None:
+                    old = result[index][1][0] # type:ignore
+                    result[index] = None
+                    if old == new:
+                        continue
+                    args = (old, new, mode, type_)
+                renamed_ports[(new, mode, type_)] = len(result)
+            
+            case Event.CONNECTION_ADDED | Event.CONNECTION_REMOVED:
+                index = conns.pop(args, None)
+                if (index is not None
+                        and result[index][0] is not event # type:ignore
+                        and not (event is Event.CONNECTION_REMOVED
+                                 and args in pending_connections)):
+                    result[index] = None
+                    continue
+                conns[args] = len(result)
+
+        result.append((event, args))
+    
+    return [ev for ev in result if ev is not None]
+
+
 class EventHandler:
     def __init__(self):
         self._event_queue = Queue()
+        self.wake_callback: Optional[Callable[[], None]] = None
+        '''called when an event is added, to wake up the loop
+        waiting for events'''
+        self._wake_pending = False
+        self.coalesce = True
+        '''events without effect on the final state are removed
+        before being given by `new_events`'''
+        self.pending_connections: Container[
+            tuple[FullPortName, FullPortName]] = ()
+        '''connections requested and not added yet,
+        their CONNECTION_ADDED events are never removed'''
+        self.n_received = 0
+        'number of events received'
+        self.n_applied = 0
+        'number of events given by `new_events`'
     
     def add_event(self, event: Event, *args):
         self._event_queue.put((event, args))
+        if self.wake_callback is not None and not self._wake_pending:
+            self._wake_pending = True
+            self.wake_callback()
 
     def new_events(self) -> Iterator[tuple[Event, tuple]]:
+        self._wake_pending = False
+        events = list[tuple[Event, tuple]]()
         while self._event_queue.qsize():
-            yield self._event_queue.get()
+            events.append(self._event_queue.get())
+        
+        self.n_received += len(events)
+        if self.coalesce and len(events) > 1:
+            events = coalesce_events(events, self.pending_connections)
+        self.n_applied += len(events)
+        
+        yield from events
 
 
 class Glob:
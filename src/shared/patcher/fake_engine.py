@@ -0,0 +1,224 @@
+'''Engine simulating a JACK graph, without any JACK server.
+
+Used to measure the Patcher behavior with many ports and connections
+(see src/tests/bench_patcher.py). Ports, connections and event storms
+are made by the caller, possibly from another thread than the Patcher.
+'''
+
+# Imports from standard library
+import logging
+from threading import Condition
+from typing import Iterable, Optional
+
+# imports from shared
+from .bases import (
+    EventHandler, Event, JackPort, PortMode, PortType, ProtoEngine,
+    FullPortName, PortRegistry, ConnectionList)
+
+
+_logger = logging.getLogger(__name__)
+
+
+class FakeEngine(ProtoEngine):
+    XML_TAG = 'RAY-PATCH'
+    EXECUTABLE = 'ray-fakepatch'
+    NSM_NAME = 'Fake Connections'
+
+    def __init__(self, event_handler: EventHandler):
+        super().__init__(event_handler)
+        self.ports = PortRegistry()
+        self.connections = ConnectionList()
+        self.n_connect_requests = 0
+        self.n_disconnect_requests = 0
+        self._cond = Condition()
+        'protects ports and connections, notified at each graph change'
+        self._expected: Optional[set[tuple[FullPortName, FullPortName]]] = None
+        self._n_expected = 0
+        'number of connections in self._expected currently connected'
+
+    # ---- ProtoEngine ----
+
+    def fill_ports_and_connections(
+            self, ports: PortRegistry, connection_list: ConnectionList):
+        with self._cond:
+            for port in self.ports:
+                jack_port = JackPort()
+                jack_port.name = port.name
+                jack_port.mode = port.mode
+                jack_port.type = port.type
+                ports.add(jack_port)
+            connection_list.extend(self.connections)
+
+    def connect_ports(self, port_out: str, port_in: str):
+        with self._cond:
+            self.n_connect_requests += 1
+        self.add_connection(port_out, port_in)
+
+    def disconnect_ports(self, port_out: str, port_in: str):
+        with self._cond:
+            self.n_disconnect_requests += 1
+        self.remove_connection(port_out, port_in)
+
+    # ---- graph changes ----
+
+    def add_port(self, port_name: FullPortName, port_mode: PortMode,
+                 port_type=PortType.AUDIO):
+        port = JackPort()
+        port.name = port_name
+        port.mode = port_mode
+        port.type = port_type
+
+        with self._cond:
+            if self.ports.get(port_name, port_mode) is not None:
+                return
+            self.ports.add(port)
+            self._cond.notify_all()
+        self.ev_handler.add_event(
+            Event.PORT_ADDED, port_name, port_mode, port_type)
+
+    def remove_port(self, port_name: FullPortName, port_mode: PortMode):
+        '''remove the port and its connections'''
+        port = self.ports.mode(port_mode).get(port_name)
+        if port is not None:
+            self._remove_ports([port])
+
+    def _remove_ports(self, ports: list[JackPort]):
+        '''remove ports, after all their connections'''
+        outputs = {p.name for p in ports if p.mode is PortMode.OUTPUT}
+        inputs = {p.name for p in ports if p.mode is PortMode.INPUT}
+        with self._cond:
+            conns = [conn for conn in self.connections
+                     if conn[0] in outputs or conn[1] in inputs]
+
+        for conn in conns:
+            self.remove_connection(*conn)
+
+        for port in ports:
+            with self._cond:
+                if self.ports.mode(port.mode).get(port.name) is not port:
+                    continue
+                self.ports.pop(port.name, port.mode)
+                self._cond.notify_all()
+            self.ev_handler.add_event(
+                Event.PORT_REMOVED, port.name, port.mode, port.type)
+
+    def rename_port(self, old_name: FullPortName, new_name: FullPortName,
+                    port_mode: PortMode):
+        '''rename the port, its connections are renamed too,
+        without any connection event (as JACK does).'''
+        with self._cond:
+            port = self.ports.rename(old_name, new_name, port_mode)
+            if port is None:
+                return
+
+            conns = ConnectionList()
+            for conn in self.connections:
+                if port_mode is PortMode.OUTPUT and conn[0] == old_name:
+                    conns.append((new_name, conn[1]))
+                elif port_mode is PortMode.INPUT and conn[1] == old_name:
+                    conns.append((conn[0], new_name))
+                else:
+                    conns.append(conn)
+            self.connections = conns
+            self._count_expected()
+            self._cond.notify_all()
+        self.ev_handler.add_event(
+            Event.PORT_RENAMED, old_name, new_name, port_mode, port.type)
+
+    def add_connection(self, port_out: FullPortName, port_in: FullPortName):
+        conn = (port_out, port_in)
+        with self._cond:
+            if (conn in self.connections
+                    or port_out not in self.ports.mode(PortMode.OUTPUT)
+                    or port_in not in self.ports.mode(PortMode.INPUT)):
+                return
+            self.connections.append(conn)
+            if self._expected is not None and conn in self._expected:
+                self._n_expected += 1
+            self._cond.notify_all()
+        self.ev_handler.add_event(Event.CONNECTION_ADDED, *conn)
+
+    def remove_connection(self, port_out: FullPortName,
+                          port_in: FullPortName):
+        conn = (port_out, port_in)
+        with self._cond:
+            if conn not in self.connections:
+                return
+            del self.connections[conn]
+            if self._expected is not None and conn in self._expected:
+                self._n_expected -= 1
+            self._cond.notify_all()
+        self.ev_handler.add_event(Event.CONNECTION_REMOVED, *conn)
+
+    def stop_server(self):
+        '''as if JACK stopped'''
+        self.ev_handler.add_event(Event.JACK_STOPPED)
+
+    # ---- clients ----
+
+    @staticmethod
+    def client_port_names(
+            client_name: str, n_outputs: int, n_inputs: int
+            ) -> tuple[list[FullPortName], list[FullPortName]]:
+        return ([f'{client_name}:out_{i + 1}' for i in range(n_outputs)],
+                [f'{client_name}:in_{i + 1}' for i in range(n_inputs)])
+
+    def add_client(self, client_name: str, n_outputs: int, n_inputs: int,
+                   port_type=PortType.AUDIO):
+        '''add a client with ports named "out_1", "in_1"...'''
+        outputs, inputs = self.client_port_names(
+            client_name, n_outputs, n_inputs)
+        for port_name in outputs:
+            self.add_port(port_name, PortMode.OUTPUT, port_type)
+        for port_name in inputs:
+            self.add_port(port_name, PortMode.INPUT, port_type)
+
+    def client_ports(self, client_name: str) -> list[JackPort]:
+        prefix = client_name + ':'
+        with self._cond:
+            return [p for p in self.ports if p.name.startswith(prefix)]
+
+    def remove_client(self, client_name: str):
+        '''remove all ports of the client, and their connections'''
+        self._remove_ports(self.client_ports(client_name))
+
+    def restart_client(self, client_name: str):
+        '''remove all ports of the client, then add them again,
+        without their connections.'''
+        ports = self.client_ports(client_name)
+        self._remove_ports(ports)
+        for port in ports:
+            self.add_port(port.name, port.mode, port.type)
+
+    def rename_client(self, old_name: str, new_name: str):
+        for port in self.client_ports(old_name):
+            self.rename_port(
+                port.name, new_name + port.name[len(old_name):], port.mode)
+
+    # ---- waiting ----
+
+    def _count_expected(self):
+        if self._expected is not None:
+            self._n_expected = sum(
+                1 for conn in self._expected if conn in self.connections)
+
+    def wait_connections(
+            self, conns: Iterable[tuple[FullPortName, FullPortName]],
+            timeout: float, exact=False) -> bool:
+        '''wait until all conns are connected, and only them if `exact`.
+
+        Return False if it is not the case after `timeout` seconds.'''
+        expected = set(conns)
+
+        def done() -> bool:
+            if self._n_expected < len(expected):
+                return False
+            return not exact or len(self.connections) == len(expected)
+
+        with self._cond:
+            self._expected = expected
+            self._count_expected()
+            try:
+                return self._cond.wait_for(done, timeout)
+            finally:
+                self._expected = None
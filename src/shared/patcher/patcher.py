@@ -1,8 +1,13 @@
 
+from itertools import chain
 import logging
+import math
 import os
-import sys
+import re
+import time
+from typing import TextIO
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 
 from jack_renaming_tools import (
     port_belongs_to_client, port_name_client_replaced)
@@ -16,14 +21,45 @@ from .bases import (
     PortMode,
     PortType,
     JackPort,
+    PortRegistry,
+    ConnectionList,
+    ConnectionRule,
+    RuleIndex,
     MonitorStates,
     ProtoEngine,
     Timer,
+    Scheduler,
     Event,
     debug_conn_str)
 
 _logger = logging.getLogger(__name__)
 
+_CONNECT_TIMEOUT = 1.0
+'''seconds after which a requested connection not added
+is not considered as in progress anymore'''
+
+_CONNECT_RATE_BURST = 0.200
+'''with a connect rate limit, seconds of connections that can be
+requested at once, after a pause.'''
+
+
+_XML_ATTR_ENTITIES = {
+    '"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#09;'}
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        _logger.warning(f'{name} environment variable must be a number')
+        return default
+
+
+def _xml_attrs(attribs: dict[str, str]) -> str:
+    return ''.join(f' {key}="{escape(value, _XML_ATTR_ENTITIES)}"'
+                   for key, value in attribs.items())
+
+
 class Patcher:
     def __init__(
             self, engine: ProtoEngine, nsm_server: NsmServer,
@@ -32,17 +68,44 @@ class Patcher:
         self.engine = engine
         self._logger = logger
         self.brothers_dict = dict[NsmClientName, JackClientBaseName]()
-        self.connection_list = list[tuple[FullPortName, FullPortName]]()
-        self.saved_connections = list[tuple[FullPortName, FullPortName]]()
-        self.to_disc_connections = list[tuple[FullPortName, FullPortName]]()
-        self.jack_ports = dict[PortMode, list[JackPort]]()
-        for port_mode in (PortMode.NULL, PortMode.INPUT, PortMode.OUTPUT):
-            self.jack_ports[port_mode] = list[JackPort]()
-
-        self.timer_dirty_check = Timer(0.300)
-        self.timer_connect_check = Timer(0.200)
+        self.connection_list = ConnectionList()
+        self.saved_connections = ConnectionList()
+        self.to_disc_connections = ConnectionList()
+        self.ports = PortRegistry()
+        self.rules = RuleIndex()
+        'saved connection rules'
+        self.rule_connections = ConnectionList()
+        'connections from present output ports given by the rules'
+
+        self.scheduler = Scheduler()
+        self.timer_dirty_check = Timer(0.300, self.scheduler)
+        self.timer_connect_check = Timer(0.200, self.scheduler)
+
+        self.connect_batch = int(_env_number('RAY_PATCH_CONNECT_BATCH', 1))
+        '''max number of saved connections requested and not yet added
+        while restoring, 0 for no limit.'''
+        self.connect_rate = _env_number('RAY_PATCH_CONNECT_RATE', 0.0)
+        '''max number of connections requested per second
+        while restoring, 0 for no limit.'''
+        self._connecting = dict[tuple[FullPortName, FullPortName], float]()
+        'connections requested and not added yet, with request time'
+        self._connect_failed = set[tuple[FullPortName, FullPortName]]()
+        'connections not added after request, not requested again'
+        self._next_connect_time = 0.0
+        self._restore_start = 0.0
+        self._restore_count = 0
+        
+        self._generation = 0
+        '''incremented at each change of the saved content'''
+        self._saved_generation = -1
+        self._saved_path = ''
         
         self.nsm_server = nsm_server
+        # new engine events wake up the run loop
+        self.engine.ev_handler.wake_callback = self.nsm_server.wake
+        # a requested connection added then removed in the same batch
+        # must still be seen as added, not as failed.
+        self.engine.ev_handler.pending_connections = self._connecting
         self.nsm_server.set_callbacks({
             NsmCallback.OPEN: self.open_file,
             NsmCallback.SAVE: self.save_file,
@@ -56,14 +119,18 @@ class Patcher:
 
     def run_loop(self, stop_with_jack=True):
         self.engine.fill_ports_and_connections(
-            self.jack_ports, self.connection_list)
+            self.ports, self.connection_list)
         jack_stopped = False
 
         while True:
             if self.glob.terminate:
                 break
 
-            self.nsm_server.recv(50)
+            # wait for NSM messages or engine events,
+            # or until the next timer deadline.
+            timeout = self.scheduler.timeout()
+            self.nsm_server.recv(
+                None if timeout is None else math.ceil(timeout * 1000))
 
             for event, args in self.engine.ev_handler.new_events():
                 match event:
@@ -85,7 +152,7 @@ class Patcher:
                 break
             
             if self.timer_connect_check.elapsed():
-                self.may_make_one_connection()
+                self.may_make_connections()
 
             if self.timer_dirty_check.elapsed():
                 self.timer_dirty_finished()
@@ -94,6 +161,7 @@ class Patcher:
 
     def stop(self, *args):
         self.glob.terminate = True
+        self.nsm_server.wake()
 
     def set_dirty_clean(self):
         self.glob.is_dirty = False
@@ -114,9 +182,26 @@ class Patcher:
             self.nsm_server.send_dirty_state(False)
             self.glob.dirty_state_sent = True
 
+    def _present_ports(self, conn: tuple[FullPortName, FullPortName]) -> bool:
+        '''True if both ports of the connection exist'''
+        return (conn[0] in self.ports.mode(PortMode.OUTPUT)
+                and conn[1] in self.ports.mode(PortMode.INPUT))
+
+    def _add_rule_connections(self, port_name: FullPortName):
+        for target in self.rules.targets(port_name):
+            self.rule_connections.append((port_name, target))
+
+    def _remove_rule_connections(self, port_name: FullPortName):
+        for target in self.rules.targets(port_name):
+            self.rule_connections.discard((port_name, target))
+
+    def _content_changed(self):
+        self._generation += 1
+
     def is_dirty_now(self) -> bool:
         for conn in self.connection_list:
-            if not conn in self.saved_connections:
+            if (conn not in self.saved_connections
+                    and conn not in self.rule_connections):
                 # There is at least one present connection unsaved                
                 return True
 
@@ -124,10 +209,7 @@ class Patcher:
             if sv_con in self.connection_list:
                 continue
 
-            if (sv_con[0] in [
-                        p.name for p in self.jack_ports[PortMode.OUTPUT]]
-                    and sv_con[1] in [
-                        p.name for p in self.jack_ports[PortMode.INPUT]]):
+            if self._present_ports(sv_con):
                 # There is at least one saved connection not present
                 # despite the fact its two ports are present.
                 return True
@@ -141,7 +223,10 @@ class Patcher:
         port.type = PortType(port_type)
         port.is_new = True
 
-        self.jack_ports[port.mode].append(port)
+        self.ports.add(port)
+        if port.mode is PortMode.OUTPUT:
+            self._add_rule_connections(port_name)
+        self._content_changed()
         self.timer_connect_check.start()
         
         # dirty checker timer is longer than timer connect
@@ -151,53 +236,49 @@ class Patcher:
 
     def port_removed(
             self, port_name: str, port_mode: PortMode, port_type: PortType):
-        for port in self.jack_ports[port_mode]:
-            if port.name == port_name and port.type == port_type:
-                self.jack_ports[port_mode].remove(port)
-                break
-        
-        else:
-            # strange, but in some cases,
-            # JACK does not sends the good port mode at remove time.
-            for pmode in (PortMode.INPUT, PortMode.OUTPUT):
-                if pmode is port_mode:
-                    continue
-                
-                for port in self.jack_ports[pmode]:
-                    if port.name == port_name and port.type == port_type:
-                        self.jack_ports[pmode].remove(port)
-                        break
-                break
+        # port of another mode can be removed, because in some cases,
+        # JACK does not sends the good port mode at remove time.
+        port = self.ports.get(port_name, port_mode)
+        if port is not None and port.type == port_type:
+            self.ports.pop(port_name, port.mode)
+            if port.mode is PortMode.OUTPUT:
+                self._remove_rule_connections(port_name)
+            self._content_changed()
 
     def port_renamed(
             self, old_name: str, new_name: str,
             port_mode: PortMode, port_type: PortType):
-        for port in self.jack_ports[port_mode]:
-            if port.name == old_name and port.type == port_type:
-                port.name = new_name
-                port.is_new = True
-                self.timer_connect_check.start()
-                break
+        port = self.ports.mode(port_mode).get(old_name)
+        if port is not None and port.type == port_type:
+            self.ports.rename(old_name, new_name, port_mode)
+            if port.mode is PortMode.OUTPUT:
+                self._remove_rule_connections(old_name)
+                self._add_rule_connections(new_name)
+            port.is_new = True
+            self._content_changed()
+            self.timer_connect_check.start()
         
     def connection_added(self, port_str_a: str, port_str_b: str):
         self.connection_list.append((port_str_a, port_str_b))
+        self._content_changed()
+        self._connecting.pop((port_str_a, port_str_b), None)
 
         if self.glob.pending_connection:
-            self.may_make_one_connection()
+            self.may_make_connections()
 
         if (port_str_a, port_str_b) not in self.saved_connections:
             self.timer_dirty_check.start()
             
     def connection_removed(self, port_str_a: str, port_str_b: str):
-        if (port_str_a, port_str_b) in self.connection_list:
-            self.connection_list.remove((port_str_a, port_str_b))
+        self.connection_list.discard((port_str_a, port_str_b))
+        self._content_changed()
 
         if self.to_disc_connections:
-            self.may_make_one_connection()
+            self.may_make_connections()
 
         self.timer_dirty_check.start()
 
-    def may_make_one_connection(self):
+    def may_make_connections(self):
         if self.glob.allow_disconnections:
             if self.to_disc_connections:
                 for to_disc_con in self.to_disc_connections:
@@ -208,34 +289,70 @@ class Patcher:
                 else:
                     self.to_disc_connections.clear()
 
-        output_ports = [p.name for p in self.jack_ports[PortMode.OUTPUT]]
-        input_ports = [p.name for p in self.jack_ports[PortMode.INPUT]]
-        new_output_ports = [p.name for p in self.jack_ports[PortMode.OUTPUT]
-                            if p.is_new]
-        new_input_ports = [p.name for p in self.jack_ports[PortMode.INPUT]
-                           if p.is_new]
-
-        one_connected = False
-
-        for sv_con in self.saved_connections:
+        output_ports = self.ports.mode(PortMode.OUTPUT)
+        input_ports = self.ports.mode(PortMode.INPUT)
+        new_output_ports = {p.name for p in output_ports.values()
+                            if p.is_new}
+        new_input_ports = {p.name for p in input_ports.values()
+                           if p.is_new}
+
+        now = time.time()
+        if self.connect_rate > 0.0:
+            self._next_connect_time = max(
+                self._next_connect_time, now - _CONNECT_RATE_BURST)
+
+        for conn, request_time in list(self._connecting.items()):
+            if now - request_time > _CONNECT_TIMEOUT:
+                self._logger.warning(f'{debug_conn_str(conn)} failed')
+                del self._connecting[conn]
+                self._connect_failed.add(conn)
+
+        for sv_con in chain(self.saved_connections, self.rule_connections):
             if (not sv_con in self.connection_list
+                    and sv_con not in self._connecting
+                    and sv_con not in self._connect_failed
                     and sv_con[0] in output_ports
                     and sv_con[1] in input_ports
                     and (sv_con[0] in new_output_ports
                          or sv_con[1] in new_input_ports)):
-                if one_connected:
+                if ((self.connect_batch
+                        and len(self._connecting) >= self.connect_batch)
+                        or now < self._next_connect_time):
                     self.glob.pending_connection = True
+                    if now < self._next_connect_time:
+                        # limited by rate, no CONNECTION_ADDED event
+                        # will call this again.
+                        self.timer_connect_check.start()
                     break
 
+                if not self._restore_start:
+                    self._restore_start = now
+                    self._restore_count = 0
+
                 self._logger.info(f'connect ports: {sv_con}')
                 self.engine.connect_ports(*sv_con)
-                one_connected = True
+                self._connecting[sv_con] = now
+                self._restore_count += 1
+                if self.connect_rate > 0.0:
+                    self._next_connect_time += 1.0 / self.connect_rate
         else:
+            if self._connecting:
+                # wait for the requested connections
+                self.glob.pending_connection = True
+                self.timer_connect_check.start()
+                return
+
             self.glob.pending_connection = False
+            self._connect_failed.clear()
 
-            for port_mode in (PortMode.INPUT, PortMode.OUTPUT):
-                for port in self.jack_ports[port_mode]:
-                    port.is_new = False
+            for port in self.ports:
+                port.is_new = False
+            
+            if self._restore_start:
+                self._logger.info(
+                    f'{self._restore_count} connections restored in '
+                    f'{time.time() - self._restore_start:.3f}s')
+                self._restore_start = 0.0
 
     # ---- NSM callbacks ----
 
@@ -243,6 +360,9 @@ class Patcher:
                   full_client_id: str) -> tuple[Err, str]:
         _logger.info(f'Open file "{project_path}"')
         self.saved_connections.clear()
+        self.rules.clear()
+        self.rule_connections.clear()
+        self._content_changed()
 
         file_path = project_path + '.xml'
         self.glob.file_path = file_path
@@ -265,9 +385,9 @@ class Patcher:
                 return (Err.BAD_PROJECT,
                         f'{file_path} is not a {XML_TAG} .xml file')
             
-            graph_ports = dict[PortMode, list[str]]()
+            graph_ports = dict[PortMode, set[str]]()
             for port_mode in (PortMode.INPUT, PortMode.OUTPUT):
-                graph_ports[port_mode] = list[str]()
+                graph_ports[port_mode] = set[str]()
             
             for child in root:
                 if child.tag == 'connection':
@@ -307,6 +427,23 @@ class Patcher:
                             continue
                         
                     self.saved_connections.append((port_from, port_to))
+
+                elif child.tag == 'rule':
+                    from_pattern: str = child.attrib.get('from', '')
+                    to_template: str = child.attrib.get('to', '')
+                    if not from_pattern or not to_template:
+                        self._logger.warning(
+                            f'rule from "{from_pattern}" '
+                            f'to "{to_template}" is incomplete.')
+                        continue
+
+                    try:
+                        self.rules.add(
+                            ConnectionRule(from_pattern, to_template))
+                    except re.error as e:
+                        self._logger.warning(
+                            f'rule from "{from_pattern}" is not a valid '
+                            f'regular expression: {e}')
             
                 elif child.tag == 'graph':
                     for gp in child:
@@ -315,22 +452,26 @@ class Patcher:
                         gp_name = gp.attrib['name']
                         for pt in gp:
                             if pt.tag == 'out_port':
-                                graph_ports[PortMode.OUTPUT].append(
+                                graph_ports[PortMode.OUTPUT].add(
                                     ':'.join((gp_name, pt.attrib['name'])))
                             elif pt.tag == 'in_port':
-                                graph_ports[PortMode.INPUT].append(
+                                graph_ports[PortMode.INPUT].add(
                                     ':'.join((gp_name, pt.attrib['name'])))
 
             # re-declare all ports as new in case we are switching session
-            for port_mode in (PortMode.INPUT, PortMode.OUTPUT):
-                for port in self.jack_ports[port_mode]:
-                    port.is_new = True
+            for port in self.ports:
+                port.is_new = True
+
+            if self.rules:
+                for port_name in self.ports.mode(PortMode.OUTPUT):
+                    self._add_rule_connections(port_name)
 
             self.to_disc_connections.clear()
             # disconnect connections not existing at last save
             # if their both ports were present in the graph.
             for conn in self.connection_list:
                 if (conn not in self.saved_connections
+                        and conn not in self.rule_connections
                         and conn[0] in graph_ports[PortMode.OUTPUT]
                         and conn[1] in graph_ports[PortMode.INPUT]):
                     self.to_disc_connections.append(conn)
@@ -338,7 +479,7 @@ class Patcher:
             if self.glob.open_done_once:
                 self.glob.allow_disconnections = True
 
-            self.may_make_one_connection()
+            self.may_make_connections()
 
         self.glob.is_dirty = False
         self.glob.open_done_once = True
@@ -349,8 +490,18 @@ class Patcher:
         if not self.glob.file_path:
             return
 
+        if (self._generation == self._saved_generation
+                and self.glob.file_path == self._saved_path
+                and os.path.isfile(self.glob.file_path)):
+            # nothing changed since last save
+            self._logger.info(f'file unchanged: {self.glob.file_path}')
+            self.set_dirty_clean()
+            return (Err.OK, 'Done')
+
+        # connections given by a rule are not saved one by one
         for connection in self.connection_list:
-            if not connection in self.saved_connections:
+            if (connection not in self.saved_connections
+                    and connection not in self.rule_connections):
                 self.saved_connections.append(connection)
 
         # delete from saved connected all connections 
@@ -359,71 +510,105 @@ class Patcher:
 
         for sv_con in self.saved_connections:
             if (not sv_con in self.connection_list
-                    and sv_con[0] in [
-                        p.name for p in self.jack_ports[PortMode.OUTPUT]]
-                    and sv_con[1] in [
-                        p.name for p in self.jack_ports[PortMode.INPUT]]):
+                    and self._present_ports(sv_con)):
                 del_list.append(sv_con)
                 
         for del_con in del_list:
             self.saved_connections.remove(del_con)
 
-        # write the XML file
-        root = ET.Element(self.engine.XML_TAG)
-        for sv_con in self.saved_connections:
-            conn_el = ET.SubElement(root, 'connection')
-            conn_el.attrib['from'], conn_el.attrib['to'] = sv_con
-            jack_con_from_name = sv_con[0].partition(':')[0].partition('/')[0]
-            jack_con_to_name = sv_con[1].partition(':')[0].partition('/')[0]
-            for key, value in self.brothers_dict.items():
-                if jack_con_from_name == value:
-                    conn_el.attrib['nsm_client_from'] = key
-                if jack_con_to_name == value:
-                    conn_el.attrib['nsm_client_to'] = key
-
-        graph = ET.SubElement(root, 'graph')
-        group_names = dict[str, ET.Element]()
-
-        for port_mode in (PortMode.INPUT, PortMode.OUTPUT):
-            el_name = 'in_port' if port_mode is PortMode.INPUT else 'out_port'
-
-            for jack_port in self.jack_ports[port_mode]:
-                gp_name, colon, port_name = jack_port.name.partition(':')
-                if group_names.get(gp_name) is None:
-                    group_names[gp_name] = ET.SubElement(graph, 'group')
-                    group_names[gp_name].attrib['name'] = gp_name
-
-                    gp_base_name = gp_name.partition('/')[0]
-                    for key, value in self.brothers_dict.items():
-                        if value == gp_base_name:
-                            group_names[gp_name].attrib['nsm_client'] = key
-                            break
-
-                out_port_el = ET.SubElement(group_names[gp_name], el_name)
-                out_port_el.attrib['name'] = port_name
-        
-        if sys.version_info >= (3, 9):
-            # we can indent the xml tree since python3.9
-            ET.indent(root, space='  ', level=0)
-
         self._logger.info(f'save file: {self.glob.file_path}')
-        tree = ET.ElementTree(root)
+        # write a temporary file and replace the file with it,
+        # the file is never left half written.
+        tmp_path = self.glob.file_path + '.tmp'
         try:
-            tree.write(self.glob.file_path)
+            # same encoding than the previous ElementTree.write,
+            # ASCII with non ASCII characters as character references.
+            with open(tmp_path, 'w', encoding='ascii',
+                      errors='xmlcharrefreplace') as f:
+                self._write_xml(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.glob.file_path)
         except:
             self._logger.error(f'unable to write file {self.glob.file_path}')
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
             self.glob.terminate = True
             return
 
+        self._saved_generation = self._generation
+        self._saved_path = self.glob.file_path
         self.set_dirty_clean()
         return (Err.OK, 'Done')
 
+    def _write_xml(self, file: TextIO):
+        '''write the saved connections and the graph of present ports
+        to file, element by element.'''
+        # NSM client of each JACK client base name,
+        # the last one if several NSM clients have the same JACK name
+        nsm_clients = dict[JackClientBaseName, NsmClientName]()
+        # for groups, the first one
+        gp_nsm_clients = dict[JackClientBaseName, NsmClientName]()
+        for key, value in self.brothers_dict.items():
+            nsm_clients[value] = key
+            gp_nsm_clients.setdefault(value, key)
+
+        xml_tag = self.engine.XML_TAG
+        file.write(f'<{xml_tag}>\n')
+
+        for rule in self.rules:
+            attribs = {'from': rule.from_pattern, 'to': rule.to_template}
+            file.write(f'  <rule{_xml_attrs(attribs)} />\n')
+
+        for sv_con in self.saved_connections:
+            attribs = {'from': sv_con[0], 'to': sv_con[1]}
+            jack_con_from_name = sv_con[0].partition(':')[0].partition('/')[0]
+            jack_con_to_name = sv_con[1].partition(':')[0].partition('/')[0]
+            nsm_client_from = nsm_clients.get(jack_con_from_name)
+            if nsm_client_from is not None:
+                attribs['nsm_client_from'] = nsm_client_from
+            nsm_client_to = nsm_clients.get(jack_con_to_name)
+            if nsm_client_to is not None:
+                attribs['nsm_client_to'] = nsm_client_to
+            file.write(f'  <connection{_xml_attrs(attribs)} />\n')
+
+        # ports are grouped by JACK client, groups keep the order
+        # of their first port.
+        groups = dict[str, list[tuple[str, str]]]()
+        for port_mode in (PortMode.INPUT, PortMode.OUTPUT):
+            el_name = 'in_port' if port_mode is PortMode.INPUT else 'out_port'
+
+            for jack_port in self.ports.mode(port_mode).values():
+                gp_name, colon, port_name = jack_port.name.partition(':')
+                groups.setdefault(gp_name, []).append((el_name, port_name))
+
+        if not groups:
+            file.write('  <graph />\n')
+        else:
+            file.write('  <graph>\n')
+            for gp_name, gp_ports in groups.items():
+                attribs = {'name': gp_name}
+                nsm_client = gp_nsm_clients.get(gp_name.partition('/')[0])
+                if nsm_client is not None:
+                    attribs['nsm_client'] = nsm_client
+                file.write(f'    <group{_xml_attrs(attribs)}>\n')
+                for el_name, port_name in gp_ports:
+                    file.write(f'      <{el_name}'
+                               f'{_xml_attrs({"name": port_name})} />\n')
+                file.write('    </group>\n')
+            file.write('  </graph>\n')
+
+        file.write(f'</{xml_tag}>')
+
     def monitor_client_state(
             self, client_id: str, jack_name: str, is_started: int):
         if self.glob.monitor_states_done is not MonitorStates.UPDATING:
             self.brothers_dict.clear()
 
         self.glob.monitor_states_done = MonitorStates.UPDATING
+        self._content_changed()
         
         if client_id:
             self.brothers_dict[client_id] = jack_name
@@ -472,6 +657,8 @@ class Patcher:
             else:
                 return
             
+            self._content_changed()
+            
             # remove all saved connections from and to its client
             conns_to_unsave = list[tuple[str, str]]()
                 
@@ -493,7 +680,8 @@ class Patcher:
     def monitor_client_updated(
             self, client_id: str, jack_name: str, is_started: int):
         self.brothers_dict[client_id] = jack_name
+        self._content_changed()
 
     def session_is_loaded(self):
         self.glob.allow_disconnections = True
-        self.may_make_one_connection()
\ No newline at end of file
+        self.may_make_connections()
\ No newline at end of file
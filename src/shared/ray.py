@@ -252,6 +252,14 @@ class ScriptFile(Flag):
     CLOSE = 0x8
     
 
+class StreamRate(Enum):
+    '''rate of transport and DSP load messages
+    sent by the patchbay daemon to a GUI'''
+    OFF = 0
+    LOW = 1
+    FULL = 2
+
+
 class PreviewState(Enum):
     STARTED = 1
     NOTES = 2
@@ -0,0 +1,79 @@
+'''Memory and time used by a MegaSend containing a big patchbay graph,
+for the route really used (same process or local bulk).
+
+Compares the lazy MegaSend (tuples only, liblo Messages created only
+if needed) with the previous eager way (one tuple and one liblo
+Message created at each `add`).
+
+run with: python3 src/tests/bench_mega_send_memory.py'''
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import BunServer, MegaSend, Message, OscPack
+from osclib import bun_server
+
+N_PORTS = 20_000
+
+
+class EagerMegaSend(MegaSend):
+    'MegaSend as it was, creating a liblo Message at each add'
+    def add(self, *args):
+        super().add(*args)
+        self.eager_messages.append(Message(*args))
+
+    def __init__(self, ref: str):
+        super().__init__(ref)
+        self.eager_messages = list[Message]()
+
+
+def fill(ms: MegaSend):
+    for i in range(N_PORTS):
+        ms.add('/ray/patchbay/monitor/port_added',
+               f'client_{i // 8}:port_{i % 8}', 1, 0x02, 0x1000000000 + i)
+    for i in range(N_PORTS // 2):
+        ms.add('/ray/patchbay/monitor/connection_added',
+               f'client_{i // 8}:port_{i % 8}',
+               f'client_{i // 8 + 1}:port_{i % 8}')
+
+
+def bench(ms_class: type[MegaSend], same_process: bool) -> tuple[float, int]:
+    received = list[OscPack]()
+    sender = BunServer(total_fake=same_process)
+    receiver = BunServer(total_fake=same_process)
+    receiver.add_nice_method(
+        '/ray/patchbay/monitor/port_added', 'siih', received.append)
+    receiver.add_nice_method(
+        '/ray/patchbay/monitor/connection_added', 'ss', received.append)
+    if not same_process:
+        # act as if receiver was in another process
+        bun_server._process_channels.pop(receiver.port)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    ms = ms_class('bench')
+    fill(ms)
+    sender.mega_send(receiver.port if same_process else receiver.url, ms)
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    while receiver.recv(10):
+        pass
+    assert len(received) == len(ms)
+    return duration, peak
+
+
+if __name__ == '__main__':
+    print(f'{N_PORTS} ports and {N_PORTS // 2} connections')
+    for same_process in (True, False):
+        route = 'same process' if same_process else 'local bulk'
+        for ms_class in (EagerMegaSend, MegaSend):
+            duration, peak = bench(ms_class, same_process)
+            mode = 'eager' if ms_class is EagerMegaSend else 'lazy '
+            print(f'{route:16} {mode}: {duration * 1000:8.1f} ms, '
+                  f'peak memory {peak / 1024:9.1f} kB')
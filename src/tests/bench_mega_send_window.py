@@ -0,0 +1,94 @@
+'''Benchmark of the transfer time of a big patchbay graph
+to a remote GUI, over UDP loopback, for several mega send windows.
+
+The receiver runs in another process. It is reached at 127.0.0.2,
+a loopback address not seen as this machine, so the public `mega_send`
+takes the bundle packs route, as for a GUI on another machine.
+The median of N_RUNS sends is given for each window.
+
+run with: python3 src/tests/bench_mega_send_window.py'''
+
+import statistics
+import sys
+import time
+from multiprocessing import Process, Queue
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import BunServer, MegaSend, OscPack
+
+N_PORTS = 20_000
+WINDOWS = (1, 2, 4, 8)
+N_RUNS = 5
+
+
+def fill(ms: MegaSend):
+    for i in range(N_PORTS):
+        ms.add('/ray/patchbay/monitor/port_added',
+               f'client_{i // 8}:port_{i % 8}', 1, 0x02, 0x1000000000 + i)
+    for i in range(N_PORTS // 2):
+        ms.add('/ray/patchbay/monitor/connection_added',
+               f'client_{i // 8}:port_{i % 8}',
+               f'client_{i // 8 + 1}:port_{i % 8}')
+
+
+def receiver_process(url_queue: Queue, n_messages: int, n_rounds: int):
+    received = list[OscPack]()
+    receiver = BunServer()
+    receiver.add_nice_method(
+        '/ray/patchbay/monitor/port_added', 'siih', received.append)
+    receiver.add_nice_method(
+        '/ray/patchbay/monitor/connection_added', 'ss', received.append)
+    url_queue.put(receiver.port)
+
+    start = time.time()
+    while len(received) < n_messages * n_rounds:
+        receiver.recv(50)
+        if time.time() - start > 60.0:
+            break
+    url_queue.put(len(received))
+
+
+def new_mega_send() -> MegaSend:
+    ms = MegaSend('bench window')
+    fill(ms)
+    # create liblo messages and compute sizes before timing
+    ms.messages, ms.sizes
+    return ms
+
+
+if __name__ == '__main__':
+    ms = new_mega_send()
+
+    url_queue = Queue()
+    process = Process(
+        target=receiver_process,
+        args=(url_queue, len(ms), len(WINDOWS) * N_RUNS))
+    process.start()
+    url = f'osc.udp://127.0.0.2:{url_queue.get()}/'
+
+    sender = BunServer()
+    durations = dict[int, list[float]]()
+    for run in range(N_RUNS):
+        # windows are alternated, so they all have the same conditions
+        for window in WINDOWS:
+            # a new mega send id is needed, else the receiver
+            # ignores packs already received.
+            ms = new_mega_send()
+            sender.mega_send_window = window
+            start = time.perf_counter()
+            sender.mega_send(url, ms)
+            durations.setdefault(window, []).append(
+                time.perf_counter() - start)
+
+    for window in WINDOWS:
+        print(f'window {window}: {len(ms)} messages in '
+              f'{statistics.median(durations[window]) * 1000:8.1f} ms '
+              f'(min {min(durations[window]) * 1000:.1f} ms, '
+              f'max {max(durations[window]) * 1000:.1f} ms)')
+
+    n_received = url_queue.get()
+    process.join()
+    print(f'{n_received} messages received, '
+          f'{len(ms) * len(WINDOWS) * N_RUNS} expected')
@@ -0,0 +1,152 @@
+'''Micro benchmark of MethodsAdder.get_func, used for all messages
+delivered between BunServers of the same process.
+
+Compares the indexed dispatch with the previous implementation,
+which scanned all (types, func) pairs for the path and checked
+each argument with a `match` statement.
+
+run with: python3 src/tests/bench_methods_adder.py'''
+
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib.bases import OscArg, OscTypes, get_types_with_args
+from osclib.bun_tools import MethodsAdder
+
+
+class LegacyMethodsAdder:
+    'MethodsAdder.get_func as it was before the dispatch index'
+    def __init__(self):
+        self._dict = dict[str | None, list[tuple[str | None, Callable]]]()
+
+    def add(self, path: Optional[str], typespec: Optional[OscTypes],
+            func: Callable):
+        self._dict.setdefault(path, []).append((typespec, func))
+
+    def _get_func_in_list(
+            self, args: list[OscArg],
+            type_funcs: list[tuple[OscTypes | None, Callable]]):
+        for types, func in type_funcs:
+            if types is None:
+                return get_types_with_args(args), func
+
+            if len(types) != len(args):
+                continue
+
+            for i in range(len(types)):
+                c = types[i]
+                a = args[i]
+                if isinstance(a, tuple) and len(a) == 2:
+                    if a[0] != c:
+                        break
+
+                match c:
+                    case 'c':
+                        if not (isinstance(a, str) and len(a) == 1):
+                            break
+                    case 's'|'S':
+                        if not isinstance(a, str):
+                            break
+                    case 'f'|'d'|'t'|'I':
+                        if not isinstance(a, float):
+                            break
+                    case 'i'|'h':
+                        if not isinstance(a, int):
+                            break
+                    case 'b':
+                        if not isinstance(a, bytes):
+                            break
+                    case 'N':
+                        if a is not None:
+                            break
+                    case 'T':
+                        if a is not True:
+                            break
+                    case 'F':
+                        if a is not False:
+                            break
+                    case 'm':
+                        if not (isinstance(a, tuple)
+                                and len(a) == 4):
+                            break
+            else:
+                return types, func
+
+    def get_func(self, path: str, args: list[OscArg]):
+        type_funcs = self._dict.get(path)
+        if type_funcs is not None:
+            types_func = self._get_func_in_list(args, type_funcs)
+            if types_func is not None:
+                return types_func
+
+        none_type_funcs = self._dict.get(None)
+        if none_type_funcs is not None:
+            return self._get_func_in_list(args, none_type_funcs)
+
+
+def dummy(*args):
+    ...
+
+# methods as added by add_nice_method for the patchbay monitor paths
+METHODS: list[tuple[str, Optional[str]]] = [
+    ('/ray/patchbay/monitor/announce', 'iiiis'),
+    ('/ray/patchbay/monitor/port_added', 'siih'),
+    ('/ray/patchbay/monitor/port_removed', 's'),
+    ('/ray/patchbay/monitor/port_renamed', 'ss'),
+    ('/ray/patchbay/monitor/port_renamed', 'ssi'),
+    ('/ray/patchbay/monitor/connection_added', 'ss'),
+    ('/ray/patchbay/monitor/connection_removed', 'ss'),
+    ('/ray/patchbay/monitor/metadata_updated', 'hss'),
+    ('/ray/patchbay/monitor/big_packets', 'i'),
+    ('/ray/patchbay/group_custom_name', None),
+    ('/_bundle_head', 'hii'),
+    ('/_bundle_tail', 'hii'),
+    ('/_local_mega_send', 'hs')
+]
+
+MESSAGES: list[tuple[str, list[OscArg]]] = [
+    ('/ray/patchbay/monitor/port_added',
+     ['system:capture_1', 1, 0x02, 0x1000000000]),
+    ('/ray/patchbay/monitor/connection_added',
+     ['system:capture_1', 'Carla:audio-in1']),
+    ('/ray/patchbay/monitor/port_renamed',
+     ['Carla:out_1', 'Carla:out_L', 12]),
+    ('/ray/patchbay/monitor/metadata_updated',
+     [0x1000000000, 'http://jackaudio.org/metadata/pretty-name', 'Out']),
+    ('/ray/patchbay/group_custom_name', ['Carla', 'Carla Rack', '']),
+    ('/ray/patchbay/monitor/unknown', ['nothing']),
+]
+
+N_ROUNDS = 50_000
+
+
+def bench(adder: MethodsAdder | LegacyMethodsAdder) -> float:
+    for path, types in METHODS:
+        adder.add(path, types, dummy)
+
+    start = time.perf_counter()
+    for i in range(N_ROUNDS):
+        for path, args in MESSAGES:
+            adder.get_func(path, args)
+    duration = time.perf_counter() - start
+    return N_ROUNDS * len(MESSAGES) / duration
+
+
+if __name__ == '__main__':
+    # check both implementations find the same things
+    legacy, indexed = LegacyMethodsAdder(), MethodsAdder()
+    for path, types in METHODS:
+        legacy.add(path, types, dummy)
+        indexed.add(path, types, dummy)
+    for path, args in MESSAGES:
+        assert legacy.get_func(path, args) == indexed.get_func(path, args)
+
+    legacy_rate = bench(LegacyMethodsAdder())
+    indexed_rate = bench(MethodsAdder())
+    print(f'linear scan     : {legacy_rate:12.0f} messages/s')
+    print(f'indexed dispatch: {indexed_rate:12.0f} messages/s')
+    print(f'speedup         : {indexed_rate / legacy_rate:12.2f}x')
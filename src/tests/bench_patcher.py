@@ -0,0 +1,183 @@
+'''Benchmark of the Patcher (core of ray-jackpatch and ray-alsapatch)
+driven by a FakeEngine, without any JACK server.
+
+N_CLIENTS clients with N_PORTS outputs and N_PORTS inputs each,
+connected in a ring (session A) or to the client after the next one
+(session B). A fake NSM daemon sends open and save messages to the
+Patcher run loop, running in its own thread as in ray-jackpatch.
+
+For each step, it reports the duration, the events received
+by the patcher per second, and the peak memory (max RSS) of the process.
+
+RAY_PATCH_CONNECT_BATCH and RAY_PATCH_CONNECT_RATE
+environment variables are used as in ray-jackpatch.
+
+run with: python3 src/tests/bench_patcher.py [n_clients] [n_ports]'''
+
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import BunServer, Address
+import osc_paths
+import osc_paths.nsm as nsm
+from nsm_client import NsmServer
+from patcher.bases import EventHandler, FullPortName
+from patcher.patcher import Patcher
+from patcher.fake_engine import FakeEngine
+
+N_CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+N_PORTS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+TIMEOUT = 120.0
+
+Conns = list[tuple[FullPortName, FullPortName]]
+
+
+class FakeDaemon(BunServer):
+    '''NSM daemon, only sends requests and waits for their replies'''
+    def __init__(self):
+        super().__init__()
+        self.add_method(osc_paths.REPLY, None, self._reply)
+        self.add_method(osc_paths.ERROR, None, self._reply)
+        self._replied = set[str]()
+
+    def _reply(self, path, args, types, src_addr: Address):
+        self._replied.add(args[0])
+
+    def request(self, url: str, path: str, *args):
+        self._replied.discard(path)
+        self.send(Address(url), path, *args)
+        start = time.perf_counter()
+        while path not in self._replied:
+            self.recv(10)
+            if time.perf_counter() - start > TIMEOUT:
+                raise TimeoutError(f'no reply to {path}')
+
+
+def ring_conns(step: int) -> Conns:
+    return [(f'client_{i}:out_{k + 1}',
+             f'client_{(i + step) % N_CLIENTS}:in_{k + 1}')
+            for i in range(N_CLIENTS) for k in range(N_PORTS)]
+
+
+def wait_until(func: Callable[[], bool]):
+    start = time.perf_counter()
+    while not func():
+        if time.perf_counter() - start > TIMEOUT:
+            raise TimeoutError
+        time.sleep(0.001)
+
+
+class Bench:
+    def __init__(self):
+        self.ev_handler = EventHandler()
+        self.engine = FakeEngine(self.ev_handler)
+        for i in range(N_CLIENTS):
+            self.engine.add_client(f'client_{i}', N_PORTS, N_PORTS)
+        # ports are given by fill_ports_and_connections
+        list(self.ev_handler.new_events())
+
+        self.daemon = FakeDaemon()
+        self.nsm_server = NsmServer(Address(self.daemon.port))
+        logger = logging.getLogger('bench_patcher')
+        logger.setLevel(logging.WARNING)
+        self.patcher = Patcher(self.engine, self.nsm_server, logger)
+        self.thread = threading.Thread(
+            target=self.patcher.run_loop, args=(False,))
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir.name, name)
+
+    def step(self, name: str, func: Callable[[], None]):
+        n_events = self.ev_handler.n_received
+        n_requests = self.engine.n_connect_requests
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        n_events = self.ev_handler.n_received - n_events
+        n_requests = self.engine.n_connect_requests - n_requests
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f'{name:<36} {duration * 1000:9.1f}ms '
+              f'{n_events / duration if duration else 0.0:10.0f} events/s '
+              f'{n_requests:6} connects '
+              f'{max_rss / 1024:7.1f}MiB')
+
+    def open(self, name: str):
+        self.daemon.request(self.nsm_server.url, nsm.client.OPEN,
+                            self.path(name), 'bench', 'nFAKE')
+
+    def save(self):
+        self.daemon.request(self.nsm_server.url, nsm.client.SAVE)
+
+    def set_conns(self, conns: Conns):
+        '''replace all connections in the graph,
+        and wait for the patcher to know them.'''
+        for conn in list(self.engine.connections):
+            self.engine.remove_connection(*conn)
+        for conn in conns:
+            self.engine.add_connection(*conn)
+        self.wait_patcher(conns, exact=True)
+
+    def wait_patcher(self, conns: Conns, exact=False):
+        '''wait for the patcher to receive the events of conns'''
+        conn_list = self.patcher.connection_list
+        wait_until(lambda: (not exact or len(conn_list) == len(conns))
+                           and all(conn in conn_list for conn in conns))
+
+    def wait_conns(self, conns: Conns, exact=False):
+        if not self.engine.wait_connections(conns, TIMEOUT, exact=exact):
+            raise TimeoutError('connections not restored')
+        self.wait_patcher(conns, exact=exact)
+
+    def restart_all_clients(self, conns: Conns):
+        for i in range(N_CLIENTS):
+            self.engine.restart_client(f'client_{i}')
+        self.wait_conns(conns)
+
+    def run(self):
+        conns_a = ring_conns(1)
+        conns_b = ring_conns(2)
+        print(f'{N_CLIENTS} clients, {N_CLIENTS * N_PORTS * 2} ports, '
+              f'{len(conns_a)} connections')
+
+        self.thread.start()
+        self.step('open new session A', lambda: self.open('session_a'))
+        self.step('connection storm A',
+                  lambda: self.set_conns(conns_a))
+        self.step('save A', self.save)
+        self.step('save A unchanged', self.save)
+        self.step('open new session B', lambda: self.open('session_b'))
+        self.step('connection storm B',
+                  lambda: self.set_conns(conns_b))
+        self.step('save B', self.save)
+
+        def switch(name: str, conns: Conns):
+            self.open(name)
+            self.wait_conns(conns, exact=True)
+
+        self.step('switch to A, fully connected',
+                  lambda: switch('session_a', conns_a))
+        self.step('switch to B, fully connected',
+                  lambda: switch('session_b', conns_b))
+        self.step('disconnect all', lambda: self.set_conns([]))
+        self.step('reopen B, fully connected',
+                  lambda: switch('session_b', conns_b))
+        self.step('all clients restart, reconnected',
+                  lambda: self.restart_all_clients(conns_b))
+
+        self.patcher.stop()
+        self.thread.join()
+        self.tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    Bench().run()
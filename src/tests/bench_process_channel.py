@@ -0,0 +1,66 @@
+'''Benchmark of a 10k messages MegaSend between two BunServers
+of the same process (as done between the patchbay daemon and
+internal ray-jackpatch or ray-alsapatch).
+
+Compares the process channel (one enqueued batch per MegaSend)
+with the previous way, one Queue.put of an OscPack per message.
+
+run with: python3 src/tests/bench_process_channel.py'''
+
+import sys
+import time
+from pathlib import Path
+from queue import Queue
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import BunServer, MegaSend, OscPack, Address
+from osclib.bases import get_types_with_args
+
+N_MESSAGES = 10_000
+
+
+def make_mega_send() -> MegaSend:
+    ms = MegaSend('bench process channel')
+    for i in range(N_MESSAGES):
+        ms.add('/ray/patchbay/monitor/port_added',
+               f'client_{i // 8}:port_{i % 8}', 1, 0x02, 0x1000000000 + i)
+    return ms
+
+
+def bench_legacy_queue(ms: MegaSend) -> tuple[float, float]:
+    queue = Queue[OscPack]()
+    start = time.perf_counter()
+    for path, *args in ms.tuples:
+        queue.put(OscPack(path, args, get_types_with_args(args),
+                          Address(1)))
+    sent = time.perf_counter()
+    while queue.qsize():
+        queue.get()
+    return sent - start, time.perf_counter() - start
+
+
+def bench_channel(ms: MegaSend) -> tuple[float, float]:
+    received = list[OscPack]()
+    sender = BunServer(total_fake=True)
+    receiver = BunServer(total_fake=True)
+    receiver.add_nice_method(
+        '/ray/patchbay/monitor/port_added', 'siih', received.append)
+
+    start = time.perf_counter()
+    sender.mega_send(receiver.port, ms)
+    sent = time.perf_counter()
+    receiver.recv(0)
+    assert len(received) == N_MESSAGES
+    return sent - start, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    ms = make_mega_send()
+    legacy_send, legacy_total = bench_legacy_queue(ms)
+    chan_send, chan_total = bench_channel(ms)
+    print(f'{N_MESSAGES} messages')
+    print(f'Queue.put per message: send {legacy_send * 1000:8.2f} ms '
+          f'(enqueue + dequeue only: {legacy_total * 1000:8.2f} ms)')
+    print(f'process channel      : send {chan_send * 1000:8.2f} ms '
+          f'(send + full dispatch : {chan_total * 1000:8.2f} ms)')
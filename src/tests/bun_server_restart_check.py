@@ -0,0 +1,88 @@
+'''Check that BunServerThreads can be started again after stop,
+and that start, stop and free do not leak file descriptors
+(pipes of the process channels).
+
+run with: python3 src/tests/bun_server_restart_check.py'''
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import BunServer, BunServerThread
+
+N_CYCLES = 50
+
+
+def n_fds() -> int:
+    return len(os.listdir('/proc/self/fd'))
+
+
+def check_restart(total_fake: bool) -> bool:
+    received = list[int]()
+    server = BunServerThread(total_fake=total_fake)
+    server.add_method('/test/num', 'i',
+                      lambda path, args: received.append(args[0]))
+    sender = BunServer(total_fake=total_fake)
+
+    ok = True
+    for num in range(3):
+        server.start()
+        if not server._thread or not server._thread.is_alive():
+            print(f'FAIL thread not alive after start {num + 1}')
+            ok = False
+        sender.send(server.port, '/test/num', num)
+        for _ in range(100):
+            if len(received) > num:
+                break
+            time.sleep(0.01)
+        server.stop()
+
+    if received != [0, 1, 2]:
+        print(f'FAIL received {received} instead of [0, 1, 2]')
+        ok = False
+
+    sender.free()
+    server.free()
+    return ok
+
+
+def check_fake_recv() -> bool:
+    server = BunServer(total_fake=True)
+    start = time.monotonic()
+    server.recv(None)
+    server.free()
+    if time.monotonic() - start > 0.5:
+        print('FAIL recv(None) waited without OSC port')
+        return False
+    return True
+
+
+def check_fd_leak() -> bool:
+    n_fds_start = n_fds()
+    for _ in range(N_CYCLES):
+        server = BunServerThread()
+        server.start()
+        server.stop()
+        server.start()
+        server.stop()
+        server.free()
+
+    leaked = n_fds() - n_fds_start
+    if leaked:
+        print(f'FAIL {leaked} fds leaked by {N_CYCLES} servers')
+        return False
+    return True
+
+
+def main() -> int:
+    results = [check_restart(False), check_restart(True),
+               check_fake_recv(), check_fd_leak()]
+    print(f'{sum(results)}/{len(results)} checks passed')
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
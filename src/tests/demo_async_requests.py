@@ -0,0 +1,87 @@
+'''Demo of AsyncBunServer.request, many concurrent requests
+to a fake daemon, on one socket.
+
+The daemon is a BunServerThread replying to '/test/echo' at once,
+to '/test/slow' after 100ms, and with an /error to '/test/fail'.
+A reply only contains the path of its request, so replies
+to a same path are matched in sending order.
+
+run with: python3 src/tests/demo_async_requests.py'''
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import BunServerThread, Address
+from osclib.async_bun_server import AsyncBunServer, OscRequestError
+
+
+N_REQUESTS = 200
+
+
+class FakeDaemon(BunServerThread):
+    def __init__(self):
+        super().__init__()
+        self.add_method('/test/echo', 'i', self._echo)
+        self.add_method('/test/slow', 'i', self._slow)
+        self.add_method('/test/fail', '', self._fail)
+        self.add_method('/test/list', '', self._list)
+
+    def _echo(self, path, args, types, src_addr: Address):
+        self.send(src_addr, '/reply', path, args[0])
+
+    def _slow(self, path, args, types, src_addr: Address):
+        threading.Timer(
+            0.100, self.send, (src_addr, '/reply', path, args[0])).start()
+
+    def _fail(self, path, args, types, src_addr: Address):
+        self.send(src_addr, '/error', path, -1, 'it failed')
+
+    def _list(self, path, args, types, src_addr: Address):
+        self.send(src_addr, '/reply', path, 'a', 'b')
+        self.send(src_addr, '/reply', path, 'c')
+        self.send(src_addr, '/reply', path)
+
+
+async def main(daemon_url: str):
+    server = AsyncBunServer()
+    server.attach()
+
+    start = time.perf_counter()
+    slow = asyncio.ensure_future(
+        server.request(daemon_url, '/test/slow', -1))
+    results = await asyncio.gather(
+        *[server.request(daemon_url, '/test/echo', i)
+          for i in range(N_REQUESTS)])
+    duration = time.perf_counter() - start
+    assert results == [[i] for i in range(N_REQUESTS)]
+    print(f'{N_REQUESTS} concurrent requests replied in {duration:.3f}s, '
+          f'slow request done: {slow.done()}')
+    print('slow reply:', await slow)
+
+    try:
+        await server.request(daemon_url, '/test/fail')
+    except OscRequestError as e:
+        print(f'error raised: {e}')
+
+    print('list reply:', await server.request_list(daemon_url, '/test/list'))
+
+    try:
+        await server.request(daemon_url, '/test/nothing', timeout=0.2)
+    except asyncio.TimeoutError:
+        print('no reply, timeout raised')
+
+    server.detach()
+
+
+if __name__ == '__main__':
+    daemon = FakeDaemon()
+    daemon.start()
+    try:
+        asyncio.run(main(daemon.url))
+    finally:
+        daemon.stop()
@@ -0,0 +1,55 @@
+'''Check osc_message_size against the real size of messages
+encoded by liblo, received on a raw UDP socket.
+
+run with: python3 src/tests/osc_message_size_check.py'''
+
+import socket
+import sys
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parents[1] / 'shared'))
+
+from osclib import Address, send
+from osclib.bases import osc_message_size
+
+
+MESSAGES = [
+    ('/a',),
+    ('/ray/patchbay/monitor/port_added',
+     'client:port_1', 1, 0x02, 0x1000000000),
+    ('/a', 'xyz', 3, 2.5, ('h', 3), True, False, None),
+    ('/a', 'été', ''),
+    ('/a', ('m', (1, 2, 3, 4))),
+    ('/a', b'abc'),
+    ('/a', b'abcd'),
+    ('/a', [1, 2, 3]),
+    ('/a', ('b', b'abc')),
+    ('/a', ('b', b'abcd')),
+    ('/a', ('b', b'abcde')),
+    ('/a', ('b', [1, 2, 3, 4, 5])),
+    ('/a', 'x', ('b', bytes(1000)), 4),
+]
+
+
+def main() -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    addr = Address('127.0.0.1', sock.getsockname()[1])
+
+    failures = 0
+    for message in MESSAGES:
+        send(addr, *message)
+        real_size = len(sock.recv(65536))
+        size = osc_message_size(message)
+        if size != real_size:
+            failures += 1
+            print(f'FAIL {message!r:.60}: {size} instead of {real_size}')
+
+    sock.close()
+    print(f'{len(MESSAGES) - failures}/{len(MESSAGES)} sizes are right')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())